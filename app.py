@@ -1,16 +1,36 @@
 import os
+import time
+import asyncio
 import uvicorn
 from pathlib import Path
-from typing import Optional
+from typing import List, Optional
 from config import get_settings
 from pydantic import BaseModel, Field
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import FileResponse
+from fastapi import FastAPI, HTTPException, Request
+from contextlib import asynccontextmanager, nullcontext
+from fastapi.responses import FileResponse, PlainTextResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
+from src.jobs import JobQueue
+from src.db import create_db_engine
+from src.dataset_store import DatasetStore
+from src.tracing import Tracer
+from src.metrics import REGISTRY, CONTENT_TYPE, HTTP_REQUESTS, HTTP_REQUEST_SECONDS
+from src.schema import SolutionTask
 from src.sandbox import MathForge, MCQType, DifficultyLevel
-from src.llm_connector import GoogleConfig, AnthropicConfig, GroqConfig, OpenAIConfig, TogetherConfig
 
-app = FastAPI(title="Synth Math Question Generator API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await math_forge.start()
+    if dataset_store is not None:
+        await dataset_store.start()
+    await job_queue.start()
+    yield
+    await job_queue.close()
+    if dataset_store is not None:
+        await dataset_store.close()
+    math_forge.close()
+
+app = FastAPI(title="Synth Math Question Generator API", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -20,32 +40,47 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+UNTRACED_PATHS = {"/health", "/metrics"}
+
+@app.middleware("http")
+async def observe_request(request: Request, call_next):
+    # Streaming responses are timed and traced up to their first byte.
+    started = time.perf_counter()
+    traced = (
+        tracer is not None and request.url.path not in UNTRACED_PATHS
+        and not request.url.path.startswith("/debug/")
+    )
+    with tracer.trace(f"{request.method} {request.url.path}") if traced else nullcontext() as trace:
+        response = await call_next(request)
+        if trace is not None:
+            trace.root.set(status=response.status_code)
+            response.headers["X-Trace-Id"] = trace.trace_id
+    route = request.scope.get("route")
+    path = route.path if route is not None else "unmatched"
+    HTTP_REQUESTS.labels(request.method, path, str(response.status_code)).inc()
+    HTTP_REQUEST_SECONDS.labels(request.method, path).observe(time.perf_counter() - started)
+    return response
+
 # Initialize settings and MathU instance
 settings = get_settings()
-math_forge = MathForge(
-    max_tokens=settings.max_tokens,
-    temperature=settings.temperature,
-    anthropic=AnthropicConfig(
-        api_key=settings.anthropic_api_key, 
-        model=settings.anthropic_primary_model
-    ),
-    google=GoogleConfig(
-        api_key=settings.google_api_key,
-        model=settings.google_primary_model
-    ),
-    together=TogetherConfig(
-        api_key=settings.together_api_key,
-        model=settings.together_primary_model
-    ),
-    openai=OpenAIConfig(
-        api_key=settings.openai_api_key,
-        model=settings.openai_primary_model
-    ),
-    groq=GroqConfig(
-        api_key=settings.groq_api_key,
-        model=settings.groq_primary_model
-    ),
-    provider_priority=settings.provider_priority
+engine = create_db_engine(settings.database_url)
+tracer = Tracer(
+    capacity=settings.trace_buffer_size,
+    sample_rate=settings.trace_sample_rate,
+    slowest_fraction=settings.trace_slowest_fraction,
+    path=settings.trace_file_path,
+) if settings.tracing_enabled else None
+dataset_store = DatasetStore(
+    engine=engine,
+    batch_size=settings.dataset_batch_size,
+    flush_interval=settings.dataset_flush_interval,
+) if settings.dataset_store_enabled else None
+math_forge = MathForge.from_settings(settings, dataset_store=dataset_store)
+job_queue = JobQueue(
+    math_forge=math_forge,
+    engine=engine,
+    concurrency=settings.job_concurrency,
+    lease_seconds=settings.job_lease_seconds,
 )
 
 class SolutionRequest(BaseModel):
@@ -73,6 +108,21 @@ class SolutionRequest(BaseModel):
         description="Enable by setting True to add a solution code verification layer",
         example=False
     )
+    topic: Optional[str] = Field(
+        default=None,
+        description="Topic the question belongs to, recorded with the solution in the dataset store",
+        example="Trigonometry"
+    )
+    difficulty_level: Optional[DifficultyLevel] = Field(
+        default=None,
+        description="Difficulty level of the question, recorded with the solution in the dataset store",
+        example=DifficultyLevel.EASY
+    )
+    use_cache: bool = Field(
+        default=True,
+        description="Serve LLM responses and execution results from the cache when the same request was made before. Set False for a fresh generation",
+        example=True
+    )
 
     model_config = {
         "json_schema_extra": {
@@ -102,6 +152,60 @@ class SolutionRequest(BaseModel):
         }
     }
 
+class BatchSolutionRequest(BaseModel):
+    questions: List[SolutionTask] = Field(
+        ...,
+        description="The questions to be solved, each with its own `mcq_type`",
+    )
+    temperature: Optional[float] = Field(
+        default=None,
+        description="Temperature parameter for LLM generation (0.2 to 1.0)",
+        example=0.3,
+    )
+    provider: Optional[str] = Field(
+        default=None,
+        description="LLM provider to use (`google`, `anthropic`, or `together`)",
+        example="google"
+    )
+    verify_solution: bool = Field(
+        default=False,
+        description="Enable by setting True to add a solution code verification layer",
+        example=False
+    )
+    max_concurrency: Optional[int] = Field(
+        default=None,
+        description="Maximum number of questions solved at the same time. Defaults to the server setting",
+        example=8
+    )
+    use_cache: bool = Field(
+        default=True,
+        description="Serve LLM responses and execution results from the cache when the same request was made before. Set False for a fresh generation",
+        example=True
+    )
+
+    model_config = {
+        "json_schema_extra": {
+            "examples": [
+                {
+                    "questions": [
+                        {
+                            "question": "A ladder 10 meters long rests against a vertical wall. The foot of the ladder is 6 meters from the wall. Find the height reached by the ladder on the wall.",
+                            "mcq_type": "numerical"
+                        },
+                        {
+                            "question": "If the distance between points A(3, 4) and B(6, 8) is 5 units, determine if this statement is true or false.",
+                            "mcq_type": "statement"
+                        }
+                    ],
+                    "temperature": 0.3,
+                    "provider": "google",
+                    "verify_solution": False,
+                    "max_concurrency": 8
+                }
+            ]
+        }
+    }
+
 class QuestionsRequest(BaseModel):
     tagname: str = Field(
         ...,
@@ -115,6 +219,7 @@ class QuestionsRequest(BaseModel):
     )
     num_questions: int = Field(
         default=30,
+        ge=1,
         description="Number of questions to be generated",
         example=30
     )
@@ -138,6 +243,16 @@ class QuestionsRequest(BaseModel):
         description="LLM provider to use (`google`, `anthropic`, or `together`)",
         example="google"
     )
+    parallel: bool = Field(
+        default=False,
+        description="Generate the questions as concurrent sub-batches spread across providers instead of one growing conversation",
+        example=False
+    )
+    use_cache: bool = Field(
+        default=True,
+        description="Serve LLM responses from the cache when the same request was made before. Set False for a fresh generation",
+        example=True
+    )
 
     model_config = {
         "json_schema_extra": {
@@ -176,6 +291,11 @@ class MultiLevelQuestionsRequest(BaseModel):
         description="LLM provider to use (`google`, `anthropic`, or `together`)",
         example="google"
     )
+    use_cache: bool = Field(
+        default=True,
+        description="Serve LLM responses from the cache when the same request was made before. Set False for a fresh generation",
+        example=True
+    )
 
     model_config = {
         "json_schema_extra": {
@@ -205,12 +325,47 @@ async def solve_question(request: SolutionRequest):
             mcq_type=request.mcq_type,
             provider=request.provider,
             temperature=request.temperature,
-            verify_solution=request.verify_solution
+            verify_solution=request.verify_solution,
+            topic=request.topic,
+            difficulty_level=request.difficulty_level,
+            use_cache=request.use_cache,
         )
         return result
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/solve-question/stream")
+async def solve_question_stream(request: SolutionRequest):
+    async def stream_events():
+        async for event in math_forge.stream_solution(
+            question=request.question,
+            mcq_type=request.mcq_type,
+            provider=request.provider,
+            temperature=request.temperature,
+            verify_solution=request.verify_solution,
+            topic=request.topic,
+            difficulty_level=request.difficulty_level,
+            use_cache=request.use_cache,
+        ):
+            yield f"event: {event.event}\ndata: {event.model_dump_json()}\n\n"
+
+    return StreamingResponse(stream_events(), media_type="text/event-stream")
+
+@app.post("/solve-questions")
+async def solve_questions(request: BatchSolutionRequest):
+    async def stream_results():
+        async for result in math_forge.generate_solutions(
+            tasks=request.questions,
+            provider=request.provider,
+            temperature=request.temperature,
+            verify_solution=request.verify_solution,
+            max_concurrency=request.max_concurrency,
+            use_cache=request.use_cache,
+        ):
+            yield result.model_dump_json() + "\n"
+
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+
 @app.post("/generate-questions")
 async def generate_questions(request: QuestionsRequest):
     try:
@@ -222,6 +377,8 @@ async def generate_questions(request: QuestionsRequest):
             description=request.description,
             num_questions=request.num_questions,
             difficulty_level=request.difficulty_level,
+            parallel=request.parallel,
+            use_cache=request.use_cache,
         )
         return result
     except Exception as e:
@@ -235,6 +392,7 @@ async def generate_multi_level_questions(request: MultiLevelQuestionsRequest):
             provider=request.provider,
             temperature=request.temperature,
             description=request.description,
+            use_cache=request.use_cache,
         )
         return result
     except Exception as e:
@@ -244,6 +402,104 @@ async def generate_multi_level_questions(request: MultiLevelQuestionsRequest):
 async def health_check():
     return {"status": "healthy"}
 
+@app.get("/metrics")
+async def metrics():
+    return Response(REGISTRY.render(), media_type=CONTENT_TYPE)
+
+@app.get("/cache-stats")
+async def cache_stats():
+    return {
+        "llm_responses": math_forge.llm.cache_stats(),
+        "executions": math_forge.execution_cache_stats(),
+        "token_usage": math_forge.llm.usage_stats(),
+    }
+
+@app.get("/usage")
+async def usage():
+    return math_forge.usage_stats()
+
+@app.post("/jobs/generate-questions")
+async def submit_generate_questions(request: QuestionsRequest):
+    return await asyncio.to_thread(job_queue.submit, "generate_questions", request.model_dump(mode="json"))
+
+@app.post("/jobs/generate-multi-level-questions")
+async def submit_generate_multi_level_questions(request: MultiLevelQuestionsRequest):
+    return await asyncio.to_thread(job_queue.submit, "generate_multi_level_questions", request.model_dump(mode="json"))
+
+@app.post("/jobs/solve-questions")
+async def submit_solve_questions(request: BatchSolutionRequest):
+    return await asyncio.to_thread(job_queue.submit, "solve_questions", request.model_dump(mode="json"))
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = await asyncio.to_thread(job_queue.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return job
+
+@app.get("/dataset/questions")
+async def sample_questions(
+    topic: Optional[str] = None,
+    difficulty_level: Optional[DifficultyLevel] = None,
+    mcq_type: Optional[MCQType] = None,
+    limit: int = 20,
+):
+    if dataset_store is None:
+        raise HTTPException(status_code=404, detail="Dataset store is disabled")
+    return await asyncio.to_thread(
+        dataset_store.sample_questions,
+        topic=topic,
+        difficulty_level=difficulty_level.value if difficulty_level else None,
+        mcq_type=mcq_type.value if mcq_type else None,
+        limit=limit,
+    )
+
+@app.get("/dataset/solutions")
+async def sample_solutions(
+    topic: Optional[str] = None,
+    difficulty_level: Optional[DifficultyLevel] = None,
+    mcq_type: Optional[MCQType] = None,
+    limit: int = 20,
+):
+    if dataset_store is None:
+        raise HTTPException(status_code=404, detail="Dataset store is disabled")
+    return await asyncio.to_thread(
+        dataset_store.sample_solutions,
+        topic=topic,
+        difficulty_level=difficulty_level.value if difficulty_level else None,
+        mcq_type=mcq_type.value if mcq_type else None,
+        limit=limit,
+    )
+
+@app.get("/dataset/stats")
+async def dataset_stats():
+    if dataset_store is None:
+        raise HTTPException(status_code=404, detail="Dataset store is disabled")
+    return await asyncio.to_thread(dataset_store.stats)
+
+@app.get("/debug/traces")
+async def list_traces(limit: int = 50):
+    if tracer is None:
+        raise HTTPException(status_code=404, detail="Tracing is disabled")
+    return tracer.recent(limit)
+
+@app.get("/debug/traces/{trace_id}")
+async def get_trace(trace_id: str, format: str = "text"):
+    trace = tracer.get(trace_id) if tracer is not None else None
+    if trace is None:
+        raise HTTPException(status_code=404, detail=f"Trace {trace_id} not found")
+    if format == "json":
+        return trace.to_dict()
+    return PlainTextResponse(trace.waterfall())
+
+@app.get("/provider-health")
+async def provider_health():
+    return math_forge.llm.health_stats()
+
+@app.get("/rate-limits")
+async def rate_limits():
+    return {**math_forge.llm.rate_limit_stats(), "hedging": math_forge.llm.hedge_stats()}
+
 if __name__ == "__main__":
     uvicorn.run(
         "app:app",
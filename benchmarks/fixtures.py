@@ -0,0 +1,137 @@
+"""
+Fixed LLM outputs for the benchmarks, one per pipeline stage.
+
+The recordings are written against the current system prompts at run time
+rather than checked in, so they keep matching when a prompt is edited: the
+replay provider falls back to the recording made for the same system prompt.
+"""
+from src.replay import RecordingStore
+from prompts.verifier import VERIFIER_INSTRUCTION
+from prompts.distractor import DISTRACATOR_INSTRUCTION
+from prompts.solver import SYMBOLIC_SOLVER_INSTRUCTION, STATEMENT_SOLVER_INSTRUCTION
+from prompts.questionaire import QUESTION_GENERATION_INSTRUCTION, MULTI_DIFFICULTY_QUESTION_GENERATION_INSTRUCTION
+
+
+QUESTIONS = [
+    "A ladder 10 meters long rests against a vertical wall with its foot 6 meters from the wall. How high up the wall does it reach?",
+    "Find the derivative of f(x) = x^3 sin(x) and evaluate it at x = pi/2.",
+    "Solve the quadratic equation 2x^2 - 7x + 3 = 0 for x.",
+    "A circle has equation x^2 + y^2 - 6x + 8y = 0. Determine its radius.",
+    "Compute the definite integral of e^(2x) from x = 0 to x = 1.",
+    "Find the point dividing the segment from (-7, -3) to (4, 8) internally in the ratio 4:3.",
+    "The sum of an arithmetic progression's first 20 terms is 610 and its first term is 3. Find the common difference.",
+    "Evaluate the limit of (1 - cos(3x)) / x^2 as x approaches 0.",
+    "A bag has 5 red and 7 blue balls. Two are drawn without replacement. What is the probability both are red?",
+    "Find the inverse of the matrix [[2, 1], [5, 3]].",
+]
+
+SOLVER_RESPONSE = """<thoughts>
+The ladder, the wall and the ground form a right triangle with the ladder as the
+hypotenuse, so the height follows from the Pythagorean theorem.
+</thoughts>
+
+```python
+import sympy as sp
+
+def solve_problem(ladder_length, foot_distance):
+    height = sp.sqrt(ladder_length**2 - foot_distance**2)
+    return sp.nsimplify(height)
+
+actual_params = {'ladder_length': 10, 'foot_distance': 6}
+```
+"""
+
+SYMBOLIC_SOLVER_RESPONSE = """<thoughts>
+Apply the product rule to x^3 sin(x) and keep the result symbolic.
+</thoughts>
+
+```python
+import sympy as sp
+
+def solve_problem(power):
+    x = sp.Symbol('x')
+    expression = x**power * sp.sin(x)
+    return sp.simplify(sp.diff(expression, x))
+
+actual_params = {'power': 3}
+```
+"""
+
+STATEMENT_SOLVER_RESPONSE = """<thoughts>
+The distance between A(3, 4) and B(6, 8) is sqrt(3^2 + 4^2) = 5, so the statement holds.
+</thoughts>
+
+```python
+import sympy as sp
+
+def solve_problem(a, b, claimed):
+    distance = sp.sqrt((b[0] - a[0])**2 + (b[1] - a[1])**2)
+    return "True" if sp.simplify(distance - claimed) == 0 else "False"
+
+actual_params = {'a': (3, 4), 'b': (6, 8), 'claimed': 5}
+```
+"""
+
+VERIFIER_RESPONSE = """<thoughts>
+The code models the problem correctly, uses the given values and returns an exact result.
+</thoughts>
+<need_update>False</need_update>
+"""
+
+DISTRACTOR_RESPONSE = """<thoughts>
+Common mistakes: adding instead of subtracting the squares, forgetting the square
+root, and swapping the roles of the legs.
+</thoughts>
+<options>
+    <option>2\\sqrt{34}</option>
+    <option>64</option>
+    <option>4</option>
+    <option>6</option>
+    <option>\\sqrt{136}</option>
+</options>
+"""
+
+QUESTION_RESPONSE = (
+    "<thoughts>\nCover right-triangle geometry, calculus, algebra and probability at an easy level.\n</thoughts>\n"
+    "<questions>\n" + "".join(f"    <li>{question}</li>\n" for question in QUESTIONS) + "</questions>\n"
+)
+
+MULTI_LEVEL_RESPONSE = "".join(
+    f"<{level}-questions>\n" + "".join(
+        f"    <{kind}-questions>\n" + "".join(
+            f"        <li>({level}, {kind}) {question}</li>\n" for question in QUESTIONS[index::3]
+        ) + f"    </{kind}-questions>\n"
+        for index, kind in enumerate(["numerical", "symbolic", "statement"])
+    ) + f"</{level}-questions>\n"
+    for level in ["easy", "medium", "hard"]
+)
+
+STAGE_RESPONSES = {
+    "solve": (SYMBOLIC_SOLVER_INSTRUCTION, SOLVER_RESPONSE),
+    "solve_statement": (STATEMENT_SOLVER_INSTRUCTION, STATEMENT_SOLVER_RESPONSE),
+    "verify": (VERIFIER_INSTRUCTION, VERIFIER_RESPONSE),
+    "distractors": (DISTRACATOR_INSTRUCTION, DISTRACTOR_RESPONSE),
+    "questions": (QUESTION_GENERATION_INSTRUCTION, QUESTION_RESPONSE),
+    "multi_level_questions": (MULTI_DIFFICULTY_QUESTION_GENERATION_INSTRUCTION, MULTI_LEVEL_RESPONSE),
+}
+
+
+def write_recordings(path: str) -> RecordingStore:
+    """Records one fixed response per stage to `path` and returns the store."""
+    store = RecordingStore(path)
+    for system, response in STAGE_RESPONSES.values():
+        store.record(
+            system=system,
+            messages=[{"role": "user", "content": "benchmark fixture"}],
+            response=response,
+            provider="fixture",
+            model="fixture",
+            latency=0.0,
+        )
+    return store
+
+
+if __name__ == "__main__":
+    import sys
+    store = write_recordings(sys.argv[1] if len(sys.argv) > 1 else ".cache/fixtures.jsonl")
+    print(f"Wrote {len(STAGE_RESPONSES)} fixture recordings to {store.path}")
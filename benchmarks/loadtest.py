@@ -0,0 +1,268 @@
+"""
+Open-loop HTTP load generator for the API.
+
+Requests arrive as a Poisson process whose rate follows a ramp profile,
+independently of how fast earlier requests complete, so an overloaded server
+shows up as growing latency and errors instead of a silently lower request
+rate. By default the app is loaded in-process with the replay provider
+standing in for the LLMs; `--url` targets a running server instead:
+
+    python -m benchmarks.loadtest --profile 0-20:30 20:60 --llm-latency 2.0
+    python -m benchmarks.fixtures .cache/fixtures.jsonl
+    REPLAY='{"recordings_path": ".cache/fixtures.jsonl", "latency_mean": 2.0}' uvicorn app:app --workers 4
+    python -m benchmarks.loadtest --url http://localhost:8000 --profile 50:120
+
+A profile is a list of `rate:seconds` (constant rate) or `start-end:seconds`
+(linear ramp) segments, in requests per second. The report has latency
+percentiles and a histogram per endpoint, error rates, the offered and
+achieved rates and the event-loop lag of this process (which, in-process,
+includes the app's own work).
+"""
+import os
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import statistics
+from typing import Any, Dict, List, Optional, Tuple
+import httpx
+from benchmarks import fixtures
+
+
+HISTOGRAM_BUCKETS_MS = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000]
+
+ENDPOINTS = {
+    "solve": ("POST", "/solve-question"),
+    "questions": ("POST", "/generate-questions"),
+    "health": ("GET", "/health"),
+}
+
+
+def parse_profile(segments: List[str]) -> List[Tuple[float, float, float]]:
+    """Parses `rate:seconds` and `start-end:seconds` segments into `(start_rate, end_rate, seconds)`."""
+    profile = []
+    for segment in segments:
+        rates, seconds = segment.split(":")
+        start, _, end = rates.partition("-")
+        profile.append((float(start), float(end or start), float(seconds)))
+    return profile
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        if name not in ENDPOINTS:
+            raise ValueError(f"Unknown endpoint {name}; expected one of {', '.join(ENDPOINTS)}")
+        weights[name] = float(weight or 1)
+    return weights
+
+def _percentile(values: List[float], percentile: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(percentile * len(ordered)))]
+
+
+def request_body(endpoint: str, rng: random.Random) -> Optional[dict]:
+    if endpoint == "solve":
+        return {"question": rng.choice(fixtures.QUESTIONS), "mcq_type": "numerical", "verify_solution": False}
+    if endpoint == "questions":
+        return {
+            "tagname": "Trigonometry",
+            "description": "Sine, cosine and tangent ratios in right triangles",
+            "num_questions": len(fixtures.QUESTIONS),
+        }
+    return None
+
+
+class LoadTest:
+    def __init__(
+        self,
+        client: httpx.AsyncClient,
+        profile: List[Tuple[float, float, float]],
+        mix: Dict[str, float],
+        timeout: float,
+        seed: Optional[int] = None,
+    ) -> None:
+        self.client = client
+        self.profile = profile
+        self.mix = mix
+        self.timeout = timeout
+        self.rng = random.Random(seed)
+        self.latencies: Dict[str, List[float]] = {endpoint: [] for endpoint in mix}
+        self.errors: Dict[str, Dict[str, int]] = {endpoint: {} for endpoint in mix}
+        self.sent = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.loop_lag: List[float] = []
+
+    async def _send(self, endpoint: str) -> None:
+        method, path = ENDPOINTS[endpoint]
+        body = request_body(endpoint, self.rng)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        started = time.perf_counter()
+        try:
+            response = await self.client.request(method, path, json=body, timeout=self.timeout)
+            error = None if response.status_code < 400 else str(response.status_code)
+        except httpx.TimeoutException:
+            error = "timeout"
+        except Exception as e:
+            error = type(e).__name__
+        finally:
+            self.in_flight -= 1
+        if error is None:
+            self.latencies[endpoint].append(time.perf_counter() - started)
+        else:
+            self.errors[endpoint][error] = self.errors[endpoint].get(error, 0) + 1
+
+    async def _monitor_loop_lag(self, interval: float = 0.05) -> None:
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(interval)
+            self.loop_lag.append(max(0.0, time.perf_counter() - started - interval))
+
+    async def run(self) -> Dict[str, Any]:
+        endpoints, weights = list(self.mix), list(self.mix.values())
+        tasks = set()
+        monitor = asyncio.create_task(self._monitor_loop_lag())
+        started = time.perf_counter()
+        offset = 0.0
+        try:
+            for start_rate, end_rate, seconds in self.profile:
+                elapsed = 0.0
+                while True:
+                    rate = start_rate + (end_rate - start_rate) * min(1.0, elapsed / seconds) if seconds else end_rate
+                    # Exponential inter-arrival times at the current rate; at rate 0 wait a little and re-check.
+                    gap = self.rng.expovariate(rate) if rate > 0 else 0.1
+                    elapsed += gap
+                    if elapsed >= seconds:
+                        break
+                    delay = started + offset + elapsed - time.perf_counter()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                    if rate <= 0:
+                        continue
+                    endpoint = self.rng.choices(endpoints, weights)[0]
+                    task = asyncio.create_task(self._send(endpoint))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+                    self.sent += 1
+                offset += seconds
+            load_seconds = time.perf_counter() - started
+            if tasks:
+                await asyncio.wait(tasks)
+        finally:
+            monitor.cancel()
+        return self.report(load_seconds, time.perf_counter() - started)
+
+    def report(self, load_seconds: float, total_seconds: float) -> Dict[str, Any]:
+        endpoints = {}
+        for endpoint, latencies in self.latencies.items():
+            errors = sum(self.errors[endpoint].values())
+            total = len(latencies) + errors
+            latencies_ms = [latency * 1000 for latency in latencies]
+            endpoints[endpoint] = {
+                "requests": total,
+                "ok": len(latencies),
+                "error_rate": round(errors / total, 4) if total else 0.0,
+                "errors": self.errors[endpoint],
+                "latency_ms": {
+                    "p50": _round(_percentile(latencies_ms, 0.5)),
+                    "p95": _round(_percentile(latencies_ms, 0.95)),
+                    "p99": _round(_percentile(latencies_ms, 0.99)),
+                    "max": _round(max(latencies_ms, default=None)),
+                    "mean": _round(statistics.fmean(latencies_ms) if latencies_ms else None),
+                },
+                "histogram_ms": _histogram(latencies_ms),
+            }
+        completed = sum(len(latencies) for latencies in self.latencies.values())
+        lag_ms = [lag * 1000 for lag in self.loop_lag]
+        return {
+            "requests": self.sent,
+            "load_seconds": round(load_seconds, 3),
+            "total_seconds": round(total_seconds, 3),
+            "offered_rps": round(self.sent / load_seconds, 3) if load_seconds else 0.0,
+            "achieved_rps": round(completed / total_seconds, 3) if total_seconds else 0.0,
+            "max_in_flight": self.max_in_flight,
+            "endpoints": endpoints,
+            "event_loop_lag_ms": {
+                "p50": _round(_percentile(lag_ms, 0.5)),
+                "p99": _round(_percentile(lag_ms, 0.99)),
+                "max": _round(max(lag_ms, default=None)),
+            },
+        }
+
+
+def _round(value: Optional[float]) -> Optional[float]:
+    return round(value, 3) if value is not None else None
+
+def _histogram(latencies_ms: List[float]) -> Dict[str, int]:
+    """Counts per latency bucket, keyed by the bucket's upper bound (`+Inf` for the rest)."""
+    counts = {f"<={bound}": 0 for bound in HISTOGRAM_BUCKETS_MS}
+    counts["+Inf"] = 0
+    for latency in latencies_ms:
+        bound = next((bound for bound in HISTOGRAM_BUCKETS_MS if latency <= bound), None)
+        counts[f"<={bound}" if bound is not None else "+Inf"] += 1
+    return counts
+
+
+def configure_in_process_app(args: argparse.Namespace, directory: str) -> None:
+    """Points the app's settings at the replay provider and throwaway storage; must run before `app` is imported."""
+    recordings_path = args.recordings or os.path.join(directory, "recordings.jsonl")
+    if args.recordings is None:
+        fixtures.write_recordings(recordings_path)
+    os.environ["REPLAY"] = json.dumps({
+        "recordings_path": recordings_path,
+        "latency_distribution": args.llm_latency_distribution,
+        "latency_mean": args.llm_latency,
+        "latency_stddev": args.llm_latency / 2,
+        "error_rate": args.llm_error_rate,
+        "seed": args.seed,
+    })
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(directory, 'mathforge.db')}"
+    os.environ["RESPONSE_CACHE_PATH"] = os.path.join(directory, "cache.sqlite")
+    # Cached responses and executions would turn most requests into lookups.
+    os.environ.setdefault("RESPONSE_CACHE_ENABLED", "false")
+    os.environ.setdefault("EXECUTION_CACHE_ENABLED", "false")
+    os.environ.setdefault("DATASET_STORE_ENABLED", "false")
+
+
+async def main(args: argparse.Namespace) -> Dict[str, Any]:
+    profile = parse_profile(args.profile)
+    mix = parse_mix(args.mix)
+    if args.url is not None:
+        async with httpx.AsyncClient(base_url=args.url, limits=httpx.Limits(max_connections=None)) as client:
+            return await LoadTest(client, profile, mix, args.timeout, args.seed).run()
+
+    with tempfile.TemporaryDirectory() as directory:
+        configure_in_process_app(args, directory)
+        from app import app
+        async with app.router.lifespan_context(app):
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://loadtest") as client:
+                return await LoadTest(client, profile, mix, args.timeout, args.seed).run()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Open-loop load test of the API against stubbed LLM providers.")
+    parser.add_argument("--url", default=None, help="Base URL of a running server; the app runs in-process if omitted")
+    parser.add_argument("--profile", nargs="+", default=["0-10:20", "10:40"],
+                        help="Arrival-rate segments, `rate:seconds` or `start-end:seconds`")
+    parser.add_argument("--mix", default="solve=8,questions=1,health=1", help="Relative weights of the endpoints")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Per-request timeout in seconds")
+    parser.add_argument("--llm-latency", type=float, default=1.0, help="Mean stub LLM latency in seconds (in-process)")
+    parser.add_argument("--llm-latency-distribution", default="lognormal")
+    parser.add_argument("--llm-error-rate", type=float, default=0.0)
+    parser.add_argument("--recordings", default=None, help="Replay this recording file instead of the fixtures")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="Also write the report as JSON to this file")
+    args = parser.parse_args()
+
+    report = asyncio.run(main(args))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
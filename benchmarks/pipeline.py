@@ -0,0 +1,316 @@
+"""
+Per-stage and end-to-end benchmarks of the MathForge pipeline.
+
+The LLM is the replay provider serving the fixed outputs of
+`benchmarks/fixtures.py` (or a recording file given with `--recordings`), so
+runs are offline and comparable. Results are written as JSON, to be diffed
+between commits:
+
+    python -m benchmarks.pipeline --output benchmarks/results/main.json
+    python -m benchmarks.pipeline --compare benchmarks/results/main.json
+
+Every stage reports wall time (mean/p50/p95), CPU time and the memory it
+allocates per call (tracemalloc peak, and what is still held afterwards).
+End-to-end throughput of `generate_solution` is measured at each
+`--concurrency` level.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import inspect
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+import tracemalloc
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+import sympy as sp
+from src.sandbox import MathForge
+from src.schema import MCQType, ReplayConfig
+from benchmarks import fixtures
+from prompts.solver import SYMBOLIC_SOLVER_INSTRUCTION
+from prompts.base import INPUT_TEMPLATE, DISTRACTOR_TEMPLATE, VERIFIER_TEMPLATE, QUESTION_GENERATION_TEMPLATE
+import src.utils as utils
+from src.utils import (exec_restricted, format_result, extract_from_solver, extract_from_verifier,
+extract_question, extract_multi_level_questions, extract_distractors, extract_code_snippet)
+
+
+def _percentile(values: List[float], percentile: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(percentile * len(ordered)))]
+
+def _summary(wall: List[float], cpu: List[float], peaks: List[int], retained: List[int]) -> Dict[str, Any]:
+    return {
+        "iterations": len(wall),
+        "wall_ms": {
+            "mean": round(statistics.fmean(wall) * 1000, 4),
+            "p50": round(_percentile(wall, 0.5) * 1000, 4),
+            "p95": round(_percentile(wall, 0.95) * 1000, 4),
+        },
+        "cpu_ms_mean": round(statistics.fmean(cpu) * 1000, 4),
+        "alloc_peak_kb_mean": round(statistics.fmean(peaks) / 1024, 3),
+        "alloc_retained_kb_mean": round(statistics.fmean(retained) / 1024, 3),
+    }
+
+
+async def measure(call: Callable[[], Any], iterations: int, warmup: int = 3) -> Dict[str, Any]:
+    """
+    Times `call` (sync, or returning an awaitable) `iterations` times. Memory is
+    measured in a separate, shorter pass, as tracing allocations slows every
+    call down.
+    """
+    async def run_once() -> None:
+        result = call()
+        if inspect.isawaitable(result):
+            await result
+
+    for _ in range(warmup):
+        await run_once()
+    wall, cpu = [], []
+    for _ in range(iterations):
+        wall_started, cpu_started = time.perf_counter(), time.process_time()
+        await run_once()
+        wall.append(time.perf_counter() - wall_started)
+        cpu.append(time.process_time() - cpu_started)
+
+    peaks, retained = [], []
+    tracemalloc.start()
+    try:
+        for _ in range(min(iterations, 20)):
+            tracemalloc.reset_peak()
+            before, _ = tracemalloc.get_traced_memory()
+            await run_once()
+            after, peak = tracemalloc.get_traced_memory()
+            peaks.append(peak - before)
+            retained.append(max(0, after - before))
+    finally:
+        tracemalloc.stop()
+    return _summary(wall, cpu, peaks, retained)
+
+
+def build_math_forge(args: argparse.Namespace, recordings_path: str) -> MathForge:
+    return MathForge(
+        replay=ReplayConfig(
+            recordings_path=recordings_path,
+            latency_distribution=args.llm_latency_distribution,
+            latency_mean=args.llm_latency,
+            latency_stddev=args.llm_latency / 2,
+            seed=0,
+        ),
+        provider_priority=["replay"],
+        max_concurrency=max(args.concurrency),
+        sandbox_pool_size=args.sandbox_pool_size,
+        sandbox_max_queue=max(64, 2 * max(args.concurrency)),
+    )
+
+
+async def benchmark_stages(math_forge: MathForge, iterations: int) -> Dict[str, Any]:
+    question = fixtures.QUESTIONS[0]
+    code = extract_code_snippet(fixtures.SOLVER_RESPONSE)
+    symbolic_code = extract_code_snippet(fixtures.SYMBOLIC_SOLVER_RESPONSE)
+    # The namespace sandbox workers execute solver code in.
+    namespace = vars(utils).copy()
+    x = sp.Symbol('x')
+    results = [
+        8,
+        3.14159265358,
+        sp.diff(x**3 * sp.sin(x), x),
+        sp.Matrix([[3, -1], [-5, 2]]),
+        (sp.Rational(-1, 7), sp.Rational(23, 7)),
+    ]
+
+    def format_prompts() -> None:
+        INPUT_TEMPLATE.format(question=question, output_type=MCQType.NUMERICAL)
+        DISTRACTOR_TEMPLATE.format(correct_answer="8")
+        VERIFIER_TEMPLATE.format(question=question, output_type=MCQType.NUMERICAL, code=code, answer="8")
+        QUESTION_GENERATION_TEMPLATE.format(
+            topic="Trigonometry", chapter_overview="Right triangles",
+            difficulty_level="easy", expected_answer_type=MCQType.NUMERICAL,
+        )
+
+    def llm_wait() -> Awaitable:
+        return math_forge.llm.generate(
+            system=SYMBOLIC_SOLVER_INSTRUCTION,
+            messages=[{"role": "user", "content": INPUT_TEMPLATE.format(question=question, output_type="numerical")}],
+            use_cache=False,
+        )
+
+    return {
+        "prompt_formatting": await measure(format_prompts, iterations),
+        "llm_wait": await measure(llm_wait, max(1, iterations // 10)),
+        "xml_extraction_solver": await measure(lambda: extract_from_solver(fixtures.SOLVER_RESPONSE), iterations),
+        "xml_extraction_verifier": await measure(lambda: extract_from_verifier(fixtures.VERIFIER_RESPONSE), iterations),
+        "xml_extraction_questions": await measure(lambda: extract_question(fixtures.QUESTION_RESPONSE), iterations),
+        "xml_extraction_multi_level": await measure(
+            lambda: extract_multi_level_questions(fixtures.MULTI_LEVEL_RESPONSE), max(1, iterations // 10)
+        ),
+        "exec_restricted": await measure(lambda: exec_restricted(code, namespace.copy()), iterations),
+        "exec_restricted_symbolic": await measure(lambda: exec_restricted(symbolic_code, namespace.copy()), iterations),
+        "sandbox_run": await measure(
+            lambda: math_forge.sandbox.run(code=code, timeout=math_forge.code_execution_timeout),
+            max(1, iterations // 10),
+        ),
+        "sandbox_run_symbolic": await measure(
+            lambda: math_forge.sandbox.run(code=symbolic_code, timeout=math_forge.code_execution_timeout),
+            max(1, iterations // 10),
+        ),
+        "format_result": await measure(lambda: [format_result(value) for value in results], iterations),
+        "distractor_parsing": await measure(lambda: extract_distractors(fixtures.DISTRACTOR_RESPONSE), iterations),
+    }
+
+
+async def benchmark_solutions(math_forge: MathForge, concurrency: int, solutions: int, verify: bool) -> Dict[str, Any]:
+    """Throughput and latency of `generate_solution` with `concurrency` questions in flight."""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    stage_timings: Dict[str, List[float]] = {}
+    errors = 0
+
+    async def solve(index: int) -> None:
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                output = await math_forge.generate_solution(
+                    question=fixtures.QUESTIONS[index % len(fixtures.QUESTIONS)],
+                    mcq_type=MCQType.NUMERICAL,
+                    verify_solution=verify,
+                )
+            except Exception:
+                errors += 1
+                return
+            latencies.append(time.perf_counter() - started)
+            for stage, seconds in (output.stage_timings or {}).items():
+                stage_timings.setdefault(stage, []).append(seconds)
+
+    started, cpu_started = time.perf_counter(), time.process_time()
+    await asyncio.gather(*(solve(index) for index in range(solutions)))
+    elapsed = time.perf_counter() - started
+    return {
+        "solutions": solutions,
+        "errors": errors,
+        "seconds": round(elapsed, 4),
+        "cpu_seconds": round(time.process_time() - cpu_started, 4),
+        "throughput_per_s": round(len(latencies) / elapsed, 3),
+        "latency_ms": {
+            "p50": round(_percentile(latencies, 0.5) * 1000, 3),
+            "p95": round(_percentile(latencies, 0.95) * 1000, 3),
+        } if latencies else None,
+        "stage_ms_mean": {
+            stage: round(statistics.fmean(values) * 1000, 3) for stage, values in sorted(stage_timings.items())
+        },
+    }
+
+
+async def benchmark_end_to_end(math_forge: MathForge, args: argparse.Namespace) -> Dict[str, Any]:
+    results: Dict[str, Any] = {
+        "generate_solution": {
+            str(concurrency): await benchmark_solutions(
+                math_forge, concurrency, max(args.solutions, 2 * concurrency), args.verify
+            )
+            for concurrency in args.concurrency
+        },
+    }
+    iterations = max(1, args.iterations // 20)
+    results["generate_questions"] = await measure(lambda: math_forge.generate_questions(
+        tagname="Trigonometry", description="Right triangles", num_questions=len(fixtures.QUESTIONS),
+    ), iterations, warmup=1)
+    results["generate_multi_level_questions"] = await measure(lambda: math_forge.generate_multi_level_questions(
+        tagname="Trigonometry", description="Right triangles",
+    ), iterations, warmup=1)
+    return results
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline: Dict[str, Any], current: Dict[str, Any], threshold: float) -> List[str]:
+    """Lines describing stages whose p50 wall time or end-to-end throughput moved by more than `threshold`."""
+    lines = []
+    for stage, result in current["stages"].items():
+        before = baseline.get("stages", {}).get(stage)
+        if before is None or not before["wall_ms"]["p50"]:
+            continue
+        change = result["wall_ms"]["p50"] / before["wall_ms"]["p50"] - 1
+        if abs(change) > threshold:
+            lines.append(f"{stage}: p50 {before['wall_ms']['p50']} -> {result['wall_ms']['p50']} ms ({change:+.0%})")
+    for concurrency, result in current["end_to_end"]["generate_solution"].items():
+        before = baseline.get("end_to_end", {}).get("generate_solution", {}).get(concurrency)
+        if before is None or not before["throughput_per_s"]:
+            continue
+        change = result["throughput_per_s"] / before["throughput_per_s"] - 1
+        if abs(change) > threshold:
+            lines.append(
+                f"generate_solution @ {concurrency}: {before['throughput_per_s']} -> "
+                f"{result['throughput_per_s']} solutions/s ({change:+.0%})"
+            )
+    return lines
+
+
+async def main(args: argparse.Namespace) -> Dict[str, Any]:
+    with tempfile.TemporaryDirectory() as directory:
+        recordings_path = args.recordings
+        if recordings_path is None:
+            recordings_path = os.path.join(directory, "recordings.jsonl")
+            fixtures.write_recordings(recordings_path)
+        math_forge = build_math_forge(args, recordings_path)
+        await math_forge.start()
+        try:
+            results = {
+                "meta": {
+                    "commit": _git_commit(),
+                    "timestamp": time.time(),
+                    "python": sys.version.split()[0],
+                    "platform": platform.platform(),
+                    "cpu_count": os.cpu_count(),
+                    "args": {name: value for name, value in vars(args).items() if name not in ("output", "compare")},
+                },
+                "stages": await benchmark_stages(math_forge, args.iterations),
+                "end_to_end": await benchmark_end_to_end(math_forge, args),
+            }
+        finally:
+            math_forge.close()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the MathForge pipeline against replayed LLM outputs.")
+    parser.add_argument("--output", default="benchmark-results.json", help="Where to write the JSON results")
+    parser.add_argument("--compare", default=None, help="Earlier results to compare against")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Relative change reported by --compare")
+    parser.add_argument("--iterations", type=int, default=200, help="Iterations of the cheapest stages")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 64])
+    parser.add_argument("--solutions", type=int, default=32, help="Minimum solutions per concurrency level")
+    parser.add_argument("--verify", action="store_true", help="Include the verification stage")
+    parser.add_argument("--recordings", default=None, help="Replay this recording file instead of the fixtures")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="Mean replayed LLM latency in seconds")
+    parser.add_argument("--llm-latency-distribution", default="fixed")
+    parser.add_argument("--sandbox-pool-size", type=int, default=4)
+    args = parser.parse_args()
+
+    results = asyncio.run(main(args))
+    directory = os.path.dirname(args.output)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+    for stage, result in results["stages"].items():
+        print(f"  {stage:<28} p50 {result['wall_ms']['p50']:>10} ms  cpu {result['cpu_ms_mean']:>10} ms  "
+              f"alloc {result['alloc_peak_kb_mean']:>9} KB")
+    for concurrency, result in results["end_to_end"]["generate_solution"].items():
+        print(f"  generate_solution @ {concurrency:<8} {result['throughput_per_s']:>8} solutions/s")
+
+    if args.compare:
+        with open(args.compare) as f:
+            changes = compare(json.load(f), results, args.threshold)
+        print("\n".join(changes) if changes else f"No change above {args.threshold:.0%} against {args.compare}")
@@ -0,0 +1,293 @@
+"""
+Offline bulk generation driven by a topic manifest.
+
+For every topic × difficulty level × answer type in the manifest, questions
+are generated and then solved, with at most `--unit-concurrency` units
+generating questions and `--solution-concurrency` questions being solved at a
+time. Solutions are appended to sharded JSONL files in `--output-dir`; a unit
+is checkpointed once its solutions are written, together with the questions
+that failed to solve. Re-running the same command skips completed units,
+solves only the failed questions of the others and redoes interrupted ones.
+
+    uv run bulk_gen.py manifest.json --output-dir output/bulk
+
+The manifest is JSON (or YAML, if PyYAML is installed):
+
+    {
+        "defaults": {
+            "num_questions": 10,
+            "difficulty_levels": ["easy", "medium", "hard"],
+            "mcq_types": ["numerical", "symbolic", "statement"],
+            "verify_solution": false
+        },
+        "topics": [
+            {"tagname": "Trigonometry", "description": "Sine, cosine and tangent ratios"},
+            {"tagname": "Probability", "description": "...", "num_questions": 20}
+        ]
+    }
+
+Any default (also `temperature` and `provider`) can be overridden per topic.
+"""
+import os
+import json
+import time
+import asyncio
+import hashlib
+import argparse
+from config import get_settings
+from src.db import create_db_engine
+from src.dataset_store import DatasetStore
+from typing import Dict, List, Optional
+from src.sandbox import MathForge, MCQType, DifficultyLevel
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+
+DEFAULT_UNIT = {
+    "num_questions": 10,
+    "difficulty_levels": [level.value for level in DifficultyLevel],
+    "mcq_types": [mcq_type.value for mcq_type in MCQType],
+    "verify_solution": False,
+    "temperature": 0.3,
+    "provider": None,
+}
+
+
+def load_manifest(path: str) -> List[dict]:
+    """Expands the manifest into one unit per topic, difficulty level and answer type."""
+    with open(path) as f:
+        if path.endswith((".yaml", ".yml")):
+            if yaml is None:
+                raise Exception("PyYAML is required for YAML manifests; install it or use JSON")
+            manifest = yaml.safe_load(f)
+        else:
+            manifest = json.load(f)
+
+    defaults = {**DEFAULT_UNIT, **manifest.get("defaults", {})}
+    units = []
+    for topic in manifest["topics"]:
+        topic = {**defaults, **topic}
+        for difficulty_level in topic["difficulty_levels"]:
+            for mcq_type in topic["mcq_types"]:
+                units.append({
+                    "id": f"{topic['tagname']}|{difficulty_level}|{mcq_type}",
+                    "tagname": topic["tagname"],
+                    "description": topic["description"],
+                    "difficulty_level": DifficultyLevel(difficulty_level).value,
+                    "mcq_type": MCQType(mcq_type).value,
+                    "num_questions": topic["num_questions"],
+                    "verify_solution": topic["verify_solution"],
+                    "temperature": topic["temperature"],
+                    "provider": topic["provider"],
+                })
+    return units
+
+
+class BulkRun:
+    """
+    Runs the units of a manifest, writing sharded JSONL output and a
+    checkpoint file to `output_dir`.
+    """
+    def __init__(
+        self,
+        math_forge: MathForge,
+        output_dir: str,
+        num_shards: int = 16,
+        unit_concurrency: int = 4,
+        solution_concurrency: int = 8,
+        progress_interval: float = 10.0,
+    ) -> None:
+        self.math_forge = math_forge
+        self.output_dir = output_dir
+        self.num_shards = num_shards
+        self.unit_concurrency = unit_concurrency
+        self.solution_semaphore = asyncio.Semaphore(solution_concurrency)
+        self.progress_interval = progress_interval
+        self.checkpoint_path = os.path.join(output_dir, "checkpoint.jsonl")
+        self.total_units = 0
+        self.units_done = 0
+        self.units_failed = 0
+        self.questions = 0
+        self.solutions = 0
+        self.solutions_failed = 0
+        self.started_at = time.time()
+
+    def checkpointed_units(self) -> Dict[str, List[str]]:
+        """Maps every checkpointed unit to the questions it still has to solve; none if it is complete."""
+        if not os.path.exists(self.checkpoint_path):
+            return {}
+        checkpointed = {}
+        with open(self.checkpoint_path) as f:
+            for line in f:
+                try:
+                    checkpoint = json.loads(line)
+                    # A later checkpoint of the same unit is a rerun of its failed questions.
+                    checkpointed[checkpoint["unit"]] = checkpoint.get("failed_questions", [])
+                except (json.JSONDecodeError, KeyError):
+                    # A checkpoint cut off by a crash; that unit is simply redone.
+                    continue
+        return checkpointed
+
+    def shard_path(self, unit_id: str) -> str:
+        shard = int(hashlib.md5(unit_id.encode()).hexdigest(), 16) % self.num_shards
+        return os.path.join(self.output_dir, f"shard-{shard:04d}.jsonl")
+
+    def _append(self, path: str, lines: List[str]) -> None:
+        with open(path, "a") as f:
+            f.write("".join(line + "\n" for line in lines))
+            f.flush()
+            os.fsync(f.fileno())
+
+    async def run(self, units: List[dict]) -> None:
+        os.makedirs(self.output_dir, exist_ok=True)
+        checkpointed = self.checkpointed_units()
+        pending = [unit for unit in units if checkpointed.get(unit["id"]) != []]
+        self.total_units = len(pending)
+        print(f"{len(units)} units in manifest, {len(units) - len(pending)} already completed, {len(pending)} to run")
+
+        unit_semaphore = asyncio.Semaphore(self.unit_concurrency)
+
+        async def run_unit(unit: dict) -> None:
+            try:
+                await self.run_unit(unit, unit_semaphore, checkpointed.get(unit["id"]))
+                self.units_done += 1
+            except Exception as e:
+                self.units_failed += 1
+                print(f"Unit {unit['id']} failed, it will be retried on the next run: {str(e)}")
+
+        reporter = asyncio.create_task(self._report_progress())
+        try:
+            await asyncio.gather(*(run_unit(unit) for unit in pending))
+        finally:
+            reporter.cancel()
+            self.print_progress()
+
+    async def run_unit(
+        self, unit: dict, unit_semaphore: asyncio.Semaphore, questions: Optional[List[str]] = None,
+    ) -> None:
+        """
+        Generates and solves the questions of `unit`, or only solves `questions`, the
+        failed questions of an earlier run. Raises if any question fails to solve.
+        """
+        if questions is None:
+            # Only question generation holds a unit slot, so the next units' questions
+            # are generated while the solutions of earlier ones are still running.
+            async with unit_semaphore:
+                question_bank = await self.math_forge.generate_questions(
+                    tagname=unit["tagname"],
+                    description=unit["description"],
+                    num_questions=unit["num_questions"],
+                    temperature=unit["temperature"],
+                    mcq_type=unit["mcq_type"],
+                    difficulty_level=unit["difficulty_level"],
+                    provider=unit["provider"],
+                    parallel=True,
+                )
+            questions = question_bank.questions
+            self.questions += len(questions)
+
+        async def solve(question: str) -> dict:
+            record = {
+                "unit": unit["id"],
+                "topic": unit["tagname"],
+                "difficulty_level": unit["difficulty_level"],
+                "mcq_type": unit["mcq_type"],
+                "question": question,
+                "output": None,
+                "error": None,
+            }
+            async with self.solution_semaphore:
+                try:
+                    output = await self.math_forge.generate_solution(
+                        question=question,
+                        mcq_type=MCQType(unit["mcq_type"]),
+                        temperature=unit["temperature"],
+                        verify_solution=unit["verify_solution"],
+                        provider=unit["provider"],
+                        topic=unit["tagname"],
+                        difficulty_level=unit["difficulty_level"],
+                    )
+                    record["output"] = output.model_dump()
+                    self.solutions += 1
+                except Exception as e:
+                    record["error"] = str(e)
+                    self.solutions_failed += 1
+            return record
+
+        records = await asyncio.gather(*(solve(question) for question in questions))
+        solved = [record for record in records if record["error"] is None]
+        failed = [record for record in records if record["error"] is not None]
+        # The unit's solutions are written in one go before it is checkpointed,
+        # so an interrupted unit leaves nothing behind that a rerun would duplicate.
+        # Failed questions are only kept in the checkpoint, to be solved again.
+        if solved:
+            self._append(self.shard_path(unit["id"]), [json.dumps(record) for record in solved])
+        self._append(self.checkpoint_path, [json.dumps({
+            "unit": unit["id"],
+            "questions": len(records),
+            "failed_questions": [record["question"] for record in failed],
+            "completed_at": time.time(),
+        })])
+        if failed:
+            raise RuntimeError(f"{len(failed)} of {len(records)} questions failed to solve, e.g.: {failed[0]['error']}")
+
+    async def _report_progress(self) -> None:
+        while True:
+            await asyncio.sleep(self.progress_interval)
+            self.print_progress()
+
+    def print_progress(self) -> None:
+        elapsed = time.time() - self.started_at
+        finished = self.units_done + self.units_failed
+        eta = "-"
+        if self.units_done:
+            remaining = (self.total_units - finished) * elapsed / finished
+            eta = time.strftime("%H:%M:%S", time.gmtime(remaining))
+        print(
+            f"[{time.strftime('%H:%M:%S', time.gmtime(elapsed))}] "
+            f"units {self.units_done}/{self.total_units} ({self.units_failed} failed) | "
+            f"questions {self.questions} | solutions {self.solutions} ({self.solutions_failed} failed) | "
+            f"{self.solutions / max(elapsed, 1e-9):.2f} solutions/s | ETA {eta}",
+            flush=True,
+        )
+
+
+async def main(args: argparse.Namespace) -> None:
+    settings = get_settings()
+    units = load_manifest(args.manifest)
+    dataset_store = DatasetStore(
+        engine=create_db_engine(settings.database_url),
+        batch_size=settings.dataset_batch_size,
+        flush_interval=settings.dataset_flush_interval,
+    ) if settings.dataset_store_enabled else None
+    math_forge = MathForge.from_settings(settings, dataset_store=dataset_store)
+    await math_forge.start()
+    if dataset_store is not None:
+        await dataset_store.start()
+    try:
+        await BulkRun(
+            math_forge=math_forge,
+            output_dir=args.output_dir,
+            num_shards=args.shards,
+            unit_concurrency=args.unit_concurrency,
+            solution_concurrency=args.solution_concurrency or settings.solution_concurrency,
+            progress_interval=args.progress_interval,
+        ).run(units)
+    finally:
+        if dataset_store is not None:
+            await dataset_store.close()
+        math_forge.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate and solve questions for every topic of a manifest.")
+    parser.add_argument("manifest", help="JSON or YAML manifest of topics")
+    parser.add_argument("--output-dir", default="output/bulk", help="Directory for the JSONL shards and the checkpoint")
+    parser.add_argument("--shards", type=int, default=16, help="Number of JSONL shards")
+    parser.add_argument("--unit-concurrency", type=int, default=4, help="Units generating questions at the same time")
+    parser.add_argument("--solution-concurrency", type=int, default=None, help="Questions solved at the same time")
+    parser.add_argument("--progress-interval", type=float, default=10.0, help="Seconds between progress lines")
+    asyncio.run(main(parser.parse_args()))
@@ -1,5 +1,5 @@
 import threading
-import dotenv, os, time
+import dotenv, os, time, json
 from typing import Optional
 from dotenv import load_dotenv
 
@@ -7,10 +7,33 @@ load_dotenv()
 
 class Settings:
     max_tokens: int = 5049
+    # Per-stage output budgets overriding the defaults in src/sandbox.py, e.g. {"distractors": 512, "solve": 2048}
+    stage_max_tokens: dict = json.loads(os.getenv("STAGE_MAX_TOKENS", "{}"))
+    # Cut each stage's response off as soon as everything it needs has been generated
+    early_stop: bool = os.getenv("EARLY_STOP", "true").lower() == "true"
     temperature: float = 0.3
     code_execution_timeout: int = 5
+    solution_concurrency: int = 8
+    # Drop generated questions that are near-duplicates (MinHash/LSH) rather than only exact repeats;
+    # with number normalisation, questions differing only in their numbers also count as duplicates
+    near_duplicate_dedup: bool = os.getenv("NEAR_DUPLICATE_DEDUP", "false").lower() == "true"
+    dedup_normalize_numbers: bool = os.getenv("DEDUP_NORMALIZE_NUMBERS", "false").lower() == "true"
+    job_concurrency: int = 2
+    # A running job whose worker has not renewed its lease for this long is taken over by another worker
+    job_lease_seconds: float = 60
+    sandbox_pool_size: int = 4
+    sandbox_max_queue: int = 64
+    sandbox_cpu_time_limit: int = 10
+    sandbox_memory_limit_mb: int = 1024
+    sandbox_warm_workers: bool = True
+    sandbox_max_jobs_per_worker: int = 200
     
-    database_url: Optional[str] = os.getenv("DATABASE_URL")
+    # Stores background jobs and the generated dataset; any SQLAlchemy URL with a synchronous driver
+    database_url: str = os.getenv("DATABASE_URL", "sqlite:///.cache/mathforge.db")
+    # Keep every generated question and solution, written in batches in the background
+    dataset_store_enabled: bool = os.getenv("DATASET_STORE_ENABLED", "true").lower() == "true"
+    dataset_batch_size: int = 200
+    dataset_flush_interval: float = 1.0
     google_api_key: Optional[str] = os.getenv("GOOGLE_API")
     together_api_key: Optional[str] = os.getenv("TOGETHER_API")
     anthropic_api_key: Optional[str] = os.getenv("ANTHROPIC_API")
@@ -29,6 +52,50 @@ class Settings:
     
     
     provider_priority: Optional[list] = ["google", "anthropic", "together", "groq", "mistral"]
+    # Serve every request from recorded responses instead of the live APIs, e.g.
+    # {"recordings_path": ".cache/recordings.jsonl", "latency_mean": 0.5, "error_rate": 0.05}
+    replay: Optional[dict] = json.loads(os.getenv("REPLAY", "null"))
+    # Append every live response to this JSONL file, to be replayed later
+    record_responses_path: Optional[str] = os.getenv("RECORD_RESPONSES_PATH")
+    
+    anthropic_prompt_cache: bool = True
+    
+    # USD per million tokens of each provider's model, e.g. {"anthropic": {"input": 3.0, "output": 15.0, "cache_read": 0.3}}
+    provider_pricing: dict = json.loads(os.getenv("PROVIDER_PRICING", "{}"))
+    # Send each stage to the cheapest provider meeting its latency SLO, e.g. {"stage_latency_slo": {"distractors": 5.0}}
+    cost_routing: Optional[dict] = json.loads(os.getenv("COST_ROUTING", "null"))
+    
+    # Per-provider limits, e.g. {"groq": {"requests_per_minute": 30, "tokens_per_minute": 6000, "max_concurrency": 4}}
+    provider_rate_limits: dict = json.loads(os.getenv("PROVIDER_RATE_LIMITS", "{}"))
+    # Set to share rate-limit budgets between processes (e.g. uvicorn workers) through SQLite
+    rate_limit_state_path: Optional[str] = os.getenv("RATE_LIMIT_STATE_PATH")
+    # Off by default: a cached response is returned for every identical call, even when sampling at temperature > 0
+    response_cache_enabled: bool = os.getenv("RESPONSE_CACHE_ENABLED", "false").lower() == "true"
+    response_cache_path: Optional[str] = os.getenv("RESPONSE_CACHE_PATH", ".cache/mathforge.sqlite")
+    response_cache_max_entries: int = 2048
+    response_cache_ttl: Optional[int] = 7 * 24 * 3600
+    # Sandbox results keyed by the normalised AST of the solution code, stored in the same SQLite file
+    execution_cache_enabled: bool = os.getenv("EXECUTION_CACHE_ENABLED", "true").lower() == "true"
+    execution_cache_max_entries: int = 4096
+    
+    # Re-send a slow request to the next provider once the primary runs past the
+    # `hedge_percentile` of its recent latencies; at most `hedge_max_ratio` of requests are duplicated
+    hedge_requests: bool = os.getenv("HEDGE_REQUESTS", "false").lower() == "true"
+    hedge_percentile: float = 0.95
+    hedge_min_delay: float = 2.0
+    hedge_max_ratio: float = float(os.getenv("HEDGE_MAX_RATIO", "0.1"))
+    
+    # Circuit breaker and retry settings shared by all providers, e.g. {"failure_rate_threshold": 0.5, "open_seconds": 30}
+    circuit_breaker: dict = json.loads(os.getenv("CIRCUIT_BREAKER", "{}"))
+    
+    # Per-request traces served on /debug/traces. Failed traces and the slowest
+    # `trace_slowest_fraction` are always kept, others with probability `trace_sample_rate`
+    tracing_enabled: bool = os.getenv("TRACING_ENABLED", "true").lower() == "true"
+    trace_sample_rate: float = float(os.getenv("TRACE_SAMPLE_RATE", "0.1"))
+    trace_slowest_fraction: float = 0.01
+    trace_buffer_size: int = 500
+    # Also append kept traces to this JSONL file, rotated at 10 MB
+    trace_file_path: Optional[str] = os.getenv("TRACE_FILE_PATH")
 
     
 _settings = None
@@ -71,3 +71,26 @@ Please generate the questions and output them in the following XML format:
 </questions>
 
 Ensure that the generated questions meaningfully expand upon and complement the existing question set while maintaining consistency in quality and relevance to the topic. The goal is to create a diverse set of "{n}" additional questions."""
+
+QUESTION_FOCUS_USER_TEMPLATE = """<topic>{topic}</topic>
+
+<chapter_overview>{chapter_overview}</chapter_overview>
+
+<difficulty_level>{difficulty_level}</difficulty_level>
+
+<expected_answer_type>{expected_answer_type}</expected_answer_type>
+
+<focus>{focus}</focus>
+
+This request is one of several batches generated independently for the same topic. To keep the batches from overlapping, generate "{n}" questions that all center on the aspect described in the <focus> tag while still meeting every other criteria. (batch seed: {seed})"""
+
+QUESTION_FOCUS_AREAS = [
+    "direct computations using the core formulas and definitions of the topic",
+    "real-world word problems and practical applications",
+    "reverse problems where an unknown parameter must be found from a given result",
+    "problems that connect this topic with closely related concepts from the curriculum",
+    "special cases, edge cases and boundary values",
+    "multi-step problems that chain several results together",
+    "comparing or relating two or more quantities",
+    "properties, identities and standard results of the topic",
+]
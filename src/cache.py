@@ -0,0 +1,160 @@
+import os
+import time
+import json
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from src.metrics import CACHE_HIT_RATIO, CACHE_LOOKUPS
+from typing import Any, Dict, List, Optional, Tuple
+
+
+def make_cache_key(**parts: Any) -> str:
+    """Content-addressed key: SHA-256 over the canonical JSON encoding of `parts`."""
+    payload = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class TieredCache:
+    """
+    A key-value cache with an in-memory LRU tier in front of an optional SQLite tier.
+
+    Values must be JSON-serializable. Entries expire after `ttl` seconds in both
+    tiers, the memory tier holds at most `max_entries` items and the disk tier is
+    trimmed to `max_disk_entries`, oldest first. Several caches can share one
+    SQLite file as long as they use different `namespace`s.
+    """
+    def __init__(
+        self,
+        namespace: str,
+        max_entries: int = 1024,
+        ttl: Optional[float] = None,
+        db_path: Optional[str] = None,
+        max_disk_entries: int = 100_000,
+    ) -> None:
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_disk_entries = max_disk_entries
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self._hit_metric = CACHE_LOOKUPS.labels(namespace, "hit")
+        self._miss_metric = CACHE_LOOKUPS.labels(namespace, "miss")
+        CACHE_HIT_RATIO.labels(namespace).set_function(self._hit_ratio)
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._writes_since_trim = 0
+        self._db: Optional[sqlite3.Connection] = None
+        if db_path:
+            directory = os.path.dirname(db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS cache_entries ("
+                "namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, "
+                "created_at REAL NOT NULL, expires_at REAL, PRIMARY KEY (namespace, key))"
+            )
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS ix_cache_entries_created_at ON cache_entries (namespace, created_at)"
+            )
+
+    def _expiry(self) -> Optional[float]:
+        return time.time() + self.ttl if self.ttl else None
+
+    def _remember(self, key: str, value: Any, expires_at: Optional[float]) -> None:
+        self._memory[key] = (value, expires_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, key: str) -> Optional[Any]:
+        return self.get_first([key])
+
+    def get_first(self, keys: List[str]) -> Optional[Any]:
+        """Returns the value of the first key present, counting a single miss if none is."""
+        found = self.find_first(keys)
+        return found[1] if found is not None else None
+
+    def find_first(self, keys: List[str]) -> Optional[Tuple[str, Any]]:
+        """Like `get_first`, but returns the key that was found along with its value."""
+        with self._lock:
+            for key in keys:
+                value = self._lookup(key)
+                if value is not None:
+                    self.hits += 1
+                    self._hit_metric.inc()
+                    return key, value
+            self.misses += 1
+            self._miss_metric.inc()
+            return None
+
+    def _lookup(self, key: str) -> Optional[Any]:
+        now = time.time()
+        entry = self._memory.get(key)
+        if entry is not None:
+            value, expires_at = entry
+            if expires_at is None or expires_at > now:
+                self._memory.move_to_end(key)
+                return value
+            del self._memory[key]
+
+        if self._db is not None:
+            row = self._db.execute(
+                "SELECT value, expires_at FROM cache_entries WHERE namespace = ? AND key = ?",
+                (self.namespace, key)
+            ).fetchone()
+            if row is not None and (row[1] is None or row[1] > now):
+                value = json.loads(row[0])
+                self._remember(key, value, row[1])
+                self.disk_hits += 1
+                return value
+        return None
+
+    def set(self, key: str, value: Any) -> None:
+        expires_at = self._expiry()
+        with self._lock:
+            self._remember(key, value, expires_at)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO cache_entries (namespace, key, value, created_at, expires_at) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (self.namespace, key, json.dumps(value), time.time(), expires_at)
+                )
+                self._writes_since_trim += 1
+                if self._writes_since_trim >= 100:
+                    self._trim_disk()
+
+    def _trim_disk(self) -> None:
+        self._writes_since_trim = 0
+        self._db.execute(
+            "DELETE FROM cache_entries WHERE namespace = ? AND expires_at IS NOT NULL AND expires_at <= ?",
+            (self.namespace, time.time())
+        )
+        self._db.execute(
+            "DELETE FROM cache_entries WHERE namespace = ? AND key IN ("
+            "SELECT key FROM cache_entries WHERE namespace = ? ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+            (self.namespace, self.namespace, self.max_disk_entries)
+        )
+
+    def clear(self) -> None:
+        with self._lock:
+            self._memory.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM cache_entries WHERE namespace = ?", (self.namespace,))
+
+    def _hit_ratio(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "disk_hits": self.disk_hits,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "memory_entries": len(self._memory),
+        }
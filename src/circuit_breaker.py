@@ -0,0 +1,137 @@
+import time
+import random
+import openai
+import anthropic
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+from src.schema import CircuitBreakerConfig, CircuitState, ProviderUnavailableException
+
+
+TRANSIENT_STATUS_CODES = {408, 409, 500, 502, 503, 504, 529}
+
+
+def is_transient_error(error: Exception) -> bool:
+    """Timeouts, dropped connections and 5xx/overloaded responses, which are worth retrying."""
+    if isinstance(error, (openai.APIConnectionError, anthropic.APIConnectionError)):
+        return True
+    return getattr(error, "status_code", None) in TRANSIENT_STATUS_CODES
+
+def is_provider_failure(error: Exception) -> bool:
+    """Whether `error` says something about the provider's health, as opposed to the request."""
+    status_code = getattr(error, "status_code", None)
+    if status_code is None or is_transient_error(error):
+        return True
+    return status_code >= 500
+
+def retry_delay(attempt: int, base_delay: float, max_delay: float) -> float:
+    """Exponential backoff with full jitter for the `attempt`-th retry (starting at 0)."""
+    return random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+
+
+class CircuitBreaker:
+    """
+    Closed/open/half-open circuit breaker for a single provider.
+
+    The breaker keeps the outcomes of the last `window_size` calls made within
+    `window_seconds`, and an EWMA of successful call latencies. Once at least
+    `min_calls` outcomes are known and the failure rate reaches
+    `failure_rate_threshold`, the circuit opens and calls are refused for
+    `open_seconds`. After that the circuit is half-open and lets
+    `half_open_max_calls` probes through: a successful probe closes it again, a
+    failed one re-opens it.
+    """
+    def __init__(self, provider: str, config: Optional[CircuitBreakerConfig] = None) -> None:
+        self.provider = provider
+        self.config = config or CircuitBreakerConfig()
+        self.state = CircuitState.CLOSED
+        self.latency_ewma: Optional[float] = None
+        self.opened_at = 0.0
+        self.trips = 0
+        self._outcomes = deque(maxlen=self.config.window_size)
+        self._probes = 0
+
+    @property
+    def failure_rate(self) -> float:
+        self._expire()
+        if not self._outcomes:
+            return 0.0
+        return sum(not ok for _, ok in self._outcomes) / len(self._outcomes)
+
+    def _expire(self) -> None:
+        # Old outcomes age out, so a provider that was demoted for its errors
+        # is tried again once they no longer describe it.
+        horizon = time.time() - self.config.window_seconds
+        while self._outcomes and self._outcomes[0][0] < horizon:
+            self._outcomes.popleft()
+
+    def _refresh(self) -> None:
+        if self.state == CircuitState.OPEN and time.time() - self.opened_at >= self.config.open_seconds:
+            self.state = CircuitState.HALF_OPEN
+            self._probes = 0
+
+    def available(self) -> bool:
+        self._refresh()
+        if self.state == CircuitState.OPEN:
+            return False
+        return self.state == CircuitState.CLOSED or self._probes < self.config.half_open_max_calls
+
+    def _open(self) -> None:
+        self.state = CircuitState.OPEN
+        self.opened_at = time.time()
+        self.trips += 1
+        self._outcomes.clear()
+
+    def _close(self) -> None:
+        self.state = CircuitState.CLOSED
+
+    def record_success(self, latency: float) -> None:
+        if self.state == CircuitState.HALF_OPEN:
+            self._close()
+        self._outcomes.append((time.time(), True))
+        alpha = self.config.latency_alpha
+        self.latency_ewma = latency if self.latency_ewma is None else alpha * latency + (1 - alpha) * self.latency_ewma
+
+    def record_failure(self) -> None:
+        if self.state == CircuitState.HALF_OPEN:
+            self._open()
+            return
+        self._outcomes.append((time.time(), False))
+        if len(self._outcomes) >= self.config.min_calls and self.failure_rate >= self.config.failure_rate_threshold:
+            self._open()
+
+    @contextmanager
+    def call(self):
+        """
+        Guards one call to the provider. Raises `ProviderUnavailableException`
+        while the circuit refuses calls, otherwise records the call's outcome.
+        """
+        if not self.available():
+            raise ProviderUnavailableException(f"Circuit for provider {self.provider} is {self.state.value}")
+        probe = self.state == CircuitState.HALF_OPEN
+        self._probes += probe
+        started = time.perf_counter()
+        try:
+            yield
+        except BaseException as e:
+            if isinstance(e, Exception) and is_provider_failure(e):
+                self.record_failure()
+            elif probe and self.state == CircuitState.HALF_OPEN:
+                # The probe ended without telling anything about the provider
+                # (cancelled, or a client-side error); let another one through.
+                self._probes -= 1
+            raise
+        self.record_success(time.perf_counter() - started)
+
+    def stats(self) -> Dict[str, Any]:
+        self._refresh()
+        failure_rate = self.failure_rate
+        return {
+            "state": self.state.value,
+            "failure_rate": round(failure_rate, 3),
+            "calls": len(self._outcomes),
+            "latency_ewma": round(self.latency_ewma, 3) if self.latency_ewma is not None else None,
+            "trips": self.trips,
+            "open_for": round(max(0.0, self.opened_at + self.config.open_seconds - time.time()), 1)
+                if self.state == CircuitState.OPEN else 0.0,
+        }
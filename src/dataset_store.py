@@ -0,0 +1,218 @@
+import json
+import asyncio
+from sqlalchemy import func, insert
+from sqlmodel import Session, SQLModel, select
+from sqlalchemy.engine import Engine
+from src.db import QuestionRecord, SolutionRecord
+from typing import Any, Dict, Iterable, List, Optional, Type
+from src.schema import FinalOutput, MultiLevelQuestionBank, QuestionBank
+
+
+def _value(field: Any) -> Any:
+    # Enum members are stored by value.
+    return getattr(field, "value", field)
+
+
+class DatasetStore:
+    """
+    Persistent store of the questions and solutions MathForge generates.
+
+    Writes are buffered in memory: the `add_*` methods only queue rows, and a
+    background task writes them with one batched insert per table every
+    `flush_interval` seconds, or sooner once `batch_size` rows are waiting. If
+    the database cannot be written, rows stay buffered and are retried; beyond
+    `max_buffer` pending rows the oldest are dropped. `close()` writes whatever
+    is left. The buffer is only touched on the event loop; flushes run one at a
+    time and hand the rows they took to a thread for the insert.
+    """
+    def __init__(
+        self,
+        engine: Engine,
+        batch_size: int = 200,
+        flush_interval: float = 1.0,
+        max_buffer: int = 10000,
+    ) -> None:
+        self.engine = engine
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self.written = 0
+        self.dropped = 0
+        self.flushes = 0
+        self._buffer: List[SQLModel] = []
+        self._flush_lock = asyncio.Lock()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._flusher: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        self._wakeup = asyncio.Event()
+        self._flusher = asyncio.create_task(self._flush_loop())
+
+    async def close(self) -> None:
+        if self._flusher is not None:
+            # Under the lock, so the flusher is never cancelled halfway through a write.
+            async with self._flush_lock:
+                self._flusher.cancel()
+                await asyncio.gather(self._flusher, return_exceptions=True)
+            self._flusher = None
+        await self.flush()
+
+    def add_questions(
+        self,
+        question_bank: QuestionBank,
+        topic: str,
+        difficulty_level: str,
+        mcq_type: str,
+        calls: Iterable[dict] = (),
+    ) -> None:
+        """Queues the questions of a bank; `calls` is the `LLMConnector.track_calls()` log that produced it."""
+        calls = list(calls)
+        providers = ",".join(sorted({call["provider"] for call in calls})) or None
+        models = ",".join(sorted({call["model"] for call in calls})) or None
+        self._add([
+            QuestionRecord(
+                topic=topic,
+                difficulty_level=_value(difficulty_level),
+                mcq_type=_value(mcq_type),
+                question=question,
+                thoughts=question_bank.thoughts,
+                providers=providers,
+                models=models,
+            )
+            for question in question_bank.questions
+        ])
+
+    def add_multi_level_questions(
+        self,
+        question_bank: MultiLevelQuestionBank,
+        topic: str,
+        calls: Iterable[dict] = (),
+    ) -> None:
+        calls = list(calls)
+        for difficulty_level, questions in (
+            ("easy", question_bank.easy_questions),
+            ("medium", question_bank.medium_questions),
+            ("hard", question_bank.hard_questions),
+        ):
+            for mcq_type, items in questions.model_dump().items():
+                self.add_questions(
+                    QuestionBank(thoughts="", questions=items),
+                    topic=topic,
+                    difficulty_level=difficulty_level,
+                    mcq_type=mcq_type,
+                    calls=calls,
+                )
+
+    def add_solution(
+        self,
+        output: FinalOutput,
+        mcq_type: str,
+        topic: Optional[str] = None,
+        difficulty_level: Optional[str] = None,
+        verified: bool = False,
+    ) -> None:
+        self._add([SolutionRecord(
+            topic=topic,
+            difficulty_level=_value(difficulty_level),
+            mcq_type=_value(mcq_type),
+            question=output.question,
+            correct_answer=str(output.correct_answer),
+            options=json.dumps([option.model_dump() for option in output.options]),
+            thoughts=output.thoughts,
+            solution_code=output.solution_code,
+            provider=output.provider,
+            model=output.model,
+            verified=verified,
+            stage_timings=json.dumps(output.stage_timings) if output.stage_timings is not None else None,
+        )])
+
+    def _add(self, rows: List[SQLModel]) -> None:
+        self._buffer.extend(rows)
+        self._trim()
+        if self._wakeup is not None and len(self._buffer) >= self.batch_size:
+            self._wakeup.set()
+
+    def _trim(self) -> None:
+        overflow = len(self._buffer) - self.max_buffer
+        if overflow > 0:
+            del self._buffer[:overflow]
+            self.dropped += overflow
+
+    async def _flush_loop(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self) -> int:
+        """Writes the buffered rows, one batched insert per table. Returns the number of rows written."""
+        async with self._flush_lock:
+            rows, self._buffer = self._buffer, []
+            if not rows:
+                return 0
+            try:
+                await asyncio.to_thread(self._insert, rows)
+            except Exception as e:
+                print(f"Dataset store flush failed, will retry: {str(e)}")
+                # Back in front of the rows added meanwhile, to keep the buffer oldest first.
+                self._buffer[:0] = rows
+                self._trim()
+                return 0
+            self.written += len(rows)
+            self.flushes += 1
+            return len(rows)
+
+    def _insert(self, rows: List[SQLModel]) -> None:
+        by_table: Dict[Type[SQLModel], List[dict]] = {}
+        for row in rows:
+            by_table.setdefault(type(row), []).append(row.model_dump(exclude={"id"}))
+        with Session(self.engine) as session:
+            for table, values in by_table.items():
+                session.execute(insert(table), values)
+            session.commit()
+
+    def sample_questions(
+        self,
+        topic: Optional[str] = None,
+        difficulty_level: Optional[str] = None,
+        mcq_type: Optional[str] = None,
+        limit: int = 20,
+    ) -> List[QuestionRecord]:
+        """Random sample of stored questions matching the given filters."""
+        return self._sample(QuestionRecord, topic, difficulty_level, mcq_type, limit)
+
+    def sample_solutions(
+        self,
+        topic: Optional[str] = None,
+        difficulty_level: Optional[str] = None,
+        mcq_type: Optional[str] = None,
+        limit: int = 20,
+    ) -> List[SolutionRecord]:
+        return self._sample(SolutionRecord, topic, difficulty_level, mcq_type, limit)
+
+    def _sample(self, table, topic, difficulty_level, mcq_type, limit: int) -> List[Any]:
+        query = select(table)
+        if topic is not None:
+            query = query.where(table.topic == topic)
+        if difficulty_level is not None:
+            query = query.where(table.difficulty_level == difficulty_level)
+        if mcq_type is not None:
+            query = query.where(table.mcq_type == mcq_type)
+        with Session(self.engine) as session:
+            return list(session.exec(query.order_by(func.random()).limit(limit)).all())
+
+    def stats(self) -> Dict[str, Any]:
+        with Session(self.engine) as session:
+            questions = session.exec(select(func.count()).select_from(QuestionRecord)).one()
+            solutions = session.exec(select(func.count()).select_from(SolutionRecord)).one()
+        return {
+            "questions": questions,
+            "solutions": solutions,
+            "pending": len(self._buffer),
+            "written": self.written,
+            "dropped": self.dropped,
+            "flushes": self.flushes,
+        }
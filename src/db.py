@@ -0,0 +1,103 @@
+import os
+import time
+from typing import Optional
+from sqlalchemy import Index, inspect
+from sqlalchemy.engine import Engine
+from src.schema import JobStatus
+from sqlmodel import Field, SQLModel, create_engine
+
+
+class Job(SQLModel, table=True):
+    __tablename__ = "jobs"
+
+    id: str = Field(primary_key=True)
+    kind: str
+    status: JobStatus = Field(default=JobStatus.QUEUED, index=True)
+    params: str
+    total_units: int = 0
+    completed_units: int = 0
+    result: Optional[str] = None
+    error: Optional[str] = None
+    attempts: int = 0
+    # Worker that is running the job and until when its claim holds; renewed while the job runs
+    owner: Optional[str] = None
+    lease_expires_at: Optional[float] = None
+    created_at: float = Field(default_factory=time.time)
+    updated_at: float = Field(default_factory=time.time)
+
+
+class JobUnit(SQLModel, table=True):
+    """Checkpointed result (or error) of one unit of work of a job, e.g. one question batch."""
+    __tablename__ = "job_units"
+
+    job_id: str = Field(primary_key=True, foreign_key="jobs.id")
+    unit_index: int = Field(primary_key=True)
+    result: Optional[str] = None
+    error: Optional[str] = None
+    updated_at: float = Field(default_factory=time.time)
+
+
+class QuestionRecord(SQLModel, table=True):
+    """A generated question. Indexed by topic, difficulty and type for sampling."""
+    __tablename__ = "questions"
+    __table_args__ = (Index("ix_questions_topic_difficulty_type", "topic", "difficulty_level", "mcq_type"),)
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    topic: str
+    difficulty_level: str
+    mcq_type: str
+    question: str
+    thoughts: Optional[str] = None
+    providers: Optional[str] = None
+    models: Optional[str] = None
+    created_at: float = Field(default_factory=time.time)
+
+
+class SolutionRecord(SQLModel, table=True):
+    """A solved question with its options, solution code and the provider that solved it."""
+    __tablename__ = "solutions"
+    __table_args__ = (Index("ix_solutions_topic_difficulty_type", "topic", "difficulty_level", "mcq_type"),)
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    topic: Optional[str] = None
+    difficulty_level: Optional[str] = None
+    mcq_type: str
+    question: str = Field(index=True)
+    correct_answer: str
+    options: str
+    thoughts: Optional[str] = None
+    solution_code: Optional[str] = None
+    provider: Optional[str] = None
+    model: Optional[str] = None
+    verified: bool = False
+    stage_timings: Optional[str] = None
+    created_at: float = Field(default_factory=time.time)
+
+
+def create_db_engine(database_url: str) -> Engine:
+    """Creates the engine for `database_url` and any missing tables. SQLite files get WAL journaling."""
+    connect_args = {}
+    if database_url.startswith("sqlite:///"):
+        directory = os.path.dirname(database_url[len("sqlite:///"):])
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        connect_args["check_same_thread"] = False
+    engine = create_engine(database_url, connect_args=connect_args)
+    if database_url.startswith("sqlite"):
+        with engine.connect() as connection:
+            connection.exec_driver_sql("PRAGMA journal_mode=WAL")
+    SQLModel.metadata.create_all(engine)
+    _add_missing_columns(engine)
+    return engine
+
+
+def _add_missing_columns(engine: Engine) -> None:
+    """Adds nullable columns introduced after a table was created, since `create_all` skips existing tables."""
+    inspector = inspect(engine)
+    with engine.begin() as connection:
+        for table in SQLModel.metadata.sorted_tables:
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing and column.nullable:
+                    column_type = column.type.compile(dialect=engine.dialect)
+                    connection.exec_driver_sql(f'ALTER TABLE {table.name} ADD COLUMN "{column.name}" {column_type}')
@@ -0,0 +1,136 @@
+import re
+import zlib
+import numpy as np
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Union
+
+
+# Prime just above 2**32, so hashed shingles (< 2**32) never collide modulo it.
+_PRIME = np.uint64(4294967311)
+_NUMBER_PATTERN = re.compile(r'\d+(?:[.,]\d+)*')
+_TOKEN_PATTERN = re.compile(r'\w+|[^\w\s]')
+
+
+def normalize_question(text: str, normalize_numbers: bool = False) -> List[str]:
+    """Lower-cases and tokenizes a question, optionally replacing every number with `0`."""
+    text = text.lower()
+    if normalize_numbers:
+        text = _NUMBER_PATTERN.sub('0', text)
+    return _TOKEN_PATTERN.findall(text)
+
+
+class NearDuplicateIndex:
+    """
+    An incremental near-duplicate index for questions based on MinHash and LSH.
+
+    Each question is tokenized (with numbers optionally normalised so questions
+    that differ only in their values collide; off by default, since numeric
+    variants of a template are usually distinct questions), split into word shingles and
+    reduced to a MinHash signature. Signatures are bucketed by LSH bands, so a
+    lookup only compares against the handful of questions sharing a band instead
+    of every question already indexed. A candidate is a duplicate when its
+    estimated Jaccard similarity reaches `threshold`.
+    """
+    def __init__(
+        self,
+        threshold: float = 0.75,
+        num_perm: int = 128,
+        bands: int = 32,
+        shingle_size: int = 2,
+        normalize_numbers: bool = False,
+        seed: int = 1,
+    ) -> None:
+        if num_perm % bands:
+            raise ValueError("num_perm must be divisible by bands")
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        self.normalize_numbers = normalize_numbers
+
+        generator = np.random.default_rng(seed)
+        # Multipliers stay below 2**31 so `a * x + b` fits in uint64 for 32-bit x.
+        self._a = generator.integers(1, 1 << 31, size=num_perm, dtype=np.uint64)
+        self._b = generator.integers(0, 1 << 32, size=num_perm, dtype=np.uint64)
+        self._band_weights = generator.integers(1, 1 << 63, size=self.rows, dtype=np.uint64) | np.uint64(1)
+        self._buckets: List[Dict[int, List[int]]] = [defaultdict(list) for _ in range(bands)]
+        self._signatures: List[np.ndarray] = []
+        self.items: List[str] = []
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def _shingles(self, text: str) -> np.ndarray:
+        tokens = normalize_question(text, self.normalize_numbers)
+        k = min(self.shingle_size, len(tokens)) or 1
+        shingles = {' '.join(tokens[i:i + k]) for i in range(max(len(tokens) - k + 1, 1))}
+        return np.fromiter((zlib.crc32(s.encode()) for s in shingles), dtype=np.uint64, count=len(shingles))
+
+    def signature(self, text: str) -> np.ndarray:
+        hashes = self._shingles(text)
+        return ((np.outer(hashes, self._a) + self._b) % _PRIME).min(axis=0)
+
+    def _band_keys(self, signature: np.ndarray) -> List[int]:
+        # One 64-bit key per band; colliding keys are only candidates and are
+        # always checked against the full signature.
+        return (signature.reshape(self.bands, self.rows) * self._band_weights).sum(axis=1).tolist()
+
+    def _find(self, signature: np.ndarray, band_keys: List[int]) -> Optional[int]:
+        checked = set()
+        for bucket, key in zip(self._buckets, band_keys):
+            for candidate in bucket.get(key, ()):
+                if candidate in checked:
+                    continue
+                checked.add(candidate)
+                if np.count_nonzero(self._signatures[candidate] == signature) >= self.threshold * self.num_perm:
+                    return candidate
+        return None
+
+    def query(self, text: str) -> Optional[str]:
+        """Returns an indexed near-duplicate of `text`, or None."""
+        signature = self.signature(text)
+        match = self._find(signature, self._band_keys(signature))
+        return None if match is None else self.items[match]
+
+    def add(self, text: str) -> bool:
+        """Indexes `text` unless it is a near-duplicate. Returns True if it was added."""
+        signature = self.signature(text)
+        band_keys = self._band_keys(signature)
+        if self._find(signature, band_keys) is not None:
+            return False
+        index = len(self.items)
+        self.items.append(text)
+        self._signatures.append(signature)
+        for bucket, key in zip(self._buckets, band_keys):
+            bucket[key].append(index)
+        return True
+
+
+class ExactDuplicateIndex:
+    """Drops only exact repeats; the same interface as `NearDuplicateIndex`."""
+    def __init__(self) -> None:
+        self._seen = set()
+        self.items: List[str] = []
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def add(self, text: str) -> bool:
+        if text in self._seen:
+            return False
+        self._seen.add(text)
+        self.items.append(text)
+        return True
+
+
+def deduplicate_questions(
+    questions: Iterable[str], index: Optional[Union[ExactDuplicateIndex, NearDuplicateIndex]] = None,
+) -> List[str]:
+    """
+    Drops duplicate questions, keeping the first occurrence: near-duplicates by
+    default, or exact repeats with an `ExactDuplicateIndex`. Pass an existing
+    `index` to also drop questions matching ones seen in earlier calls.
+    """
+    index = index if index is not None else NearDuplicateIndex()
+    return [question for question in questions if index.add(question)]
@@ -0,0 +1,278 @@
+import time
+import asyncio
+import multiprocessing as mp
+import src.utils as utils
+from typing import List, Optional, Set
+from multiprocessing.connection import Connection
+from src.schema import ExecutionException, ExecutionTimeoutException, SandboxBusyException
+from src.tracing import record_span, span
+from src.metrics import SANDBOX_BUSY_WORKERS, SANDBOX_EXECUTIONS, SANDBOX_EXECUTION_SECONDS, SANDBOX_QUEUE_DEPTH
+
+try:
+    import resource
+except ImportError:  # resource limits are only available on POSIX
+    resource = None
+
+
+_READY = "ready"
+
+# Modules the forkserver template imports once so forked workers start warm.
+WARM_PRELOAD_MODULES = ["math", "sympy", "numpy", "scipy", "src.executor"]
+
+# Restricted execution namespace, built once at import time. In warm mode this
+# happens inside the forkserver template and every worker inherits it.
+_BASE_NAMESPACE = vars(utils).copy()
+
+_EXECUTIONS_OK = SANDBOX_EXECUTIONS.labels("ok")
+_EXECUTIONS_ERROR = SANDBOX_EXECUTIONS.labels("error")
+_EXECUTIONS_TIMEOUT = SANDBOX_EXECUTIONS.labels("timeout")
+_EXECUTIONS_REJECTED = SANDBOX_EXECUTIONS.labels("rejected")
+
+
+def _current_address_space() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[0]) * resource.getpagesize()
+    except (OSError, ValueError, IndexError):
+        return 0
+
+def _apply_memory_limit(memory_limit_mb: Optional[int]) -> None:
+    """Caps the worker's address space at its post-import size plus `memory_limit_mb`."""
+    if resource is None or not memory_limit_mb:
+        return
+    limit = _current_address_space() + memory_limit_mb * 1024 * 1024
+    _, hard = resource.getrlimit(resource.RLIMIT_AS)
+    if hard != resource.RLIM_INFINITY:
+        limit = min(limit, hard)
+    resource.setrlimit(resource.RLIMIT_AS, (limit, hard))
+
+def _apply_cpu_limit(cpu_time_limit: Optional[int]) -> None:
+    """Allows the next job `cpu_time_limit` seconds of CPU on top of what the worker already used."""
+    if resource is None or not cpu_time_limit:
+        return
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    limit = int(usage.ru_utime + usage.ru_stime + cpu_time_limit) + 1
+    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    if hard != resource.RLIM_INFINITY:
+        limit = min(limit, hard)
+    resource.setrlimit(resource.RLIMIT_CPU, (limit, hard))
+
+def _worker_main(conn: Connection, memory_limit_mb: Optional[int], cpu_time_limit: Optional[int]) -> None:
+    _apply_memory_limit(memory_limit_mb)
+    conn.send(_READY)
+    while True:
+        try:
+            job = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            break
+        if job is None:
+            break
+
+        _apply_cpu_limit(cpu_time_limit)
+        namespace = _BASE_NAMESPACE.copy()
+        for name in job.get("disallowed_global_vars") or []:
+            namespace.pop(name, None)
+        timings = {}
+        try:
+            reply = (True, utils.run_solution(job["code"], namespace, job.get("disallowed_names"), timings), timings)
+        except Exception as e:
+            reply = (False, f"{type(e).__name__}: {e}", timings)
+        conn.send(reply)
+
+async def _wait_readable(conn: Connection, timeout: Optional[float]) -> bool:
+    loop = asyncio.get_running_loop()
+    readable = loop.create_future()
+    fd = conn.fileno()
+    loop.add_reader(fd, lambda: readable.done() or readable.set_result(True))
+    try:
+        await asyncio.wait_for(readable, timeout=timeout)
+        return True
+    except asyncio.TimeoutError:
+        return False
+    finally:
+        loop.remove_reader(fd)
+
+
+class _Worker:
+    def __init__(self, context, memory_limit_mb: Optional[int], cpu_time_limit: Optional[int]) -> None:
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=_worker_main,
+            args=(child_conn, memory_limit_mb, cpu_time_limit),
+            daemon=True,
+        )
+        self.process.start()
+        child_conn.close()
+        self.ready = False
+        self.jobs_done = 0
+
+    async def wait_ready(self) -> None:
+        if not self.ready:
+            await _wait_readable(self.conn, None)
+            if self.conn.recv() != _READY:
+                raise ExecutionException("Sandbox worker failed to start")
+            self.ready = True
+
+    def terminate(self) -> None:
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join(timeout=1)
+        self.conn.close()
+
+
+class SandboxPool:
+    """
+    A fixed-size pool of worker processes that execute solver code.
+
+    A worker process that overruns its wall-clock timeout is killed outright and
+    replaced, so a runaway `sp.solve` stops consuming CPU the moment its deadline
+    passes. Every job runs under a CPU-time rlimit and every worker under an
+    address-space rlimit, and once `max_queue` callers are already waiting for a
+    worker further calls are rejected instead of piling up.
+
+    In warm mode (the default where `forkserver` is available) workers are forked
+    from a template process that has already imported `WARM_PRELOAD_MODULES` and
+    built the execution namespace, so replacing a worker costs milliseconds rather
+    than a fresh sympy import. Workers are recycled after `max_jobs_per_worker`
+    jobs to keep memory growth bounded.
+
+    Workers are started lazily on first use, or eagerly with `start()`.
+    """
+    def __init__(
+        self,
+        size: int = 4,
+        max_queue: int = 64,
+        cpu_time_limit: Optional[int] = 10,
+        memory_limit_mb: Optional[int] = 1024,
+        warm: bool = True,
+        max_jobs_per_worker: Optional[int] = 200,
+        preload_modules: Optional[List[str]] = None,
+    ) -> None:
+        self.size = size
+        self.max_queue = max_queue
+        self.cpu_time_limit = cpu_time_limit
+        self.memory_limit_mb = memory_limit_mb
+        self.max_jobs_per_worker = max_jobs_per_worker
+        self.warm = warm and "forkserver" in mp.get_all_start_methods()
+        if self.warm:
+            self._context = mp.get_context("forkserver")
+            self._context.set_forkserver_preload(preload_modules or WARM_PRELOAD_MODULES)
+        else:
+            self._context = mp.get_context("spawn")
+        self._workers: Set[_Worker] = set()
+        self._idle: Optional[asyncio.Queue] = None
+        self._waiting = 0
+        self._closed = False
+        SANDBOX_QUEUE_DEPTH.set_function(lambda: self._waiting)
+        SANDBOX_BUSY_WORKERS.set_function(self._busy_workers)
+
+    def _busy_workers(self) -> int:
+        return len(self._workers) - self._idle.qsize() if self._idle is not None else 0
+
+    def _spawn(self) -> _Worker:
+        worker = _Worker(self._context, self.memory_limit_mb, self.cpu_time_limit)
+        self._workers.add(worker)
+        return worker
+
+    def _discard(self, worker: _Worker) -> None:
+        self._workers.discard(worker)
+        worker.terminate()
+
+    def _ensure_started(self) -> None:
+        if self._closed:
+            raise ExecutionException("Sandbox pool is closed")
+        if self._idle is None:
+            self._idle = asyncio.Queue()
+            for _ in range(self.size):
+                self._idle.put_nowait(self._spawn())
+
+    def _release(self, worker: _Worker, healthy: bool) -> None:
+        worker.jobs_done += 1
+        if self.max_jobs_per_worker and worker.jobs_done >= self.max_jobs_per_worker:
+            healthy = False
+        if healthy and not self._closed:
+            self._idle.put_nowait(worker)
+            return
+        self._discard(worker)
+        if not self._closed:
+            self._idle.put_nowait(self._spawn())
+
+    async def start(self) -> None:
+        """Starts all workers and waits until each one has finished importing."""
+        self._ensure_started()
+        await asyncio.gather(*(worker.wait_ready() for worker in list(self._workers)))
+
+    async def run(
+        self,
+        code: str,
+        timeout: float = 5,
+        disallowed_names: Optional[List[str]] = None,
+        disallowed_global_vars: Optional[List[str]] = None,
+    ) -> Optional[str]:
+        """
+        Executes solver code in a pooled worker process.
+
+        Args:
+            code (str): Solver code defining `solve_problem` and `actual_params`
+            timeout (float): Wall-clock limit in seconds, after which the worker is killed
+            disallowed_names (List[str], optional): Names rejected by the AST check
+            disallowed_global_vars (List[str], optional): Globals removed from the execution namespace
+
+        Returns:
+            Optional[str]: Formatted result of `solve_problem(**actual_params)`
+
+        Raises:
+            SandboxBusyException: If `max_queue` jobs are already waiting for a worker
+            ExecutionTimeoutException: If the code does not finish within `timeout`
+            ExecutionException: If the code fails or the worker dies while running it
+        """
+        self._ensure_started()
+        if self._idle.empty() and self._waiting >= self.max_queue:
+            _EXECUTIONS_REJECTED.inc()
+            raise SandboxBusyException(f"Sandbox queue is full ({self.max_queue} jobs waiting)")
+
+        self._waiting += 1
+        try:
+            with span("sandbox.wait", queued=self._waiting - 1):
+                worker: _Worker = await self._idle.get()
+        finally:
+            self._waiting -= 1
+
+        healthy = False
+        try:
+            with span("sandbox.run"):
+                await worker.wait_ready()
+                started = time.perf_counter()
+                worker.conn.send({
+                    "code": code,
+                    "disallowed_names": disallowed_names,
+                    "disallowed_global_vars": disallowed_global_vars,
+                })
+                if not await _wait_readable(worker.conn, timeout):
+                    _EXECUTIONS_TIMEOUT.inc()
+                    raise ExecutionTimeoutException(f"Code execution timed out after {timeout} seconds")
+                ok, payload, timings = worker.conn.recv()
+                SANDBOX_EXECUTION_SECONDS.observe(time.perf_counter() - started)
+                # The worker's phases, laid out back to back from when the job was sent.
+                for phase in ("exec", "solve", "format"):
+                    if phase in timings:
+                        record_span(f"sandbox.{phase}", started, started + timings[phase])
+                        started += timings[phase]
+            healthy = True
+        except (EOFError, OSError):
+            _EXECUTIONS_ERROR.inc()
+            raise ExecutionException("Sandbox worker died while executing the code (resource limit exceeded?)")
+        finally:
+            self._release(worker, healthy)
+
+        if not ok:
+            _EXECUTIONS_ERROR.inc()
+            raise ExecutionException(payload)
+        _EXECUTIONS_OK.inc()
+        return payload
+
+    def close(self) -> None:
+        """Kills every worker process. The pool cannot be used afterwards."""
+        self._closed = True
+        for worker in list(self._workers):
+            self._discard(worker)
@@ -0,0 +1,66 @@
+import math
+from collections import deque
+from typing import Optional
+
+
+class LatencyWindow:
+    """Rolling window of the most recent successful request latencies, in seconds."""
+    def __init__(self, size: int = 200) -> None:
+        self._samples = deque(maxlen=size)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def record(self, seconds: float) -> None:
+        self._samples.append(seconds)
+
+    def percentile(self, q: float) -> Optional[float]:
+        if not self._samples:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, math.ceil(q * len(ordered)) - 1)]
+
+
+class HedgePolicy:
+    """
+    Decides when a request is duplicated to the next provider.
+
+    A request is hedged once the primary provider has been running longer than
+    the `percentile` of its recent latencies (never earlier than `min_delay`;
+    `initial_delay` until `min_samples` latencies are known). At most
+    `max_hedge_ratio` of all hedge-eligible requests are ever duplicated, which
+    caps the extra spend.
+    """
+    def __init__(
+        self,
+        percentile: float = 0.95,
+        min_delay: float = 2.0,
+        initial_delay: float = 20.0,
+        min_samples: int = 20,
+        max_hedge_ratio: float = 0.1,
+    ) -> None:
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.initial_delay = initial_delay
+        self.min_samples = min_samples
+        self.max_hedge_ratio = max_hedge_ratio
+        self.requests = 0
+        self.hedges = 0
+
+    def delay(self, window: LatencyWindow) -> float:
+        if len(window) < self.min_samples:
+            return self.initial_delay
+        return max(self.min_delay, window.percentile(self.percentile))
+
+    def record_request(self) -> None:
+        self.requests += 1
+
+    def try_spend(self) -> bool:
+        """Reserves one hedge if that keeps hedges within `max_hedge_ratio` of requests."""
+        if self.hedges + 1 > self.max_hedge_ratio * self.requests:
+            return False
+        self.hedges += 1
+        return True
+
+    def stats(self) -> dict:
+        return {"requests": self.requests, "hedges": self.hedges}
@@ -0,0 +1,360 @@
+import json
+import math
+import time
+import uuid
+import asyncio
+from sqlmodel import Session, select
+from sqlalchemy import update
+from sqlalchemy.engine import Engine
+from src.db import Job, JobUnit
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+from src.schema import JobInfo, JobStatus, QuestionBank, SolutionTask, BatchSolutionResult, UsageSummary
+
+
+QUESTION_BATCH_SIZE = 30
+
+
+class JobQueue:
+    """
+    Durable background jobs for long-running `MathForge` calls.
+
+    A submitted job is stored through `engine` and its id returned straight
+    away; clients poll `get()` for progress. Every job is split into units of
+    work (a question batch, a solved question) whose results are checkpointed as
+    they complete, so an interrupted job only runs the units it is missing.
+
+    Several queues (workers, replicas) may share one database. A worker claims a
+    job by setting itself as the job's `owner` with a lease that it renews every
+    `lease_seconds / 3` while the job runs. Only running jobs whose lease has
+    expired, i.e. whose worker stopped, are requeued, and a claim succeeds for a
+    single worker only. At most `concurrency` jobs run at a time per queue.
+    Database calls made while jobs run go through `asyncio.to_thread`, so they
+    never block the event loop.
+    """
+    def __init__(self, math_forge, engine: Engine, concurrency: int = 2, lease_seconds: float = 60) -> None:
+        self.math_forge = math_forge
+        self.engine = engine
+        self.concurrency = concurrency
+        self.lease_seconds = lease_seconds
+        self.owner = uuid.uuid4().hex
+        self.handlers: Dict[str, Callable[[str, dict], Awaitable[Any]]] = {
+            "generate_questions": self._run_generate_questions,
+            "generate_multi_level_questions": self._run_generate_multi_level_questions,
+            "solve_questions": self._run_solve_questions,
+        }
+        self._queue: Optional[asyncio.Queue] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._workers: List[asyncio.Task] = []
+        self._heartbeat: Optional[asyncio.Task] = None
+        self._queued: Set[str] = set()
+        self._running: Set[str] = set()
+
+    async def start(self) -> None:
+        """Starts the workers and queues the jobs that are queued or whose worker's lease expired."""
+        self._queue = asyncio.Queue()
+        self._loop = asyncio.get_running_loop()
+        self._queued.clear()
+        for job_id in await asyncio.to_thread(self._requeue_unfinished):
+            self._enqueue(job_id)
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+        self._heartbeat = asyncio.create_task(self._heartbeat_loop())
+
+    def _requeue_unfinished(self) -> List[str]:
+        """Re-queues running jobs with an expired lease and returns the ids of all queued jobs."""
+        with Session(self.engine) as session:
+            session.execute(
+                update(Job)
+                .where(
+                    Job.status == JobStatus.RUNNING,
+                    Job.lease_expires_at.is_(None) | (Job.lease_expires_at < time.time()),
+                )
+                .values(status=JobStatus.QUEUED, owner=None, lease_expires_at=None, updated_at=time.time())
+            )
+            session.commit()
+            return list(session.exec(
+                select(Job.id).where(Job.status == JobStatus.QUEUED).order_by(Job.created_at)
+            ).all())
+
+    async def _heartbeat_loop(self) -> None:
+        """Renews the leases of the jobs this queue runs and picks up jobs left behind by stopped workers."""
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            try:
+                await asyncio.to_thread(self._renew_leases, list(self._running))
+                for job_id in await asyncio.to_thread(self._requeue_unfinished):
+                    if job_id not in self._running:
+                        self._enqueue(job_id)
+            except Exception as e:
+                print(f"Job heartbeat failed: {str(e)}")
+
+    def _enqueue(self, job_id: str) -> None:
+        if job_id not in self._queued:
+            self._queued.add(job_id)
+            self._queue.put_nowait(job_id)
+
+    def _renew_leases(self, job_ids: List[str]) -> None:
+        if not job_ids:
+            return
+        with Session(self.engine) as session:
+            session.execute(
+                update(Job)
+                .where(Job.id.in_(job_ids), Job.owner == self.owner, Job.status == JobStatus.RUNNING)
+                .values(lease_expires_at=time.time() + self.lease_seconds)
+            )
+            session.commit()
+
+    def _release_leases(self) -> None:
+        """Hands the running jobs of this queue back to the queue so any worker can resume them right away."""
+        with Session(self.engine) as session:
+            session.execute(
+                update(Job)
+                .where(Job.owner == self.owner, Job.status == JobStatus.RUNNING)
+                .values(status=JobStatus.QUEUED, owner=None, lease_expires_at=None, updated_at=time.time())
+            )
+            session.commit()
+
+    async def close(self) -> None:
+        """Stops the workers and releases the jobs they were running, which resume from their checkpoints."""
+        tasks = self._workers + ([self._heartbeat] if self._heartbeat is not None else [])
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._workers = []
+        self._heartbeat = None
+        self._running.clear()
+        await asyncio.to_thread(self._release_leases)
+
+    def submit(self, kind: str, params: dict) -> JobInfo:
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+        job = Job(id=uuid.uuid4().hex, kind=kind, params=json.dumps(params))
+        with Session(self.engine) as session:
+            session.add(job)
+            session.commit()
+            session.refresh(job)
+            info = self._info(job, [])
+        if self._loop is not None:
+            # `submit` is called from a thread (see app.py), so queue the job on the event loop
+            self._loop.call_soon_threadsafe(self._enqueue, job.id)
+        return info
+
+    def get(self, job_id: str) -> Optional[JobInfo]:
+        with Session(self.engine) as session:
+            job = session.get(Job, job_id)
+            if job is None:
+                return None
+            units = session.exec(
+                select(JobUnit)
+                .where(JobUnit.job_id == job_id, JobUnit.result.is_not(None))
+                .order_by(JobUnit.unit_index)
+            ).all()
+            return self._info(job, [json.loads(unit.result) for unit in units])
+
+    def _info(self, job: Job, partial_results: List[Any]) -> JobInfo:
+        return JobInfo(
+            id=job.id,
+            kind=job.kind,
+            status=job.status,
+            total_units=job.total_units,
+            completed_units=job.completed_units,
+            result=json.loads(job.result) if job.result is not None else None,
+            partial_results=partial_results if job.status != JobStatus.COMPLETED else [],
+            error=job.error,
+            created_at=job.created_at,
+            updated_at=job.updated_at,
+        )
+
+    async def _worker(self) -> None:
+        while True:
+            job_id = await self._queue.get()
+            self._queued.discard(job_id)
+            try:
+                await self._run(job_id)
+            except Exception as e:
+                print(f"Job {job_id} could not be run: {str(e)}")
+
+    async def _run(self, job_id: str) -> None:
+        claimed = await asyncio.to_thread(self._claim, job_id)
+        if claimed is None:
+            return
+        kind, params = claimed
+        self._running.add(job_id)
+        try:
+            result = await self.handlers[kind](job_id, params)
+            await asyncio.to_thread(
+                self._update_job, job_id, status=JobStatus.COMPLETED, result=json.dumps(result), error=None,
+                owner=None, lease_expires_at=None,
+            )
+        except Exception as e:
+            await asyncio.to_thread(
+                self._update_job, job_id, status=JobStatus.FAILED, error=str(e), owner=None, lease_expires_at=None,
+            )
+        finally:
+            self._running.discard(job_id)
+
+    def _claim(self, job_id: str) -> Optional[Tuple[str, dict]]:
+        """
+        Leases a queued job to this queue and returns its kind and parameters, or None if
+        it is not queued. The status check and update are one statement, so when several
+        workers race for a job only one of them claims it.
+        """
+        now = time.time()
+        with Session(self.engine) as session:
+            claimed = session.execute(
+                update(Job)
+                .where(Job.id == job_id, Job.status == JobStatus.QUEUED)
+                .values(
+                    status=JobStatus.RUNNING,
+                    owner=self.owner,
+                    lease_expires_at=now + self.lease_seconds,
+                    attempts=Job.attempts + 1,
+                    updated_at=now,
+                )
+            ).rowcount
+            session.commit()
+            if not claimed:
+                return None
+            job = session.get(Job, job_id)
+            return job.kind, json.loads(job.params)
+
+    def _update_job(self, job_id: str, **fields: Any) -> None:
+        with Session(self.engine) as session:
+            job = session.get(Job, job_id)
+            for name, value in fields.items():
+                setattr(job, name, value)
+            job.updated_at = time.time()
+            session.add(job)
+            session.commit()
+
+    def _completed_units(self, job_id: str) -> Dict[int, Any]:
+        with Session(self.engine) as session:
+            units = session.exec(
+                select(JobUnit).where(JobUnit.job_id == job_id, JobUnit.result.is_not(None))
+            ).all()
+            return {unit.unit_index: json.loads(unit.result) for unit in units}
+
+    def _save_unit(self, job_id: str, unit_index: int, result: Any = None, error: Optional[str] = None) -> None:
+        """Checkpoints a unit. Units saved with an error are run again when the job resumes."""
+        with Session(self.engine) as session:
+            session.merge(JobUnit(
+                job_id=job_id,
+                unit_index=unit_index,
+                result=json.dumps(result) if result is not None else None,
+                error=error,
+                updated_at=time.time(),
+            ))
+            session.commit()
+            completed_units = len(session.exec(
+                select(JobUnit.unit_index).where(JobUnit.job_id == job_id, JobUnit.result.is_not(None))
+            ).all())
+        self._update_job(job_id, completed_units=completed_units)
+
+    async def _run_generate_questions(self, job_id: str, params: dict) -> dict:
+        """
+        Generates questions as independent batches (one unit each), like
+        `MathForge.generate_questions(parallel=True)`. If deduplication leaves a
+        shortfall, further batches are added, up to twice the initial number.
+        """
+        num_questions = params["num_questions"]
+        if num_questions < 1:
+            raise ValueError("num_questions must be at least 1")
+        batch_size = min(QUESTION_BATCH_SIZE, num_questions)
+        total_units = math.ceil(num_questions / batch_size)
+        max_units = 2 * total_units
+        done = await asyncio.to_thread(self._completed_units, job_id)
+        total_units = max(total_units, max(done, default=-1) + 1)
+        await asyncio.to_thread(self._update_job, job_id, total_units=total_units)
+
+        async def run_unit(unit_index: int) -> None:
+            try:
+                question_bank = await self.math_forge.generate_question_batch(
+                    tagname=params["tagname"],
+                    description=params["description"],
+                    num_questions=batch_size,
+                    seed=unit_index,
+                    temperature=params["temperature"],
+                    mcq_type=params["mcq_type"],
+                    difficulty_level=params["difficulty_level"],
+                    provider=params["provider"],
+                    use_cache=params.get("use_cache", True),
+                )
+            except Exception as e:
+                await asyncio.to_thread(self._save_unit, job_id, unit_index, error=str(e))
+                return
+            done[unit_index] = question_bank.model_dump()
+            await asyncio.to_thread(self._save_unit, job_id, unit_index, result=done[unit_index])
+
+        while True:
+            thoughts, questions = None, []
+            index = self.math_forge.question_index()
+            for unit_index in sorted(done):
+                thoughts = thoughts if thoughts is not None else done[unit_index]["thoughts"]
+                questions.extend(q for q in done[unit_index]["questions"] if index.add(q))
+
+            pending = [unit_index for unit_index in range(total_units) if unit_index not in done]
+            if not pending:
+                if len(questions) >= num_questions or total_units >= max_units:
+                    break
+                total_units = min(max_units, total_units + math.ceil((num_questions - len(questions)) / batch_size))
+                await asyncio.to_thread(self._update_job, job_id, total_units=total_units)
+                continue
+
+            completed_before = len(done)
+            await asyncio.gather(*(run_unit(unit_index) for unit_index in pending))
+            if len(done) == completed_before:
+                raise Exception("All question generation batches failed")
+
+        usage = UsageSummary()
+        for unit in done.values():
+            if unit.get("usage"):
+                usage = usage.add(UsageSummary(**unit["usage"]))
+        question_bank = QuestionBank(thoughts=thoughts, questions=questions[:num_questions], usage=usage)
+        self.math_forge.record_questions(
+            question_bank, params["tagname"], params["difficulty_level"], params["mcq_type"]
+        )
+        return question_bank.model_dump()
+
+    async def _run_generate_multi_level_questions(self, job_id: str, params: dict) -> dict:
+        await asyncio.to_thread(self._update_job, job_id, total_units=1)
+        done = await asyncio.to_thread(self._completed_units, job_id)
+        if 0 not in done:
+            question_bank = await self.math_forge.generate_multi_level_questions(
+                tagname=params["tagname"],
+                description=params["description"],
+                temperature=params["temperature"],
+                provider=params["provider"],
+                use_cache=params.get("use_cache", True),
+            )
+            done[0] = question_bank.model_dump()
+            await asyncio.to_thread(self._save_unit, job_id, 0, result=done[0])
+        return done[0]
+
+    async def _run_solve_questions(self, job_id: str, params: dict) -> List[dict]:
+        tasks = [SolutionTask(**task) for task in params["questions"]]
+        await asyncio.to_thread(self._update_job, job_id, total_units=len(tasks))
+        done = await asyncio.to_thread(self._completed_units, job_id)
+        errors: Dict[int, str] = {}
+        pending = [unit_index for unit_index in range(len(tasks)) if unit_index not in done]
+
+        async for result in self.math_forge.generate_solutions(
+            tasks=[tasks[unit_index] for unit_index in pending],
+            provider=params["provider"],
+            temperature=params["temperature"],
+            verify_solution=params["verify_solution"],
+            max_concurrency=params["max_concurrency"],
+            use_cache=params.get("use_cache", True),
+        ):
+            result.index = pending[result.index]
+            if result.error is None:
+                done[result.index] = result.model_dump()
+                await asyncio.to_thread(self._save_unit, job_id, result.index, result=done[result.index])
+            else:
+                errors[result.index] = result.error
+                await asyncio.to_thread(self._save_unit, job_id, result.index, error=result.error)
+
+        return [
+            done.get(unit_index) or BatchSolutionResult(
+                index=unit_index, question=task.question, error=errors.get(unit_index)
+            ).model_dump()
+            for unit_index, task in enumerate(tasks)
+        ]
@@ -0,0 +1,84 @@
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Callable, Dict, List, Optional
+from src.schema import AllKeysRateLimitedException, LLMUsage
+from src.rate_limiter import is_rate_limit_error, retry_after_seconds
+
+
+class PooledKey:
+    def __init__(self, index: int, api_key: str, client: Any) -> None:
+        self.index = index
+        self.api_key = api_key
+        self.client = client
+        self.in_flight = 0
+        self.requests = 0
+        self.rate_limited = 0
+        self.tokens = 0
+        self.last_used = 0.0
+        self.ejected_until = 0.0
+
+
+class APIKeyPool:
+    """
+    One long-lived client per API key of a provider.
+
+    Clients are built once, so every request reuses an existing connection pool
+    instead of paying a fresh TLS handshake. Each lease goes to the available key
+    with the fewest requests in flight, falling back to the least recently used
+    one, which degrades to round-robin when keys are idle. A key that answers
+    with a 429 is ejected for its `Retry-After` (or `cooldown` seconds), unless
+    it is the last available one, whose backoff is left to the rate limiter and
+    retries. If every key is ejected anyway, `lease()` raises
+    `AllKeysRateLimitedException` at once, so the request can fail over to
+    another provider instead of waiting.
+    """
+    def __init__(self, api_keys: List[str], client_factory: Callable[[str], Any], cooldown: float = 60.0) -> None:
+        if not api_keys:
+            raise ValueError("APIKeyPool needs at least one API key")
+        self.cooldown = cooldown
+        self.keys = [PooledKey(index, key, client_factory(key)) for index, key in enumerate(api_keys)]
+
+    @property
+    def primary_client(self) -> Any:
+        return self.keys[0].client
+
+    def _select(self, now: float) -> PooledKey:
+        available = [key for key in self.keys if key.ejected_until <= now]
+        if not available:
+            wait = min(key.ejected_until for key in self.keys) - now
+            raise AllKeysRateLimitedException(f"All API keys are rate limited for another {wait:.1f}s")
+        return min(available, key=lambda key: (key.in_flight, key.last_used))
+
+    @asynccontextmanager
+    async def lease(self):
+        """Yields the selected `PooledKey`; pass it to `record()` with the response usage."""
+        key = self._select(time.time())
+        key.in_flight += 1
+        key.requests += 1
+        key.last_used = time.time()
+        try:
+            yield key
+        except Exception as e:
+            if is_rate_limit_error(e):
+                key.rate_limited += 1
+                now = time.time()
+                if any(other is not key and other.ejected_until <= now for other in self.keys):
+                    key.ejected_until = now + (retry_after_seconds(e) or self.cooldown)
+            raise
+        finally:
+            key.in_flight -= 1
+
+    def record(self, key: PooledKey, usage: Optional[LLMUsage]) -> None:
+        if usage is not None:
+            key.tokens += usage.input_tokens + usage.output_tokens
+
+    def stats(self) -> List[Dict[str, Any]]:
+        now = time.time()
+        return [{
+            "key": f"...{key.api_key[-4:]}",
+            "in_flight": key.in_flight,
+            "requests": key.requests,
+            "tokens": key.tokens,
+            "rate_limited": key.rate_limited,
+            "ejected_for": round(max(0.0, key.ejected_until - now), 1),
+        } for key in self.keys]
@@ -1,11 +1,27 @@
 import os
 import json
-import random
+import time
+import asyncio
 from openai import AsyncOpenAI
 from anthropic import AsyncAnthropic
-from typing import List, Callable, Optional
+from contextvars import ContextVar
+from contextlib import aclosing, contextmanager, nullcontext
+from src.key_pool import APIKeyPool
+from src.replay import RecordingStore, ReplayClient
+from src.cache import TieredCache, make_cache_key
+from src.hedging import HedgePolicy, LatencyWindow
+from src.tracing import span, start_span
+from src.routing import CostRouter
+from src.metrics import CIRCUIT_OPEN, EXTRACTION_FAILURES, ProviderMetrics, StageMetrics
+from src.circuit_breaker import CircuitBreaker, is_transient_error, retry_delay
+from src.xml_stream import StreamingTagParser, XMLElement
+from typing import Any, AsyncIterator, Dict, List, Callable, Optional, Tuple
+from src.rate_limiter import (ProviderRateLimiter, RatePermit, MemoryRateLimitBackend, 
+SQLiteRateLimitBackend, estimate_tokens, is_rate_limit_error)
 from src.schema import (LLMProviderConfig, AnthropicConfig, 
-GoogleConfig, TogetherConfig, OpenAIConfig, GroqConfig, MistralConfig, LLMMessage)
+GoogleConfig, TogetherConfig, OpenAIConfig, GroqConfig, MistralConfig, LLMMessage, LLMUsage, 
+CircuitBreakerConfig, CircuitState, CostRoutingConfig, ProviderUnavailableException, ReplayConfig,
+AllKeysRateLimitedException)
 
 
 def get_env_array(env_var_name):
@@ -23,6 +39,70 @@ def get_env_array(env_var_name):
         return None
 
 
+def with_cache_control(system: Optional[str], messages: List[dict]) -> tuple:
+    """
+    Returns Anthropic `system` blocks and a copy of `messages` with ephemeral
+    cache-control breakpoints on the system prompt and on the last message, so
+    the static instructions and the conversation prefix are read from the
+    prompt cache on the next call that shares them.
+    """
+    cache_control = {"type": "ephemeral"}
+    system_blocks = [{"type": "text", "text": system, "cache_control": cache_control}] if system else None
+    cached_messages = [dict(message) for message in messages]
+    if cached_messages:
+        content = cached_messages[-1]["content"]
+        blocks = [{"type": "text", "text": content}] if isinstance(content, str) else [dict(block) for block in content]
+        blocks[-1]["cache_control"] = cache_control
+        cached_messages[-1]["content"] = blocks
+    return system_blocks, cached_messages
+
+def usage_from_response(usage) -> LLMUsage:
+    """Normalises Anthropic and OpenAI-compatible `usage` objects into `LLMUsage`."""
+    if usage is None:
+        return LLMUsage()
+    if hasattr(usage, "input_tokens"):
+        return LLMUsage(
+            input_tokens=usage.input_tokens or 0,
+            output_tokens=usage.output_tokens or 0,
+            cache_read_input_tokens=getattr(usage, "cache_read_input_tokens", None) or 0,
+            cache_creation_input_tokens=getattr(usage, "cache_creation_input_tokens", None) or 0,
+        )
+    # OpenAI's `prompt_tokens` includes the cached ones; split them out as Anthropic reports them.
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached_tokens = getattr(details, "cached_tokens", None) or 0
+    return LLMUsage(
+        input_tokens=(usage.prompt_tokens or 0) - cached_tokens,
+        output_tokens=usage.completion_tokens or 0,
+        cache_read_input_tokens=cached_tokens,
+    )
+
+
+# The call lists of the enclosing `LLMConnector.track_calls()` blocks, outermost first.
+_call_logs: ContextVar[Tuple[List[dict], ...]] = ContextVar("llm_call_logs", default=())
+
+
+async def read_until(chunks: AsyncIterator[Optional[str]], stop_condition: Callable[[List[XMLElement]], bool]) -> str:
+    """Collects streamed text until `stop_condition` holds for the elements parsed so far."""
+    parser = StreamingTagParser()
+    elements: List[XMLElement] = []
+    async for text in chunks:
+        if not text:
+            continue
+        elements.extend(parser.feed(text))
+        if stop_condition(elements):
+            break
+    return parser.text
+
+
+OPENAI_COMPATIBLE_BASE_URLS = {
+    "together": "https://api.together.xyz/v1",
+    "google": "https://generativelanguage.googleapis.com/v1beta/",
+    "openai": "https://api.openai.com/v1",
+    "groq": "https://api.groq.com/openai/v1",
+    "mistral": "https://api.mistral.ai/v1",
+}
+
+
 class LLMConnector:
     """
     A connector class that manages interactions with multiple LLM providers.
@@ -32,6 +112,16 @@ class LLMConnector:
     - Provider fallback logic if primary provider fails
     - Streaming and non-streaming LLM interactions
     - Message formatting for different provider APIs
+    - Optional content-addressed caching of raw responses
+    - Per-provider rate limiting and concurrency control
+    - Pooled long-lived clients for every API key of OpenAI-compatible providers
+    - Optional hedging of slow requests to the next provider
+    - Per-provider circuit breakers, health-scored routing and jittered retries
+    - A `replay` provider serving recorded responses, and recording of live ones
+    - Per-provider metrics of requests, latency, tokens, retries and failovers
+    - Trace spans for every call, attempt and extraction (see `src.tracing`)
+    - Token usage and cost per call, stage and provider, and optional routing
+      of each stage to the cheapest provider meeting its latency SLO
     
     Supports both sync and async operations with automatic retries and
     provider failover based on configured priority.
@@ -44,7 +134,14 @@ class LLMConnector:
         openai: Optional[OpenAIConfig] = None,
         groq:  Optional[GroqConfig] = None, 
         mistral:  Optional[MistralConfig] = None, 
-        provider_priority: List[str] = ["anthropic", "google", "together", "groq", "mistral"]
+        replay: Optional[ReplayConfig] = None,
+        provider_priority: List[str] = ["anthropic", "google", "together", "groq", "mistral"],
+        response_cache: Optional[TieredCache] = None,
+        rate_limit_backend: Optional[MemoryRateLimitBackend | SQLiteRateLimitBackend] = None,
+        hedge_policy: Optional[HedgePolicy] = None,
+        circuit_breaker: Optional[CircuitBreakerConfig] = None,
+        recorder: Optional[RecordingStore] = None,
+        cost_routing: Optional[CostRoutingConfig] = None,
     ) -> None:
         self.google = google
         self.together = together
@@ -52,42 +149,60 @@ class LLMConnector:
         self.openai = openai
         self.groq = groq
         self.mistral = mistral
+        self.replay = replay
+        self.recorder = recorder
         self.provider_priority = [p for p in provider_priority if getattr(self, p) is not None]
+        self.response_cache = response_cache
+        self.usage: Dict[str, LLMUsage] = {}
+        self.stage_usage: Dict[str, LLMUsage] = {}
+        self.stage_metrics: Dict[str, StageMetrics] = {}
+        self.cost_router = CostRouter(cost_routing) if cost_routing is not None else None
+        self.hedge_by_default = hedge_policy is not None
+        self.hedge_policy = hedge_policy or HedgePolicy()
+        self.latencies: Dict[str, LatencyWindow] = {p: LatencyWindow() for p in self.provider_priority}
+        self.breakers: Dict[str, CircuitBreaker] = {p: CircuitBreaker(p, circuit_breaker) for p in self.provider_priority}
+        self.metrics: Dict[str, ProviderMetrics] = {
+            p: ProviderMetrics(p, getattr(self, p).model) for p in self.provider_priority
+        }
+        for p, breaker in self.breakers.items():
+            CIRCUIT_OPEN.labels(p).set_function(lambda breaker=breaker: int(breaker.state != CircuitState.CLOSED))
+        self.rate_limiters: Dict[str, ProviderRateLimiter] = {
+            p: ProviderRateLimiter(p, getattr(self, p).rate_limit, rate_limit_backend)
+            for p in self.provider_priority if getattr(self, p).rate_limit is not None
+        }
         
         if not self.provider_priority:
             raise ValueError("No valid providers configured in priority list")
         
         self.clients = {}
+        self.key_pools: Dict[str, APIKeyPool] = {}
         self._initialize_clients()
     
     def _initialize_clients(self) -> None:
-        if self.anthropic:
+        # Any provider can be given a `ReplayConfig`, e.g. to benchmark failover
+        # offline; providers replaying the same file share its recordings.
+        recording_stores: Dict[str, RecordingStore] = {}
+        if self.recorder is not None:
+            recording_stores[self.recorder.path] = self.recorder
+        for provider in ["anthropic", "replay", *OPENAI_COMPATIBLE_BASE_URLS]:
+            config: Optional[LLMProviderConfig] = getattr(self, provider)
+            if isinstance(config, ReplayConfig):
+                if config.recordings_path not in recording_stores:
+                    recording_stores[config.recordings_path] = RecordingStore(config.recordings_path)
+                self.clients[provider] = ReplayClient(config, recording_stores[config.recordings_path])
+        if self.anthropic and "anthropic" not in self.clients:
             self.clients["anthropic"] = AsyncAnthropic(api_key=self.anthropic.api_key)
-        if self.together:
-            self.clients["together"] = AsyncOpenAI(
-                api_key=self.together.api_key,
-                base_url="https://api.together.xyz/v1"
-            )
-        if self.google:
-            self.clients["google"] = AsyncOpenAI(
-                api_key=self.google.api_key,
-                base_url="https://generativelanguage.googleapis.com/v1beta/"
-            )
-        if self.openai:
-            self.clients["openai"] = AsyncOpenAI(
-                api_key=self.openai.api_key,
-                base_url="https://api.openai.com/v1"
-            )
-        if self.groq:
-            self.clients["groq"] = AsyncOpenAI(
-                api_key=self.groq.api_key,
-                base_url="https://api.groq.com/openai/v1"
-            )
-        if self.mistral:
-            self.clients["mistral"] = AsyncOpenAI(
-                api_key=self.mistral.api_key,
-                base_url="https://api.mistral.ai/v1"
+        for provider, base_url in OPENAI_COMPATIBLE_BASE_URLS.items():
+            config: Optional[LLMProviderConfig] = getattr(self, provider)
+            if config is None or provider in self.clients:
+                continue
+            extra_keys = config.api_keys or get_env_array(f"{provider.upper()}_API_KEYS") or []
+            api_keys = [config.api_key] + [key for key in extra_keys if key != config.api_key]
+            self.key_pools[provider] = APIKeyPool(
+                api_keys=api_keys,
+                client_factory=lambda api_key, base_url=base_url: AsyncOpenAI(api_key=api_key, base_url=base_url),
             )
+            self.clients[provider] = self.key_pools[provider].primary_client
 
     async def _stream_openai(self, client: AsyncOpenAI, model: str, messages: List[dict], **kwargs):
         """
@@ -110,7 +225,8 @@ class LLMConnector:
             temperature=kwargs.get("temperature", 0.5),
         )
         async for chunk in stream:
-            yield chunk.choices[0].delta.content
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
     
     async def _stream_anthropic(self, client: AsyncAnthropic, model: str, **kwargs):
         """
@@ -124,22 +240,160 @@ class LLMConnector:
         Yields:
             str: Content chunks from stream
         """
+        system, messages = kwargs.get("system"), kwargs.get("messages")
+        if kwargs.get("enable_cache"):
+            system, messages = with_cache_control(system, messages)
         stream_params = dict(
             model=model,
-            system=kwargs.get("system"),
-            messages=kwargs.get("messages"),
+            messages=messages,
             max_tokens=kwargs.get("max_tokens", 2049),
             temperature=kwargs.get("temperature", 0.5),
         )
+        if system:
+            stream_params["system"] = system
         async with client.messages.stream(**stream_params) as stream:
             async for text in stream.text_stream:
                 yield text
+            final_message = await stream.get_final_message()
+            kwargs["on_usage"](usage_from_response(final_message.usage))
+
+    async def _stream_replay(self, client: ReplayClient, model: str, system: Optional[str], messages: List[dict], **kwargs):
+        """Internal method that streams a recorded response."""
+        async with aclosing(client.stream(system, messages)) as chunks:
+            async for text in chunks:
+                yield text
+
+    def _record_usage(self, provider: str, usage: LLMUsage, stage: Optional[str] = None) -> LLMUsage:
+        """Prices `usage` in place with the provider's pricing, if any, and adds it to the totals."""
+        pricing = getattr(self, provider).pricing
+        if pricing is not None:
+            usage.cost = pricing.cost(usage)
+        self.usage[provider] = self.usage.get(provider, LLMUsage()).add(usage)
+        self.metrics[provider].record_usage(usage)
+        if stage is not None:
+            self.stage_usage[stage] = self.stage_usage.get(stage, LLMUsage()).add(usage)
+            if stage not in self.stage_metrics:
+                self.stage_metrics[stage] = StageMetrics(stage)
+            self.stage_metrics[stage].record_usage(usage)
+        return usage
+
+    def _extract(self, extractor_function: Optional[Callable], response_text: str) -> Any:
+        if extractor_function is None:
+            return response_text
+        try:
+            with span("llm.extract", extractor=extractor_function.__name__):
+                return extractor_function(response_text)
+        except Exception:
+            EXTRACTION_FAILURES.labels(extractor_function.__name__).inc()
+            raise
+
+    def rate_limit_stats(self) -> Dict[str, dict]:
+        return {
+            "providers": {provider: limiter.stats() for provider, limiter in self.rate_limiters.items()},
+            "api_keys": {provider: pool.stats() for provider, pool in self.key_pools.items()},
+        }
+
+    def usage_stats(self) -> Dict[str, dict]:
+        """Cumulative token usage and cost per provider, including prompt cache reads and writes."""
+        return {provider: usage.model_dump() for provider, usage in self.usage.items()}
+
+    def stage_usage_stats(self) -> Dict[str, dict]:
+        """Cumulative token usage and cost per pipeline stage."""
+        return {stage: usage.model_dump() for stage, usage in self.stage_usage.items()}
              
-    async def _try_next_provider(self, current_index: int) -> tuple:
-        if current_index >= len(self.provider_priority) - 1:
-            raise Exception("All providers failed")
-        next_provider = self.provider_priority[current_index + 1]
-        return next_provider, self.clients[next_provider]
+    def health_stats(self) -> Dict[str, Any]:
+        return {
+            "providers": {provider: breaker.stats() for provider, breaker in self.breakers.items()},
+            "routing": [provider for provider in self.provider_priority if self.breakers[provider].available()],
+            "cost_routing": self.cost_router.stats() if self.cost_router is not None else None,
+        }
+
+    @contextmanager
+    def track_calls(self):
+        """
+        Collects the provider and model of every successful `generate`/`stream`
+        call made inside the block, including calls from tasks it starts, as
+        `{"provider", "model", "cached", "stage", "usage"}` dicts in call
+        completion order, where `usage` is the `LLMUsage` of the response used
+        (empty for cached responses). Blocks can be nested; enclosing blocks see
+        the calls of inner ones too.
+        """
+        calls: List[dict] = []
+        token = _call_logs.set(_call_logs.get() + (calls,))
+        try:
+            yield calls
+        finally:
+            _call_logs.reset(token)
+
+    def _log_call(self, provider: str, cached: bool, usage: Optional[LLMUsage] = None, stage: Optional[str] = None) -> None:
+        call = {
+            "provider": provider, "model": getattr(self, provider).model, "cached": cached,
+            "stage": stage, "usage": usage or LLMUsage(),
+        }
+        for calls in _call_logs.get():
+            calls.append(call)
+
+    def _record_response(
+        self,
+        provider: str,
+        system: Optional[str],
+        messages: List[dict],
+        response_text: str,
+        latency: float,
+        usage: Optional[LLMUsage] = None,
+    ) -> None:
+        """Adds a live provider's response to the recording store, if recording is enabled."""
+        if self.recorder is None or isinstance(self.clients[provider], ReplayClient):
+            return
+        self.recorder.record(system, messages, response_text, provider, getattr(self, provider).model, latency, usage)
+
+    def _route(
+        self,
+        provider: Optional[str] = None,
+        stage: Optional[str] = None,
+        input_tokens: int = 0,
+        max_tokens: int = 0,
+    ) -> List[str]:
+        """
+        Internal method that orders the providers to try for a request. Providers
+        with an open circuit are skipped; the rest keep their `provider_priority`
+        order, except that error-prone (over half the failure threshold) or slow
+        (latency EWMA over `slow_latency_factor` times the fastest provider's)
+        providers are moved behind the healthy ones. Half-open providers keep
+        their place, so their probe request is actually sent.
+        
+        With cost routing and a latency SLO for `stage`, slowness is judged
+        against the SLO instead, and providers are ordered by expected cost.
+        
+        Returns:
+            List[str]: Providers in the order they should be tried
+            
+        Raises:
+            ProviderUnavailableException: If every candidate's circuit is open
+        """
+        candidates = [provider] if provider in self.provider_priority else self.provider_priority
+        available = [p for p in candidates if self.breakers[p].available()]
+        if not available:
+            raise ProviderUnavailableException(f"Circuit open for all providers: {', '.join(candidates)}")
+        
+        latencies = [self.breakers[p].latency_ewma for p in available if self.breakers[p].latency_ewma is not None]
+        fastest = min(latencies, default=None)
+        router = self.cost_router if not provider and self.cost_router is not None and self.cost_router.routes(stage) else None
+        def rank(p: str) -> tuple:
+            breaker = self.breakers[p]
+            error_prone = breaker.failure_rate >= breaker.config.failure_rate_threshold / 2
+            if router is not None:
+                return (
+                    error_prone,
+                    not router.meets_slo(p, stage),
+                    router.expected_cost(stage, getattr(self, p).pricing, input_tokens, max_tokens),
+                )
+            slow = (
+                fastest is not None and breaker.latency_ewma is not None
+                and breaker.latency_ewma > breaker.config.slow_latency_factor * fastest
+            )
+            return (error_prone, slow)
+        return sorted(available, key=rank)
                 
     async def stream(
         self, 
@@ -147,7 +401,10 @@ class LLMConnector:
         messages: List[dict], 
         max_tokens: int = 2049, 
         temperature: float=0.5,
-        provider: Optional[str] = None
+        provider: Optional[str] = None,
+        enable_cache: bool = False,
+        stop_condition: Optional[Callable[[List[XMLElement]], bool]] = None,
+        stage: Optional[str] = None,
     ):
         """
         Streams LLM responses with provider fallback support.
@@ -158,6 +415,11 @@ class LLMConnector:
             max_tokens (int): Maximum tokens in response
             temperature (float): Sampling temperature
             provider (str, optional): Specific provider to use
+            enable_cache (bool): Whether to enable Anthropic prompt caching
+            stop_condition (Callable, optional): Predicate over the elements parsed
+                so far; the stream is closed as soon as it holds
+            stage (str, optional): Pipeline stage the call belongs to, for usage
+                accounting and cost routing
             
         Yields:
             LLMMessage: Contains:
@@ -169,37 +431,357 @@ class LLMConnector:
             Exception: If all configured providers fail
         """
         output = []
-        current_index = 0
-        current_provider = provider if provider in self.provider_priority else self.provider_priority[0]
+        last_error = None
+        for current_provider in self._route(provider, stage, estimate_tokens(system, messages, 0), max_tokens):
+            breaker = self.breakers[current_provider]
+            metrics = self.metrics[current_provider]
+            retries = 0
+            reported_usage: List[LLMUsage] = []
+            while True:
+                attempt_span = None
+                try:
+                    client = self.clients[current_provider]
+                    config: LLMProviderConfig = getattr(self, current_provider)
+                    
+                    if isinstance(client, ReplayClient):
+                        stream_func = self._stream_replay
+                        kwargs = {"system": system, "messages": messages}
+                        key_lease = nullcontext(None)
+                    elif current_provider == "anthropic":
+                        stream_func = self._stream_anthropic
+                        kwargs = {
+                            "system": system, "messages": messages, "enable_cache": enable_cache,
+                            "on_usage": reported_usage.append,
+                        }
+                        key_lease = nullcontext(None)
+                    else:
+                        stream_func = self._stream_openai
+                        kwargs = {"messages": [{"role": "system", "content": system}] + messages} if system else {"messages": messages}
+                        key_lease = self.key_pools[current_provider].lease()
+                    
+                    attempt_span = start_span("llm.stream", provider=current_provider, model=config.model, attempt=retries)
+                    async with self._rate_limit(current_provider, system, messages, max_tokens) as permit, key_lease as key:
+                        if key is not None:
+                            client = key.client
+                        parser = StreamingTagParser()
+                        elements: List[XMLElement] = []
+                        request_started = time.perf_counter()
+                        if attempt_span is not None:
+                            attempt_span.set(queued=round(request_started - attempt_span.start, 4))
+                        with breaker.call():
+                            async with aclosing(stream_func(
+                                client, config.model, max_tokens=max_tokens, temperature=temperature, **kwargs
+                            )) as chunks:
+                                async for text in chunks:
+                                    output.append(text)
+                                    yield LLMMessage(content_delta=text, content="".join(output))
+                                    if stop_condition is not None:
+                                        elements.extend(parser.feed(text))
+                                        if stop_condition(elements):
+                                            break
+                        latency = time.perf_counter() - request_started
+                        response_text = "".join(output)
+                        # Only a fully consumed Anthropic stream reports usage; otherwise estimate it.
+                        if reported_usage:
+                            permit.usage = reported_usage[-1]
+                        elif isinstance(client, ReplayClient):
+                            permit.usage = client.usage(system, messages, response_text)
+                        else:
+                            permit.usage = LLMUsage(
+                                input_tokens=estimate_tokens(system, messages, 0), output_tokens=len(response_text) // 4
+                            )
+                    metrics.succeeded.inc()
+                    metrics.latency.observe(latency)
+                    usage = self._record_usage(current_provider, permit.usage, stage)
+                    if self.cost_router is not None:
+                        self.cost_router.record(current_provider, stage, latency, usage)
+                    if attempt_span is not None:
+                        attempt_span.set(input_tokens=usage.input_tokens, output_tokens=usage.output_tokens)
+                        attempt_span.finish()
+                    self._record_response(current_provider, system, messages, response_text, latency, usage)
+                    self._log_call(current_provider, cached=False, usage=usage, stage=stage)
+                    yield LLMMessage(content="".join(output), content_delta="", response_finished=True)
+                    return
+                except Exception as e:
+                    last_error = e
+                    metrics.failed.inc()
+                    if attempt_span is not None:
+                        attempt_span.finish(e)
+                    # Only retry before anything was streamed; afterwards fail over.
+                    if output or not is_transient_error(e) or retries >= breaker.config.max_retries or not breaker.available():
+                        break
+                    metrics.transient_retries.inc()
+                    await asyncio.sleep(retry_delay(retries, breaker.config.retry_base_delay, breaker.config.retry_max_delay))
+                    retries += 1
+            if provider:
+                raise Exception(f"Specified provider {provider} failed")
+            metrics.failovers.inc()
+            output = []
+        raise Exception(f"All providers failed. Last error: {str(last_error)}")
+        
+    def _rate_limit(self, provider: str, system: Optional[str], messages: List[dict], max_tokens: int):
+        limiter = self.rate_limiters.get(provider)
+        if limiter is None:
+            return nullcontext(RatePermit())
+        # With several rotated keys a Retry-After only concerns the key that got
+        # it, which the key pool ejects on its own.
+        pool = self.key_pools.get(provider)
+        return limiter.acquire(
+            estimate_tokens(system, messages, max_tokens),
+            honour_retry_after=pool is None or len(pool.keys) == 1,
+        )
+
+    async def _complete(
+        self,
+        provider: str,
+        messages: List[dict],
+        system: Optional[str],
+        max_tokens: int,
+        temperature: float,
+        enable_cache: bool,
+        stop_condition: Optional[Callable[[List[XMLElement]], bool]] = None,
+        stage: Optional[str] = None,
+    ) -> Tuple[str, LLMUsage]:
+        """
+        Internal method that sends a non-streaming request to `provider` through
+        its rate limiter, circuit breaker and API key pool. Rate-limited requests
+        wait and retry on the same provider (on another key, if it has several),
+        and transient errors are retried with jittered exponential backoff while
+        the circuit stays closed, before the error is raised.
         
+        Returns:
+            Tuple[str, LLMUsage]: Raw response text and its priced token usage
+        """
+        limiter = self.rate_limiters.get(provider)
+        pool = self.key_pools.get(provider)
+        if limiter is not None:
+            max_retries = limiter.config.max_retries
+        else:
+            # Without a limiter, a 429 is still worth retrying on the other keys.
+            max_retries = len(pool.keys) - 1 if pool is not None else 0
+        breaker = self.breakers[provider]
+        metrics = self.metrics[provider]
+        attempt = 0
+        transient_attempt = 0
         while True:
             try:
-                client = self.clients[current_provider]
-                config: LLMProviderConfig = getattr(self, current_provider)
-                
-                if current_provider == "anthropic":
-                    stream_func = self._stream_anthropic
-                    kwargs = {"system": system, "messages": messages}
+                with span("llm.attempt", provider=provider, model=getattr(self, provider).model,
+                          attempt=attempt + transient_attempt) as attempt_span:
+                    async with self._rate_limit(provider, system, messages, max_tokens) as permit:
+                        request_started = time.perf_counter()
+                        with breaker.call():
+                            response_text, permit.usage = await self._request(
+                                provider, messages, system, max_tokens, temperature, enable_cache, stop_condition
+                            )
+                        latency = time.perf_counter() - request_started
+                        self.latencies[provider].record(latency)
+                    if attempt_span is not None:
+                        attempt_span.set(
+                            queued=round(request_started - attempt_span.start, 4),
+                            input_tokens=permit.usage.input_tokens,
+                            output_tokens=permit.usage.output_tokens,
+                        )
+                metrics.succeeded.inc()
+                metrics.latency.observe(latency)
+                usage = self._record_usage(provider, permit.usage, stage)
+                if self.cost_router is not None:
+                    self.cost_router.record(provider, stage, latency, usage)
+                self._record_response(provider, system, messages, response_text, latency, usage)
+                return response_text, usage
+            except Exception as e:
+                metrics.failed.inc()
+                # With every key ejected there is nothing to retry on; fail over instead.
+                if is_rate_limit_error(e) and attempt < max_retries and not isinstance(e, AllKeysRateLimitedException):
+                    metrics.rate_limit_retries.inc()
+                    attempt += 1
+                elif is_transient_error(e) and transient_attempt < breaker.config.max_retries and breaker.available():
+                    metrics.transient_retries.inc()
+                    await asyncio.sleep(retry_delay(
+                        transient_attempt, breaker.config.retry_base_delay, breaker.config.retry_max_delay
+                    ))
+                    transient_attempt += 1
                 else:
-                    stream_func = self._stream_openai
-                    kwargs = {"messages": [{"role": "system", "content": system}] + messages} if system else {"messages": messages}
-                
-                async for text in stream_func(client, config.model, max_tokens=max_tokens, temperature=temperature, **kwargs):
-                    output.append(text)
-                    yield LLMMessage(content_delta=text, content="".join(output))
-                break
-            except Exception:
-                if provider:
-                    raise Exception(f"Specified provider {provider} failed")
+                    raise
+
+    async def _request(
+        self,
+        provider: str,
+        messages: List[dict],
+        system: Optional[str],
+        max_tokens: int,
+        temperature: float,
+        enable_cache: bool,
+        stop_condition: Optional[Callable[[List[XMLElement]], bool]] = None,
+    ) -> Tuple[str, LLMUsage]:
+        """
+        Internal method that sends a single request to `provider`. With a
+        `stop_condition` the response is streamed and the stream is closed as
+        soon as the condition holds; token usage is then partly estimated, as
+        providers only report it once a response has finished.
+        
+        Returns:
+            Tuple[str, LLMUsage]: Raw response text and token usage
+        """
+        client: AsyncOpenAI|AsyncAnthropic|ReplayClient = self.clients[provider]
+        config: LLMProviderConfig = getattr(self, provider)
+        if isinstance(client, ReplayClient):
+            if stop_condition is None:
+                return await client.complete(system, messages)
+            async with aclosing(client.stream(system, messages)) as chunks:
+                response_text = await read_until(chunks, stop_condition)
+            return response_text, client.usage(system, messages, response_text)
+        if provider == "anthropic":
+            if enable_cache:
+                system, messages = with_cache_control(system, messages)
+            params = dict(
+                model=config.model,
+                messages=messages,
+                max_tokens=max_tokens,
+                temperature=temperature,
+            )
+            if system:
+                params["system"] = system
+            if stop_condition is None:
+                response = await client.messages.create(**params)
+                return response.content[0].text, usage_from_response(response.usage)
+            async with client.messages.stream(**params) as stream:
+                response_text = await read_until(stream.text_stream, stop_condition)
+                usage = usage_from_response(stream.current_message_snapshot.usage)
+            usage.output_tokens = max(usage.output_tokens, len(response_text) // 4)
+            return response_text, usage
+        
+        if system:
+            messages = [{"role": "system", "content": system}] + messages
+        
+        _messages = []
+        for message in messages:
+            if isinstance(message['content'], list):
+                content = "\n\n".join([msg['text'] for msg in message['content']])
+                _messages.append({"role": message['role'], "content": content})
+            elif isinstance(message['content'], str):
+                _messages.append({"role": message['role'], "content": message['content']})
+        
+        pool = self.key_pools[provider]
+        async with pool.lease() as key:
+            if stop_condition is None:
+                response = await key.client.chat.completions.create(
+                    model=config.model,
+                    messages=_messages,
+                    max_tokens=max_tokens,
+                    temperature=temperature,
+                )
+                response_text, usage = response.choices[0].message.content, usage_from_response(response.usage)
+            else:
+                stream = await key.client.chat.completions.create(
+                    stream=True,
+                    model=config.model,
+                    messages=_messages,
+                    max_tokens=max_tokens,
+                    temperature=temperature,
+                )
                 try:
-                    current_provider, _ = await self._try_next_provider(current_index)
-                    current_index += 1
-                    output = []
-                except Exception as e:
-                    raise Exception(f"All providers failed. Last error: {str(e)}")
+                    response_text = await read_until(
+                        (chunk.choices[0].delta.content async for chunk in stream if chunk.choices), stop_condition
+                    )
+                finally:
+                    await stream.close()
+                usage = LLMUsage(
+                    input_tokens=estimate_tokens(None, _messages, 0),
+                    output_tokens=len(response_text) // 4,
+                )
+        pool.record(key, usage)
+        return response_text, usage
+
+    def cache_stats(self) -> Optional[dict]:
+        return self.response_cache.stats() if self.response_cache is not None else None
+
+    def hedge_stats(self) -> Dict[str, Any]:
+        return {
+            **self.hedge_policy.stats(),
+            "delays": {
+                provider: round(self.hedge_policy.delay(window), 3)
+                for provider, window in self.latencies.items()
+            },
+        }
         
-        yield LLMMessage(content="".join(output), content_delta="", response_finished=True)
+    async def _generate_hedged(
+        self,
+        messages: List[dict],
+        extractor_function: Optional[Callable],
+        system: Optional[str],
+        max_tokens: int,
+        temperature: float,
+        enable_cache: bool,
+        stop_condition: Optional[Callable[[List[XMLElement]], bool]] = None,
+        stage: Optional[str] = None,
+    ) -> Tuple[str, str, Any, LLMUsage]:
+        """
+        Internal method that races providers in priority order. If the running
+        provider has not answered within the hedge policy's delay, the same request
+        is also sent to the next provider (at most once per request, within the
+        policy's budget); a provider that fails is replaced by the next one as in
+        normal failover. The first response that passes `extractor_function` wins
+        and every other attempt is cancelled.
         
+        Returns:
+            Tuple[str, str, Any, LLMUsage]: Winning provider, raw response text,
+                extracted output and token usage
+        """
+        policy = self.hedge_policy
+        policy.record_request()
+        candidates = self._route(stage=stage, input_tokens=estimate_tokens(system, messages, 0), max_tokens=max_tokens)
+        pending: Dict[asyncio.Task, str] = {}
+        last_error: Optional[Exception] = None
+        hedged = False
+        started_at = 0.0
+
+        async def attempt(provider: str) -> Tuple[str, str, Any, LLMUsage]:
+            response_text, usage = await self._complete(
+                provider=provider,
+                messages=messages,
+                system=system,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                enable_cache=enable_cache,
+                stop_condition=stop_condition,
+                stage=stage,
+            )
+            return provider, response_text, self._extract(extractor_function, response_text), usage
+
+        def launch() -> str:
+            nonlocal started_at
+            provider = candidates.pop(0)
+            pending[asyncio.create_task(attempt(provider))] = provider
+            started_at = time.perf_counter()
+            return provider
+
+        running = launch()
+        try:
+            while pending:
+                timeout = None
+                if not hedged and candidates:
+                    elapsed = time.perf_counter() - started_at
+                    timeout = max(0.0, policy.delay(self.latencies[running]) - elapsed)
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    hedged = True
+                    if policy.try_spend():
+                        self.metrics[running].hedges.inc()
+                        launch()
+                    continue
+                for task in done:
+                    failed_provider = pending.pop(task)
+                    if task.exception() is None:
+                        return task.result()
+                    last_error = task.exception()
+                    self.metrics[failed_provider].failovers.inc()
+                if not pending and candidates:
+                    running = launch()
+        finally:
+            for task in pending:
+                task.cancel()
+        raise Exception(f"All providers failed. Last error: {str(last_error)}")
+
     async def generate(
         self, 
         messages: List[dict], 
@@ -208,7 +790,11 @@ class LLMConnector:
         max_tokens: int = 2049, 
         enable_cache: bool = False,
         temperature: float = 0.3,
-        provider: Optional[str] = None
+        provider: Optional[str] = None,
+        use_cache: bool = True,
+        hedge: Optional[bool] = None,
+        stop_condition: Optional[Callable[[List[XMLElement]], bool]] = None,
+        stage: Optional[str] = None,
     ):
         """
         Generates complete LLM responses with optional output processing.
@@ -218,9 +804,19 @@ class LLMConnector:
             extractor_function (Callable, optional): Function to process raw LLM output
             system (str, optional): System prompt for the LLM
             max_tokens (int): Maximum tokens in response
-            enable_cache (bool): Whether to enable response caching
+            enable_cache (bool): Whether to enable Anthropic prompt caching, which
+                places cache breakpoints on the system prompt and the conversation prefix
             temperature (float): Sampling temperature
             provider (str, optional): Specific provider to use
+            use_cache (bool): Whether to serve and store the raw response in the
+                response cache, if one is configured
+            hedge (bool, optional): Whether to hedge the request across providers.
+                Defaults to hedging when the connector has a `hedge_policy`
+            stop_condition (Callable, optional): Predicate over the elements parsed
+                so far (see `src.xml_stream`); the response is streamed and cut off
+                as soon as it holds
+            stage (str, optional): Pipeline stage the call belongs to, for usage
+                accounting and cost routing
             
         Returns:
             Union[str, Any]: Raw LLM response or processed output if extractor provided
@@ -228,83 +824,70 @@ class LLMConnector:
         Raises:
             Exception: If all configured providers fail
         """
-        current_index = 0
-        current_provider = provider if provider in self.provider_priority else self.provider_priority[0]
+        with span("llm.generate", extractor=getattr(extractor_function, "__name__", None)) as generate_span:
+            cache_keys = {}
+            response_text = None
+            if use_cache and self.response_cache is not None:
+                candidates = [provider] if provider in self.provider_priority else self.provider_priority
+                for candidate in candidates:
+                    config: LLMProviderConfig = getattr(self, candidate)
+                    key_parts = dict(
+                        provider=candidate, model=config.model, system=system,
+                        messages=messages, temperature=temperature, max_tokens=max_tokens,
+                    )
+                    if stop_condition is not None:
+                        key_parts["stop_condition"] = stop_condition.__name__
+                    cache_keys[candidate] = make_cache_key(**key_parts)
+                found = await asyncio.to_thread(self.response_cache.find_first, list(cache_keys.values()))
+                if found is not None:
+                    cache_key, response_text = found
+                    current_provider = next(p for p, key in cache_keys.items() if key == cache_key)
+            cached = response_text is not None
+            usage = LLMUsage()
+            if hedge is None:
+                hedge = self.hedge_by_default
     
-        while True:
-            try:
-                client: AsyncOpenAI|AsyncAnthropic = self.clients[current_provider]
-                config: LLMProviderConfig = getattr(self, current_provider)
-                if current_provider == "anthropic":
-                    if enable_cache:
-                        response = await client.beta.prompt_caching.messages.create(
-                            model=config.model,
+            route = [] if cached else self._route(provider, stage, estimate_tokens(system, messages, 0), max_tokens)
+            if hedge and not provider and len(route) > 1:
+                current_provider, response_text, output, usage = await self._generate_hedged(
+                    messages=messages,
+                    extractor_function=extractor_function,
+                    system=system,
+                    max_tokens=max_tokens,
+                    temperature=temperature,
+                    enable_cache=enable_cache,
+                    stop_condition=stop_condition,
+                    stage=stage,
+                )
+            else:
+                last_error = None
+                for current_provider in route:
+                    try:
+                        response_text, usage = await self._complete(
+                            provider=current_provider,
                             messages=messages,
-                            max_tokens=max_tokens,
-                            temperature=temperature,
-                            extra_headers={"anthropic-beta": "prompt-caching-2024-07-31"}
-                        )
-                    else:
-                        response = await client.messages.create(
-                            model=config.model,
                             system=system,
-                            messages=messages,
                             max_tokens=max_tokens,
                             temperature=temperature,
+                            enable_cache=enable_cache,
+                            stop_condition=stop_condition,
+                            stage=stage,
                         )
-                    response_text = response.content[0].text
-                
+                        break
+                    except Exception as e:
+                        last_error = e
+                        if provider:
+                            raise Exception(f"Specified provider {provider} failed")
+                        self.metrics[current_provider].failovers.inc()
                 else:
-                    if current_provider == "groq":
-                        api_keys_array = get_env_array("GROQ_API_KEYS")
-                        if api_keys_array:   
-                            _api_key = random.choice(api_keys_array)
-                            print("Using API Key: ", _api_key)
-                            client: AsyncOpenAI = AsyncOpenAI(
-                                api_key=_api_key,
-                                base_url="https://api.groq.com/openai/v1"
-                            )
-                        else:
-                            print("GROQ_API_KEYS environment variable not found or invalid string array. Using default API key.")
-                            
-                    if current_provider == "mistral":
-                        api_keys_array = get_env_array("MISTRAL_API_KEYS")
-                        if api_keys_array:   
-                            _api_key = random.choice(api_keys_array)
-                            print("Using API Key: ", _api_key)
-                            client: AsyncOpenAI = AsyncOpenAI(
-                                api_key=_api_key,
-                                base_url="https://api.mistral.ai/v1"
-                            )
-                        else:
-                            print("MISTRAL_API_KEYS environment variable not found or invalid string array. Using default API key.")
-                                
-                    if system:
-                        messages = [{"role": "system", "content": system}] + messages
-                    
-                    _messages = []
-                    for message in messages:
-                        if isinstance(message['content'], list):
-                            content = "\n\n".join([msg['text'] for msg in message['content']])
-                            _messages.append({"role": message['role'], "content": content})
-                        elif isinstance(message['content'], str):
-                            _messages.append({"role": message['role'], "content": message['content']})
-                    
-                    messages = _messages    
-                    response = await client.chat.completions.create(
-                        model=config.model,
-                        messages=messages,
-                        max_tokens=max_tokens,
-                        temperature=temperature,
-                    )
-                    response_text = response.choices[0].message.content
-                break
-            except Exception:
-                if provider:
-                    raise Exception(f"Specified provider {provider} failed")
-                try:
-                    current_provider, _ = await self._try_next_provider(current_index)
-                    current_index += 1
-                except Exception as e:
-                    raise Exception(f"All providers failed. Last error: {str(e)}")         
-        return extractor_function(response_text) if extractor_function else response_text
+                    if not cached:
+                        raise Exception(f"All providers failed. Last error: {str(last_error)}")
+                output = self._extract(extractor_function, response_text)
+            # Only cache responses the extractor accepted, so a malformed response is
+            # not served again on the next attempt.
+            if not cached and current_provider in cache_keys:
+                await asyncio.to_thread(self.response_cache.set, cache_keys[current_provider], response_text)
+            if generate_span is not None:
+                generate_span.set(provider=current_provider, cached=cached)
+            self._log_call(current_provider, cached, usage, stage)
+            return output
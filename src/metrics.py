@@ -0,0 +1,321 @@
+"""
+Process-wide metrics in the Prometheus text exposition format.
+
+Metrics are module-level objects updated in place from the event loop. A
+labelled metric creates one child per label combination on first use and keeps
+it, so hot paths bind their children once (see `ProviderMetrics`) and an update
+is then a plain attribute increment, without locks or allocations. Gauges can
+instead read their value from a function when the metrics are rendered.
+"""
+import math
+from bisect import bisect_left
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)) + "}"
+
+
+class _CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self) -> None:
+        self.value = 0
+
+    def inc(self, amount: float = 1) -> None:
+        self.value += amount
+
+
+class _GaugeChild:
+    __slots__ = ("value", "function")
+
+    def __init__(self) -> None:
+        self.value = 0
+        self.function: Optional[Callable[[], float]] = None
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def inc(self, amount: float = 1) -> None:
+        self.value += amount
+
+    def dec(self, amount: float = 1) -> None:
+        self.value -= amount
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        """Reads the value from `function` whenever the metrics are rendered."""
+        self.function = function
+
+    def get(self) -> float:
+        return self.function() if self.function is not None else self.value
+
+
+class _HistogramChild:
+    __slots__ = ("upper_bounds", "counts", "sum")
+
+    def __init__(self, upper_bounds: Tuple[float, ...]) -> None:
+        self.upper_bounds = upper_bounds
+        # One count per bucket (not cumulative) plus the overflow bucket.
+        self.counts = [0] * (len(upper_bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.upper_bounds, value)] += 1
+        self.sum += value
+
+
+class _Metric:
+    kind = ""
+    child_class = _CounterChild
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.children: Dict[Tuple[str, ...], object] = {}
+        if not self.labelnames:
+            self.children[()] = self._new_child()
+
+    def _new_child(self):
+        return self.child_class()
+
+    def labels(self, *values: str):
+        """Returns the child for these label values, creating it on first use."""
+        child = self.children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}, got {values}")
+            child = self.children[values] = self._new_child()
+        return child
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"] + self._samples()
+
+
+class Counter(_Metric):
+    kind = "counter"
+    child_class = _CounterChild
+
+    def inc(self, amount: float = 1) -> None:
+        self.children[()].inc(amount)
+
+    def _samples(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(child.value)}"
+            for values, child in list(self.children.items())
+        ]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+    child_class = _GaugeChild
+
+    def set(self, value: float) -> None:
+        self.children[()].set(value)
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        self.children[()].set_function(function)
+
+    def _samples(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(child.get())}"
+            for values, child in list(self.children.items())
+        ]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ) -> None:
+        self.upper_bounds = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self) -> _HistogramChild:
+        return _HistogramChild(self.upper_bounds)
+
+    def observe(self, value: float) -> None:
+        self.children[()].observe(value)
+
+    def _samples(self) -> List[str]:
+        lines = []
+        names = self.labelnames + ("le",)
+        for values, child in list(self.children.items()):
+            cumulative = 0
+            for upper_bound, count in zip(self.upper_bounds + (math.inf,), list(child.counts)):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(names, values + (_format_value(upper_bound),))} {cumulative}")
+            labels = _format_labels(self.labelnames, values)
+            lines.append(f"{self.name}_sum{labels} {_format_value(child.sum)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self) -> None:
+        self.metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(
+        self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS
+    ) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        """Renders every metric in the Prometheus text exposition format."""
+        lines = []
+        for metric in list(self.metrics.values()):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+HTTP_REQUESTS = REGISTRY.counter(
+    "mathforge_http_requests_total", "HTTP requests by route and status code", ("method", "route", "status")
+)
+HTTP_REQUEST_SECONDS = REGISTRY.histogram(
+    "mathforge_http_request_seconds", "HTTP request latency by route", ("method", "route")
+)
+STAGE_SECONDS = REGISTRY.histogram(
+    "mathforge_stage_seconds", "Wall time of pipeline stages", ("stage",)
+)
+
+LLM_REQUESTS = REGISTRY.counter(
+    "mathforge_llm_requests_total", "LLM API requests by outcome", ("provider", "model", "outcome")
+)
+LLM_REQUEST_SECONDS = REGISTRY.histogram(
+    "mathforge_llm_request_seconds", "Latency of successful LLM API requests", ("provider", "model")
+)
+LLM_TOKENS = REGISTRY.counter(
+    "mathforge_llm_tokens_total", "LLM tokens by direction (input, output, cache_read, cache_write)",
+    ("provider", "model", "direction")
+)
+LLM_COST = REGISTRY.counter(
+    "mathforge_llm_cost_usd_total", "Spend on LLM tokens, for providers with pricing configured", ("provider", "model")
+)
+STAGE_TOKENS = REGISTRY.counter(
+    "mathforge_stage_tokens_total", "LLM tokens by pipeline stage and direction", ("stage", "direction")
+)
+STAGE_COST = REGISTRY.counter(
+    "mathforge_stage_cost_usd_total", "Spend on LLM tokens by pipeline stage", ("stage",)
+)
+LLM_RETRIES = REGISTRY.counter(
+    "mathforge_llm_retries_total", "Requests retried on the same provider, by reason", ("provider", "reason")
+)
+LLM_FAILOVERS = REGISTRY.counter(
+    "mathforge_llm_failovers_total", "Requests given up on a provider after its retries, to fail over to the next one", ("provider",)
+)
+LLM_HEDGES = REGISTRY.counter(
+    "mathforge_llm_hedges_total", "Hedged requests sent to a second provider", ("provider",)
+)
+EXTRACTION_FAILURES = REGISTRY.counter(
+    "mathforge_extraction_failures_total", "LLM responses the stage's extractor rejected", ("extractor",)
+)
+
+SANDBOX_EXECUTIONS = REGISTRY.counter(
+    "mathforge_sandbox_executions_total", "Sandbox executions by outcome (ok, error, timeout, rejected)", ("outcome",)
+)
+SANDBOX_EXECUTION_SECONDS = REGISTRY.histogram(
+    "mathforge_sandbox_execution_seconds", "Sandbox execution time, excluding the wait for a worker"
+)
+SANDBOX_QUEUE_DEPTH = REGISTRY.gauge(
+    "mathforge_sandbox_queue_depth", "Executions waiting for a sandbox worker"
+)
+SANDBOX_BUSY_WORKERS = REGISTRY.gauge(
+    "mathforge_sandbox_busy_workers", "Sandbox workers currently running code"
+)
+
+CACHE_LOOKUPS = REGISTRY.counter(
+    "mathforge_cache_lookups_total", "Cache lookups by result (hit, miss)", ("cache", "result")
+)
+CACHE_HIT_RATIO = REGISTRY.gauge(
+    "mathforge_cache_hit_ratio", "Fraction of cache lookups that were hits since startup", ("cache",)
+)
+CIRCUIT_OPEN = REGISTRY.gauge(
+    "mathforge_circuit_open", "1 while a provider's circuit breaker is not closed", ("provider",)
+)
+
+
+class ProviderMetrics:
+    """The metric children of one provider and model, bound once so recording them allocates nothing."""
+    __slots__ = (
+        "succeeded", "failed", "latency", "input_tokens", "output_tokens", "cache_read_tokens",
+        "cache_write_tokens", "cost", "rate_limit_retries", "transient_retries", "failovers", "hedges",
+    )
+
+    def __init__(self, provider: str, model: str) -> None:
+        self.succeeded = LLM_REQUESTS.labels(provider, model, "ok")
+        self.failed = LLM_REQUESTS.labels(provider, model, "error")
+        self.latency = LLM_REQUEST_SECONDS.labels(provider, model)
+        self.input_tokens = LLM_TOKENS.labels(provider, model, "input")
+        self.output_tokens = LLM_TOKENS.labels(provider, model, "output")
+        self.cache_read_tokens = LLM_TOKENS.labels(provider, model, "cache_read")
+        self.cache_write_tokens = LLM_TOKENS.labels(provider, model, "cache_write")
+        self.cost = LLM_COST.labels(provider, model)
+        self.rate_limit_retries = LLM_RETRIES.labels(provider, "rate_limit")
+        self.transient_retries = LLM_RETRIES.labels(provider, "transient")
+        self.failovers = LLM_FAILOVERS.labels(provider)
+        self.hedges = LLM_HEDGES.labels(provider)
+
+    def record_usage(self, usage) -> None:
+        self.input_tokens.inc(usage.input_tokens)
+        self.output_tokens.inc(usage.output_tokens)
+        self.cache_read_tokens.inc(usage.cache_read_input_tokens)
+        self.cache_write_tokens.inc(usage.cache_creation_input_tokens)
+        self.cost.inc(usage.cost)
+
+
+class StageMetrics:
+    """The token and cost metric children of one pipeline stage."""
+    __slots__ = ("input_tokens", "output_tokens", "cache_read_tokens", "cache_write_tokens", "cost")
+
+    def __init__(self, stage: str) -> None:
+        self.input_tokens = STAGE_TOKENS.labels(stage, "input")
+        self.output_tokens = STAGE_TOKENS.labels(stage, "output")
+        self.cache_read_tokens = STAGE_TOKENS.labels(stage, "cache_read")
+        self.cache_write_tokens = STAGE_TOKENS.labels(stage, "cache_write")
+        self.cost = STAGE_COST.labels(stage)
+
+    def record_usage(self, usage) -> None:
+        self.input_tokens.inc(usage.input_tokens)
+        self.output_tokens.inc(usage.output_tokens)
+        self.cache_read_tokens.inc(usage.cache_read_input_tokens)
+        self.cache_write_tokens.inc(usage.cache_creation_input_tokens)
+        self.cost.inc(usage.cost)
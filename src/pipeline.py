@@ -0,0 +1,68 @@
+import time
+import asyncio
+from src.tracing import span
+from src.metrics import STAGE_SECONDS
+from typing import Any, Awaitable, Callable, Dict, Iterable, Tuple
+
+
+class StageGraph:
+    """
+    A small dependency graph of async pipeline stages.
+
+    Each stage is a coroutine function that receives the results of the stages it
+    depends on as keyword arguments, named after those stages. `run()` starts every
+    stage as soon as its dependencies have finished, so independent stages overlap,
+    and records the wall time of each stage (plus `total`) in `timings` and in
+    the `mathforge_stage_seconds` metric, and traces each stage as a span.
+    """
+    def __init__(self) -> None:
+        self.stages: Dict[str, Tuple[Callable[..., Awaitable[Any]], Tuple[str, ...]]] = {}
+        self.timings: Dict[str, float] = {}
+
+    def add(self, name: str, func: Callable[..., Awaitable[Any]], depends_on: Iterable[str] = ()) -> "StageGraph":
+        self.stages[name] = (func, tuple(depends_on))
+        return self
+
+    async def timed(self, name: str, awaitable: Awaitable[Any]) -> Any:
+        """Awaits `awaitable` and records its wall time under `name`."""
+        start = time.perf_counter()
+        try:
+            with span(f"stage.{name}"):
+                return await awaitable
+        finally:
+            elapsed = time.perf_counter() - start
+            self.timings[name] = round(elapsed, 4)
+            STAGE_SECONDS.labels(name).observe(elapsed)
+
+    async def _run_stage(self, name: str, tasks: Dict[str, asyncio.Task]) -> Any:
+        func, depends_on = self.stages[name]
+        inputs = {dependency: await tasks[dependency] for dependency in depends_on}
+        return await self.timed(name, func(**inputs))
+
+    async def run(self) -> Dict[str, Any]:
+        """
+        Runs every stage and returns their results keyed by stage name.
+
+        Raises:
+            ValueError: If a stage depends on a stage that was never added
+            Exception: The first exception raised by any stage; all other
+                stages are cancelled
+        """
+        for name, (_, depends_on) in self.stages.items():
+            missing = [dependency for dependency in depends_on if dependency not in self.stages]
+            if missing:
+                raise ValueError(f"Stage {name} depends on unknown stages: {missing}")
+
+        start = time.perf_counter()
+        tasks: Dict[str, asyncio.Task] = {}
+        for name in self.stages:
+            tasks[name] = asyncio.create_task(self._run_stage(name, tasks))
+        try:
+            results = await asyncio.gather(*tasks.values())
+        finally:
+            for task in tasks.values():
+                task.cancel()
+            elapsed = time.perf_counter() - start
+            self.timings["total"] = round(elapsed, 4)
+            STAGE_SECONDS.labels("total").observe(elapsed)
+        return dict(zip(tasks, results))
@@ -0,0 +1,222 @@
+import os
+import time
+import json
+import asyncio
+import sqlite3
+import threading
+from contextlib import asynccontextmanager
+from typing import Any, Callable, Dict, List, Optional
+from src.schema import RateLimitConfig, LLMUsage
+
+
+def estimate_tokens(system: Optional[str], messages: List[dict], max_tokens: int) -> int:
+    """Rough pre-flight token estimate (4 characters per token) used to reserve TPM budget."""
+    chars = len(system or "")
+    for message in messages:
+        content = message["content"]
+        if isinstance(content, list):
+            chars += sum(len(block.get("text", "")) for block in content)
+        else:
+            chars += len(content)
+    return chars // 4 + max_tokens
+
+def is_rate_limit_error(error: Exception) -> bool:
+    return getattr(error, "status_code", None) == 429
+
+def retry_after_seconds(error: Exception) -> Optional[float]:
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    value = headers.get("retry-after")
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+class MemoryRateLimitBackend:
+    """Keeps limiter state in process memory."""
+    def __init__(self) -> None:
+        self._states: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    def transact(self, key: str, initial: dict, update: Callable[[dict], Any]) -> Any:
+        with self._lock:
+            state = self._states.setdefault(key, dict(initial))
+            return update(state)
+
+
+class SQLiteRateLimitBackend:
+    """
+    Keeps limiter state in a SQLite file so every process on the host (e.g. all
+    uvicorn workers) draws from the same per-provider budgets. Each update runs
+    in an immediate transaction, which serialises concurrent writers.
+    """
+    def __init__(self, path: str) -> None:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS rate_limit_state (key TEXT PRIMARY KEY, state TEXT NOT NULL)")
+        self._lock = threading.Lock()
+
+    def transact(self, key: str, initial: dict, update: Callable[[dict], Any]) -> Any:
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._db.execute("SELECT state FROM rate_limit_state WHERE key = ?", (key,)).fetchone()
+                state = json.loads(row[0]) if row else dict(initial)
+                result = update(state)
+                self._db.execute(
+                    "INSERT OR REPLACE INTO rate_limit_state (key, state) VALUES (?, ?)",
+                    (key, json.dumps(state))
+                )
+                self._db.execute("COMMIT")
+                return result
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+
+
+class RatePermit:
+    """Handed out by `ProviderRateLimiter.acquire()`; carries the response usage back."""
+    def __init__(self) -> None:
+        self.usage: Optional[LLMUsage] = None
+
+
+class ProviderRateLimiter:
+    """
+    Token-bucket rate limiter and concurrency governor for a single provider.
+
+    Requests and tokens per minute are each metered by a bucket holding one
+    minute's budget. Callers wait in `acquire()` until both buckets can cover
+    the request and a concurrency slot is free, rather than being sent to the
+    provider only to be rejected. Limits adapt AIMD-style: a 429 halves the
+    effective rate and concurrency (honouring `Retry-After`), and every success
+    raises them again by `increase_step` up to the configured values.
+
+    Bucket state lives in `backend`, so a `SQLiteRateLimitBackend` shares
+    budgets across processes. Backend transactions run in a worker thread, since
+    waiting on another process's lock would otherwise block the event loop. The
+    concurrency cap applies per process.
+    """
+    def __init__(self, provider: str, config: RateLimitConfig, backend=None) -> None:
+        self.provider = provider
+        self.config = config
+        self.backend = backend or MemoryRateLimitBackend()
+        self.factor = 1.0
+        self.in_flight = 0
+        self._slot_released: Optional[asyncio.Condition] = None
+        self._initial = {
+            "requests": float(config.requests_per_minute or 0),
+            "tokens": float(config.tokens_per_minute or 0),
+            "updated_at": time.time(),
+            "factor": 1.0,
+            "blocked_until": 0.0,
+        }
+
+    def _limits(self) -> Dict[str, float]:
+        limits = {}
+        if self.config.requests_per_minute:
+            limits["requests"] = self.config.requests_per_minute
+        if self.config.tokens_per_minute:
+            limits["tokens"] = self.config.tokens_per_minute
+        return limits
+
+    def _try_take(self, state: dict, tokens: int) -> float:
+        now = time.time()
+        elapsed = max(0.0, now - state["updated_at"])
+        state["updated_at"] = now
+        self.factor = state["factor"]
+        if now < state["blocked_until"]:
+            return state["blocked_until"] - now
+
+        costs = {"requests": 1, "tokens": tokens}
+        wait = 0.0
+        for name, limit in self._limits().items():
+            capacity = limit * state["factor"]
+            refill_per_second = capacity / 60
+            state[name] = min(capacity, state[name] + elapsed * refill_per_second)
+            cost = min(costs[name], capacity)
+            if state[name] < cost:
+                wait = max(wait, (cost - state[name]) / refill_per_second)
+        if wait > 0:
+            return wait
+        for name in self._limits():
+            state[name] -= costs[name]
+        return 0.0
+
+    def _concurrency_limit(self) -> Optional[int]:
+        if not self.config.max_concurrency:
+            return None
+        return max(1, int(self.config.max_concurrency * self.factor))
+
+    async def _acquire_slot(self) -> None:
+        if self._slot_released is None:
+            self._slot_released = asyncio.Condition()
+        async with self._slot_released:
+            while self._concurrency_limit() is not None and self.in_flight >= self._concurrency_limit():
+                await self._slot_released.wait()
+            self.in_flight += 1
+
+    async def _release_slot(self) -> None:
+        async with self._slot_released:
+            self.in_flight -= 1
+            self._slot_released.notify_all()
+
+    async def _transact(self, update: Callable[[dict], Any]) -> Any:
+        return await asyncio.to_thread(self.backend.transact, self.provider, self._initial, update)
+
+    async def _on_success(self, reserved_tokens: int, usage: Optional[LLMUsage]) -> None:
+        def update(state: dict) -> None:
+            state["factor"] = min(1.0, state["factor"] + self.config.increase_step)
+            if usage is not None and self.config.tokens_per_minute:
+                # Settle the pre-flight reservation against the real token count.
+                state["tokens"] -= (usage.input_tokens + usage.output_tokens) - reserved_tokens
+            self.factor = state["factor"]
+        await self._transact(update)
+
+    async def on_rate_limited(self, retry_after: Optional[float] = None) -> None:
+        def update(state: dict) -> None:
+            state["factor"] = max(self.config.min_rate_fraction, state["factor"] * 0.5)
+            state["requests"] = min(state["requests"], 0.0)
+            if retry_after:
+                state["blocked_until"] = max(state["blocked_until"], time.time() + retry_after)
+            self.factor = state["factor"]
+        await self._transact(update)
+
+    @asynccontextmanager
+    async def acquire(self, estimated_tokens: int = 0, honour_retry_after: bool = True):
+        """
+        Waits for budget and a concurrency slot, then holds the slot for the
+        duration of the request. Set `permit.usage` to the response's `LLMUsage`
+        to settle the token reservation; a 429 raised inside the block shrinks
+        the limits, and also pauses the provider for its `Retry-After` unless
+        `honour_retry_after` is False (e.g. when the 429 only concerns one of
+        several rotated API keys).
+        """
+        await self._acquire_slot()
+        try:
+            while True:
+                wait = await self._transact(lambda state: self._try_take(state, estimated_tokens))
+                if wait <= 0:
+                    break
+                await asyncio.sleep(min(wait, 5.0))
+
+            permit = RatePermit()
+            try:
+                yield permit
+            except Exception as e:
+                if is_rate_limit_error(e):
+                    await self.on_rate_limited(retry_after_seconds(e) if honour_retry_after else None)
+                raise
+            await self._on_success(estimated_tokens, permit.usage)
+        finally:
+            await self._release_slot()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "factor": round(self.factor, 3),
+            "in_flight": self.in_flight,
+            "max_concurrency": self._concurrency_limit(),
+        }
@@ -0,0 +1,173 @@
+import os
+import math
+import json
+import time
+import random
+import asyncio
+import threading
+from src.cache import make_cache_key
+from src.schema import LLMUsage, ReplayConfig
+from typing import AsyncIterator, Dict, List, Optional
+
+
+class ReplayError(Exception):
+    """A synthetic or missing-recording error; `status_code` lets retries and circuit breakers treat it like an API error."""
+    def __init__(self, message: str, status_code: int) -> None:
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def _message_text(content) -> str:
+    if isinstance(content, list):
+        return "\n\n".join(block.get("text", "") for block in content)
+    return content
+
+def request_key(system: Optional[str], messages: List[dict]) -> str:
+    """Identifies a request by its prompts alone, so a recording replays whatever provider or model made it."""
+    return make_cache_key(
+        system=system or "",
+        messages=[{"role": m["role"], "content": _message_text(m["content"])} for m in messages],
+    )
+
+def system_key(system: Optional[str]) -> str:
+    return make_cache_key(system=system or "")
+
+
+class RecordingStore:
+    """
+    Append-only JSONL file of recorded LLM responses.
+
+    Each line holds the request key, the prompts, the response text, the
+    provider and model that produced it, its latency and token usage. Lines are
+    appended as responses are recorded and the whole file is indexed on load.
+    """
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self._by_request: Dict[str, List[dict]] = {}
+        self._by_system: Dict[str, List[dict]] = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        self._index(json.loads(line))
+                    except json.JSONDecodeError:
+                        continue
+
+    def __len__(self) -> int:
+        return sum(len(recordings) for recordings in self._by_request.values())
+
+    def _index(self, recording: dict) -> None:
+        self._by_request.setdefault(recording["key"], []).append(recording)
+        self._by_system.setdefault(recording["system_key"], []).append(recording)
+
+    def record(
+        self,
+        system: Optional[str],
+        messages: List[dict],
+        response: str,
+        provider: str,
+        model: str,
+        latency: float,
+        usage: Optional[LLMUsage] = None,
+    ) -> None:
+        recording = {
+            "key": request_key(system, messages),
+            "system_key": system_key(system),
+            "system": system,
+            "messages": messages,
+            "response": response,
+            "provider": provider,
+            "model": model,
+            "latency": round(latency, 4),
+            "usage": (usage or LLMUsage()).model_dump(),
+            "recorded_at": time.time(),
+        }
+        with self._lock:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.path, "a") as f:
+                f.write(json.dumps(recording, ensure_ascii=False, default=str) + "\n")
+            self._index(recording)
+
+    def lookup(self, system: Optional[str], messages: List[dict], match_system_prompt: bool = True) -> Optional[dict]:
+        """
+        Returns the recording of this exact request or, with
+        `match_system_prompt`, one made for the same system prompt (i.e. the
+        same pipeline stage). Among several candidates the choice is a fixed
+        function of the request, so replays are deterministic.
+        """
+        key = request_key(system, messages)
+        candidates = self._by_request.get(key)
+        if not candidates and match_system_prompt:
+            candidates = self._by_system.get(system_key(system))
+        if not candidates:
+            return None
+        return candidates[int(key, 16) % len(candidates)]
+
+
+class ReplayClient:
+    """
+    Serves responses from a `RecordingStore` in place of a provider's API, with
+    the synthetic latency and error rate of its `ReplayConfig`.
+    """
+    def __init__(self, config: ReplayConfig, store: Optional[RecordingStore] = None) -> None:
+        self.config = config
+        self.store = store or RecordingStore(config.recordings_path)
+        self.random = random.Random(config.seed)
+
+    def _latency(self, recording: dict) -> float:
+        config = self.config
+        if config.latency_distribution == "recorded":
+            latency = recording.get("latency", config.latency_mean)
+        elif config.latency_distribution == "uniform":
+            latency = self.random.uniform(
+                max(0.0, config.latency_mean - config.latency_stddev), config.latency_mean + config.latency_stddev
+            )
+        elif config.latency_distribution == "normal":
+            latency = self.random.gauss(config.latency_mean, config.latency_stddev)
+        elif config.latency_distribution == "lognormal" and config.latency_mean > 0:
+            # Parameterised by the mean and standard deviation of the latency itself.
+            sigma2 = math.log(1 + config.latency_stddev ** 2 / config.latency_mean ** 2)
+            latency = self.random.lognormvariate(math.log(config.latency_mean) - sigma2 / 2, math.sqrt(sigma2))
+        else:
+            latency = config.latency_mean
+        return max(0.0, latency * config.latency_scale)
+
+    def _resolve(self, system: Optional[str], messages: List[dict]) -> dict:
+        if self.random.random() < self.config.error_rate:
+            raise ReplayError(
+                f"Injected replay error ({self.config.error_status_code})", self.config.error_status_code
+            )
+        recording = self.store.lookup(system, messages, self.config.match_system_prompt)
+        if recording is None:
+            raise ReplayError("No recording matches this request", 404)
+        return recording
+
+    def _usage(self, recording: dict, system: Optional[str], messages: List[dict], text: str) -> LLMUsage:
+        if text == recording["response"] and recording.get("usage"):
+            return LLMUsage(**recording["usage"])
+        chars = len(system or "") + sum(len(_message_text(m["content"])) for m in messages)
+        return LLMUsage(input_tokens=chars // 4, output_tokens=len(text) // 4)
+
+    async def complete(self, system: Optional[str], messages: List[dict]) -> tuple:
+        """Returns `(text, usage)` of the matching recording after its synthetic latency."""
+        recording = self._resolve(system, messages)
+        await asyncio.sleep(self._latency(recording))
+        return recording["response"], self._usage(recording, system, messages, recording["response"])
+
+    async def stream(self, system: Optional[str], messages: List[dict]) -> AsyncIterator[str]:
+        """Yields the matching recording in `stream_chunk_chars` pieces, spreading its latency over them."""
+        recording = self._resolve(system, messages)
+        text = recording["response"]
+        size = max(1, self.config.stream_chunk_chars)
+        chunks = [text[i:i + size] for i in range(0, len(text), size)] or [""]
+        delay = self._latency(recording) / len(chunks)
+        for chunk in chunks:
+            await asyncio.sleep(delay)
+            yield chunk
+
+    def usage(self, system: Optional[str], messages: List[dict], text: str) -> LLMUsage:
+        recording = self.store.lookup(system, messages, self.config.match_system_prompt) or {"response": None}
+        return self._usage(recording, system, messages, text)
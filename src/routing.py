@@ -0,0 +1,62 @@
+import math
+from typing import Dict, Optional, Tuple
+from src.hedging import LatencyWindow
+from src.schema import CostRoutingConfig, LLMUsage, ModelPricing
+
+
+class CostRouter:
+    """
+    Prefers the cheapest provider that meets a stage's latency SLO.
+
+    For every stage with an SLO, providers whose recent latency percentile for
+    that stage is within the SLO are tried before the ones that are not, and
+    among each group the one with the lowest expected cost comes first. The
+    expected cost prices the request's estimated input tokens plus the stage's
+    average output length; providers without pricing go last, in priority order.
+    """
+    def __init__(self, config: Optional[CostRoutingConfig] = None) -> None:
+        self.config = config or CostRoutingConfig()
+        self.latencies: Dict[Tuple[str, str], LatencyWindow] = {}
+        self.output_tokens: Dict[str, float] = {}
+        self.samples: Dict[str, int] = {}
+
+    def routes(self, stage: Optional[str]) -> bool:
+        return stage is not None and stage in self.config.stage_latency_slo
+
+    def record(self, provider: str, stage: Optional[str], latency: float, usage: LLMUsage) -> None:
+        if stage is None:
+            return
+        self.latencies.setdefault((provider, stage), LatencyWindow()).record(latency)
+        # Running mean of the stage's output length, which depends on the stage more than on the provider.
+        count = self.samples.get(stage, 0) + 1
+        mean = self.output_tokens.get(stage, 0.0)
+        self.output_tokens[stage] = mean + (usage.output_tokens - mean) / count
+        self.samples[stage] = count
+
+    def meets_slo(self, provider: str, stage: str) -> bool:
+        window = self.latencies.get((provider, stage))
+        if window is None or len(window) < self.config.min_samples:
+            return True
+        return window.percentile(self.config.latency_percentile) <= self.config.stage_latency_slo[stage]
+
+    def expected_cost(self, stage: str, pricing: Optional[ModelPricing], input_tokens: int, max_tokens: int) -> float:
+        if pricing is None:
+            return math.inf
+        output_tokens = round(self.output_tokens[stage]) if stage in self.output_tokens else max_tokens
+        return pricing.cost(LLMUsage(input_tokens=input_tokens, output_tokens=output_tokens))
+
+    def stats(self) -> Dict[str, dict]:
+        return {
+            stage: {
+                "latency_slo": slo,
+                "mean_output_tokens": round(self.output_tokens.get(stage, 0.0), 1),
+                "providers": {
+                    provider: {
+                        "latency_percentile": window.percentile(self.config.latency_percentile),
+                        "meets_slo": self.meets_slo(provider, stage),
+                    }
+                    for (provider, window_stage), window in self.latencies.items() if window_stage == stage
+                },
+            }
+            for stage, slo in self.config.stage_latency_slo.items()
+        }
@@ -1,31 +1,88 @@
+import math
+import time
+import asyncio
 from src.schema import MCQType
-from typing import List, Optional, Tuple
+from src.cache import TieredCache, make_cache_key
+from src.executor import SandboxPool
+from src.hedging import HedgePolicy
+from src.rate_limiter import SQLiteRateLimitBackend
+from src.pipeline import StageGraph
+from src.tracing import span
+from src.metrics import EXTRACTION_FAILURES, STAGE_SECONDS
+from src.dedup import ExactDuplicateIndex, NearDuplicateIndex, deduplicate_questions
+from src.dataset_store import DatasetStore
+from src.xml_stream import StreamingTagParser, stop_after, stop_after_code
+from typing import AsyncIterator, Callable, Dict, List, Optional, Tuple
 from prompts.verifier import VERIFIER_INSTRUCTION
 from prompts.distractor import DISTRACATOR_INSTRUCTION
 from src.utils import (extract_from_solver, remove_print_statements, extract_question, 
-safe_exec, format_result, extract_distractors, extract_from_verifier, extract_multi_level_questions)
+extract_distractors, extract_from_verifier, extract_multi_level_questions, verifier_complete, normalized_code_key)
+from src.replay import RecordingStore
 from src.llm_connector import (LLMConnector, AnthropicConfig,  
-TogetherConfig, MistralConfig, GroqConfig, OpenAIConfig, GoogleConfig)
+TogetherConfig, MistralConfig, GroqConfig, OpenAIConfig, GoogleConfig, ReplayConfig)
 from prompts.solver import SYMBOLIC_SOLVER_INSTRUCTION, STATEMENT_SOLVER_INSTRUCTION
-from src.schema import SolverOutput, Option, FinalOutput, QuestionBank, DifficultyLevel, MultiLevelQuestionBank
+from src.schema import (SolverOutput, Option, FinalOutput, QuestionBank, DifficultyLevel, 
+MultiLevelQuestionBank, SolutionTask, BatchSolutionResult, CircuitBreakerConfig, SolutionEvent,
+CostRoutingConfig, LLMUsage, UsageSummary)
 from prompts.base import (INPUT_TEMPLATE, DISTRACTOR_TEMPLATE, VERIFIER_TEMPLATE, 
-QUESTION_GENERATION_TEMPLATE, QUESTION_EXTENSION_ASSISTANT_TEMPLATE, QUESTION_EXTENSION_USER_TEMPLATE, MULTI_LEVEL_QUESTION_GENERATION_TEMPLATE)
+QUESTION_GENERATION_TEMPLATE, QUESTION_EXTENSION_ASSISTANT_TEMPLATE, QUESTION_EXTENSION_USER_TEMPLATE, MULTI_LEVEL_QUESTION_GENERATION_TEMPLATE,
+QUESTION_FOCUS_USER_TEMPLATE, QUESTION_FOCUS_AREAS)
 from prompts.questionaire import QUESTION_GENERATION_INSTRUCTION, MULTI_DIFFICULTY_QUESTION_GENERATION_INSTRUCTION
 
 
+# Stages missing here (solve, and verify, which may rewrite the solution) get the
+# full `max_tokens`, so long symbolic solutions are not truncated; early stopping
+# still ends them once the code block is complete.
+DEFAULT_STAGE_MAX_TOKENS = {
+    "distractors": 512,
+    "questions": 4096,
+    "multi_level_questions": 5049,
+}
+
+# Each stage's response is cut off as soon as everything its extractor needs has arrived.
+STAGE_STOP_CONDITIONS = {
+    "solve": stop_after_code(["solve_problem", "actual_params"]),
+    "verify": verifier_complete,
+    "distractors": stop_after("option", count=5),
+    "questions": stop_after("questions"),
+    "multi_level_questions": stop_after("easy-questions", "medium-questions", "hard-questions"),
+}
+
+
 class MathForge:
     def __init__(
         self, 
         max_tokens: int = 3049,
+        stage_max_tokens: Dict[str, int] | None = None,
+        early_stop: bool = True,
         temperature: float = 0.3,
         code_execution_timeout: int = 5,
+        max_concurrency: int = 8,
+        near_duplicate_dedup: bool = False,
+        dedup_normalize_numbers: bool = False,
+        sandbox_pool_size: int = 4,
+        sandbox_max_queue: int = 64,
+        sandbox_cpu_time_limit: Optional[int] = 10,
+        sandbox_memory_limit_mb: Optional[int] = 1024,
+        sandbox_warm_workers: bool = True,
+        sandbox_max_jobs_per_worker: Optional[int] = 200,
         groq: GroqConfig | None = None,
         openai: OpenAIConfig | None = None,
         google: GoogleConfig | None = None,
         mistral: MistralConfig | None = None,
         together: TogetherConfig | None = None,
         anthropic: AnthropicConfig | None = None,
-        provider_priority: List[str] = ["anthropic", "google", "together", "openai", "groq", "mistral"]
+        replay: ReplayConfig | None = None,
+        provider_priority: List[str] = ["anthropic", "google", "together", "openai", "groq", "mistral"],
+        response_cache: TieredCache | None = None,
+        execution_cache: TieredCache | None = None,
+        enable_prompt_cache: bool = True,
+        rate_limit_state_path: str | None = None,
+        hedge_policy: HedgePolicy | None = None,
+        circuit_breaker: CircuitBreakerConfig | None = None,
+        dataset_store: DatasetStore | None = None,
+        recording_path: str | None = None,
+        cost_routing: CostRoutingConfig | None = None,
     ) -> None:
         self.llm = LLMConnector(
             groq=groq,
@@ -34,23 +91,186 @@ class MathForge:
             mistral=mistral,
             together=together,
             anthropic=anthropic,
-            provider_priority=provider_priority
+            replay=replay,
+            response_cache=response_cache,
+            provider_priority=provider_priority,
+            rate_limit_backend=SQLiteRateLimitBackend(rate_limit_state_path) if rate_limit_state_path else None,
+            hedge_policy=hedge_policy,
+            circuit_breaker=circuit_breaker,
+            recorder=RecordingStore(recording_path) if recording_path else None,
+            cost_routing=cost_routing,
         )
         self.max_tokens = max_tokens
+        self.stage_max_tokens = {**DEFAULT_STAGE_MAX_TOKENS, **(stage_max_tokens or {})}
+        self.early_stop = early_stop
+        self.execution_cache = execution_cache
+        self.execution_seconds_saved = 0.0
+        self.dataset_store = dataset_store
+        self.topic_usage: Dict[str, LLMUsage] = {}
         self.temperature = temperature
         self.code_execution_timeout = code_execution_timeout
+        self.max_concurrency = max_concurrency
+        self.near_duplicate_dedup = near_duplicate_dedup
+        self.dedup_normalize_numbers = dedup_normalize_numbers
+        self.enable_prompt_cache = enable_prompt_cache
+        self.sandbox = SandboxPool(
+            size=sandbox_pool_size,
+            max_queue=sandbox_max_queue,
+            cpu_time_limit=sandbox_cpu_time_limit,
+            memory_limit_mb=sandbox_memory_limit_mb,
+            warm=sandbox_warm_workers,
+            max_jobs_per_worker=sandbox_max_jobs_per_worker,
+        )
+
+    @classmethod
+    def from_settings(cls, settings, dataset_store: DatasetStore | None = None) -> "MathForge":
+        """
+        Builds a MathForge from a `config.Settings`, the way the API and the
+        bulk-generation CLI run it. Providers without an API key are left out,
+        and with `settings.replay` set every request goes to the replay provider.
+        """
+        provider_configs = {
+            "anthropic": (AnthropicConfig, settings.anthropic_api_key, settings.anthropic_primary_model),
+            "google": (GoogleConfig, settings.google_api_key, settings.google_primary_model),
+            "together": (TogetherConfig, settings.together_api_key, settings.together_primary_model),
+            "openai": (OpenAIConfig, settings.openai_api_key, settings.openai_primary_model),
+            "groq": (GroqConfig, settings.groq_api_key, settings.groq_primary_model),
+            "mistral": (MistralConfig, settings.mistral_api_key, settings.mistral_primary_model),
+        }
+        providers = {
+            name: config_class(
+                api_key=api_key,
+                model=model,
+                rate_limit=settings.provider_rate_limits.get(name),
+                pricing=settings.provider_pricing.get(name),
+            ) if api_key else None
+            for name, (config_class, api_key, model) in provider_configs.items()
+        }
+        return cls(
+            max_tokens=settings.max_tokens,
+            stage_max_tokens=settings.stage_max_tokens,
+            early_stop=settings.early_stop,
+            temperature=settings.temperature,
+            code_execution_timeout=settings.code_execution_timeout,
+            max_concurrency=settings.solution_concurrency,
+            near_duplicate_dedup=settings.near_duplicate_dedup,
+            dedup_normalize_numbers=settings.dedup_normalize_numbers,
+            sandbox_pool_size=settings.sandbox_pool_size,
+            sandbox_max_queue=settings.sandbox_max_queue,
+            sandbox_cpu_time_limit=settings.sandbox_cpu_time_limit,
+            sandbox_memory_limit_mb=settings.sandbox_memory_limit_mb,
+            sandbox_warm_workers=settings.sandbox_warm_workers,
+            sandbox_max_jobs_per_worker=settings.sandbox_max_jobs_per_worker,
+            **providers,
+            replay=ReplayConfig(**settings.replay) if settings.replay is not None else None,
+            provider_priority=["replay"] if settings.replay is not None else settings.provider_priority,
+            recording_path=settings.record_responses_path,
+            enable_prompt_cache=settings.anthropic_prompt_cache,
+            rate_limit_state_path=settings.rate_limit_state_path,
+            response_cache=TieredCache(
+                namespace="llm_responses",
+                db_path=settings.response_cache_path,
+                ttl=settings.response_cache_ttl,
+                max_entries=settings.response_cache_max_entries,
+            ) if settings.response_cache_enabled else None,
+            execution_cache=TieredCache(
+                namespace="executions",
+                db_path=settings.response_cache_path,
+                max_entries=settings.execution_cache_max_entries,
+            ) if settings.execution_cache_enabled else None,
+            hedge_policy=HedgePolicy(
+                percentile=settings.hedge_percentile,
+                min_delay=settings.hedge_min_delay,
+                max_hedge_ratio=settings.hedge_max_ratio,
+            ) if settings.hedge_requests else None,
+            circuit_breaker=CircuitBreakerConfig(**settings.circuit_breaker),
+            cost_routing=CostRoutingConfig(**settings.cost_routing) if settings.cost_routing is not None else None,
+            dataset_store=dataset_store,
+        )
+
+    async def start(self) -> None:
+        await self.sandbox.start()
+
+    def close(self) -> None:
+        self.sandbox.close()
 
-    async def execute_solution(self, code_output: SolverOutput):
-        solve_function_namespace = await safe_exec(
+    def _stage_params(self, stage: str) -> dict:
+        """Stage name, output-token budget and early-stop condition of a pipeline stage."""
+        return {
+            "stage": stage,
+            "max_tokens": self.stage_max_tokens.get(stage, self.max_tokens),
+            "stop_condition": STAGE_STOP_CONDITIONS.get(stage) if self.early_stop else None,
+        }
+
+    def question_index(self) -> ExactDuplicateIndex | NearDuplicateIndex:
+        """
+        A fresh index for deduplicating generated questions: exact repeats only,
+        or near-duplicates if `near_duplicate_dedup` is on, in which case
+        `dedup_normalize_numbers` also treats questions differing only in their
+        numbers as duplicates.
+        """
+        if self.near_duplicate_dedup:
+            return NearDuplicateIndex(normalize_numbers=self.dedup_normalize_numbers)
+        return ExactDuplicateIndex()
+
+    def _record_topic_usage(self, topic: Optional[str], usage: Optional[UsageSummary]) -> None:
+        if topic is not None and usage is not None:
+            self.topic_usage[topic] = self.topic_usage.get(topic, LLMUsage()).add(usage.total)
+
+    def usage_stats(self) -> Dict[str, dict]:
+        """Cumulative token usage and cost in total and per provider, pipeline stage and topic."""
+        total = LLMUsage()
+        for usage in self.llm.usage.values():
+            total = total.add(usage)
+        return {
+            "total": total.model_dump(),
+            "providers": self.llm.usage_stats(),
+            "stages": self.llm.stage_usage_stats(),
+            "topics": {topic: usage.model_dump() for topic, usage in self.topic_usage.items()},
+        }
+
+    async def execute_solution(self, code_output: SolverOutput, use_cache: bool = True):
+        """
+        Runs solver code in the sandbox. Successful results are cached under the
+        normalised AST of the code, so re-running a solution that only differs in
+        comments, prints or formatting does not execute it again. With `use_cache`
+        off the code is always executed.
+        """
+        code = remove_print_statements(code_output.code)
+        disallowed_global_vars = ['settings', 'llm']
+        disallowed_names = ['os', 'sys', 'eval', 'exec']
+        cache_key = None
+        if use_cache and self.execution_cache is not None:
+            normalized_code = normalized_code_key(code)
+            if normalized_code is not None:
+                cache_key = make_cache_key(
+                    code=normalized_code,
+                    disallowed_names=disallowed_names,
+                    disallowed_global_vars=disallowed_global_vars,
+                )
+                cached = await asyncio.to_thread(self.execution_cache.get, cache_key)
+                if cached is not None:
+                    self.execution_seconds_saved += cached["seconds"]
+                    with span("execution_cache.hit", seconds_saved=cached["seconds"]):
+                        return cached["result"]
+
+        started = time.perf_counter()
+        result = await self.sandbox.run(
+            code=code,
             timeout=self.code_execution_timeout,
-            disallowed_global_vars=['settings', 'llm'],
-            disallowed_names=['os', 'sys', 'eval', 'exec'],
-            code=remove_print_statements(code_output.code),
+            disallowed_names=disallowed_names,
+            disallowed_global_vars=disallowed_global_vars,
         )
-        actual_params = solve_function_namespace.get('actual_params')
-        solve_function = solve_function_namespace.get('solve_problem')
-        correct_answer = solve_function(**actual_params)
-        return format_result(correct_answer)
+        if cache_key is not None:
+            await asyncio.to_thread(
+                self.execution_cache.set, cache_key, {"result": result, "seconds": round(time.perf_counter() - started, 4)},
+            )
+        return result
+
+    def execution_cache_stats(self) -> Optional[dict]:
+        if self.execution_cache is None:
+            return None
+        return {**self.execution_cache.stats(), "seconds_saved": round(self.execution_seconds_saved, 3)}
     
     async def generate_multi_level_questions(
         self,
@@ -58,20 +278,34 @@ class MathForge:
         description: str,
         temperature: float = 0.3,
         provider: Optional[str] = None,
+        use_cache: bool = True,
     ) -> MultiLevelQuestionBank:
-        return await self.llm.generate(
-            provider=provider,
-            temperature=temperature,
-            max_tokens=self.max_tokens,
-            extractor_function=extract_multi_level_questions,
-            system=MULTI_DIFFICULTY_QUESTION_GENERATION_INSTRUCTION,
-            messages=[{
-                "role": "user",
-                "content": MULTI_LEVEL_QUESTION_GENERATION_TEMPLATE.format(
-                    topic=tagname, chapter_overview=description,
-                )
-            }],
-        )
+        started = time.perf_counter()
+        with self.llm.track_calls() as calls, span("multi_level_questions", topic=tagname):
+            question_bank = await self.llm.generate(
+                provider=provider,
+                temperature=temperature,
+                **self._stage_params("multi_level_questions"),
+                use_cache=use_cache,
+                enable_cache=self.enable_prompt_cache,
+                extractor_function=extract_multi_level_questions,
+                system=MULTI_DIFFICULTY_QUESTION_GENERATION_INSTRUCTION,
+                messages=[{
+                    "role": "user",
+                    "content": MULTI_LEVEL_QUESTION_GENERATION_TEMPLATE.format(
+                        topic=tagname, chapter_overview=description,
+                    )
+                }],
+            )
+        STAGE_SECONDS.labels("multi_level_questions").observe(time.perf_counter() - started)
+        for level in (question_bank.easy_questions, question_bank.medium_questions, question_bank.hard_questions):
+            for kind, items in level.model_dump().items():
+                setattr(level, kind, deduplicate_questions(items, self.question_index()))
+        question_bank.usage = UsageSummary.from_calls(calls)
+        self._record_topic_usage(tagname, question_bank.usage)
+        if self.dataset_store is not None:
+            self.dataset_store.add_multi_level_questions(question_bank, topic=tagname, calls=calls)
+        return question_bank
 
     async def generate_questions(
         self,
@@ -82,9 +316,74 @@ class MathForge:
         mcq_type: str = MCQType.NUMERICAL,
         difficulty_level: str = DifficultyLevel.EASY,
         provider: Optional[str] = None,
+        parallel: bool = False,
+        use_cache: bool = True,
+    ) -> QuestionBank:
+        """
+        Generates `num_questions` questions on a topic, as one growing conversation
+        or, with `parallel`, as concurrent sub-batches. With `use_cache` off no LLM
+        response is served from the response cache, so the questions are fresh.
+        """
+        started = time.perf_counter()
+        with self.llm.track_calls() as calls, span("questions", topic=tagname, parallel=parallel):
+            generate = self._generate_questions_parallel if parallel else self._generate_questions
+            question_bank = await generate(
+                tagname=tagname,
+                provider=provider,
+                mcq_type=mcq_type,
+                description=description,
+                temperature=temperature,
+                num_questions=num_questions,
+                difficulty_level=difficulty_level,
+                use_cache=use_cache,
+            )
+        STAGE_SECONDS.labels("questions").observe(time.perf_counter() - started)
+        question_bank.usage = UsageSummary.from_calls(calls)
+        self.record_questions(question_bank, tagname, difficulty_level, mcq_type, calls)
+        return question_bank
+
+    def record_questions(
+        self,
+        question_bank: QuestionBank,
+        tagname: str,
+        difficulty_level: str,
+        mcq_type: str,
+        calls: Optional[List[dict]] = None,
+    ) -> None:
+        """
+        Adds generated questions to the dataset store, if one is configured,
+        and their `usage` to the topic's totals.
+        """
+        self._record_topic_usage(tagname, question_bank.usage)
+        if self.dataset_store is not None:
+            self.dataset_store.add_questions(
+                question_bank, topic=tagname, difficulty_level=difficulty_level, mcq_type=mcq_type, calls=calls or (),
+            )
+
+    async def _generate_questions(
+        self,
+        tagname: str,
+        description: str,
+        num_questions: int,
+        temperature: float,
+        mcq_type: str,
+        difficulty_level: str,
+        provider: Optional[str] = None,
+        use_cache: bool = True,
+        batch_size: int = 30,
+        max_rounds: int = 3,
     ) -> QuestionBank:
+        """
+        Generates questions in one conversation, asking for more until there are
+        `num_questions` distinct ones. Like the parallel path, it gives up after
+        `max_rounds` times the requests a shortfall-free run would need, and
+        returns what it has.
+        """
         thoughts = None
         all_questions = []
+        index = self.question_index()
+        max_requests = max_rounds * math.ceil(num_questions / batch_size)
+        requests = 0
         messages= [{
             "role": "user",
             "content": QUESTION_GENERATION_TEMPLATE.format(
@@ -92,22 +391,24 @@ class MathForge:
                 difficulty_level=difficulty_level, expected_answer_type=mcq_type
             )
         }]
-        while len(all_questions) < num_questions:
+        while len(all_questions) < num_questions and requests < max_requests:
+            requests += 1
             question_bank: QuestionBank = await self.llm.generate(
                 provider=provider,
                 messages=messages,
                 temperature=temperature,
-                max_tokens=self.max_tokens,
+                **self._stage_params("questions"),
+                use_cache=use_cache,
+                enable_cache=self.enable_prompt_cache,
                 extractor_function=extract_question,
                 system=QUESTION_GENERATION_INSTRUCTION,
             )
             if thoughts is None:
                 thoughts = question_bank.thoughts
 
-            all_questions.extend(question_bank.questions)
-            all_questions = list(set(all_questions))
-            if len(all_questions) < num_questions:
-                n = min(30, num_questions - len(all_questions))
+            all_questions.extend(q for q in question_bank.questions if index.add(q))
+            if len(all_questions) < num_questions and requests < max_requests:
+                n = min(batch_size, num_questions - len(all_questions))
                 messages.extend([{
                     "role": "assistant",
                     "content": QUESTION_EXTENSION_ASSISTANT_TEMPLATE.format(
@@ -122,21 +423,125 @@ class MathForge:
                         difficulty_level=difficulty_level, expected_answer_type=mcq_type
                     )
                 }])
-        if num_questions>30:
+        if num_questions>batch_size:
             return QuestionBank(thoughts=thoughts, questions=all_questions)
         else:
             return QuestionBank(thoughts=thoughts, questions=all_questions[:num_questions])
 
+    async def generate_question_batch(
+        self,
+        tagname: str,
+        description: str,
+        num_questions: int,
+        seed: int,
+        temperature: float = 0.3,
+        mcq_type: str = MCQType.NUMERICAL,
+        difficulty_level: str = DifficultyLevel.EASY,
+        provider: Optional[str] = None,
+        use_cache: bool = True,
+    ) -> QuestionBank:
+        """
+        Generates one independent batch of questions, steered towards the focus
+        area selected by `seed`. Batches with different seeds can run in any order.
+        """
+        with self.llm.track_calls() as calls:
+            question_bank: QuestionBank = await self.llm.generate(
+                provider=provider,
+                temperature=temperature,
+                **self._stage_params("questions"),
+                use_cache=use_cache,
+                enable_cache=self.enable_prompt_cache,
+                extractor_function=extract_question,
+                system=QUESTION_GENERATION_INSTRUCTION,
+                messages=[{
+                    "role": "user",
+                    "content": QUESTION_FOCUS_USER_TEMPLATE.format(
+                        topic=tagname, chapter_overview=description, n=num_questions, seed=seed,
+                        difficulty_level=difficulty_level, expected_answer_type=mcq_type,
+                        focus=QUESTION_FOCUS_AREAS[seed % len(QUESTION_FOCUS_AREAS)],
+                    )
+                }],
+            )
+        question_bank.usage = UsageSummary.from_calls(calls)
+        return question_bank
+
+    async def _generate_questions_parallel(
+        self,
+        tagname: str,
+        description: str,
+        num_questions: int,
+        temperature: float,
+        mcq_type: str,
+        difficulty_level: str,
+        provider: Optional[str] = None,
+        use_cache: bool = True,
+        batch_size: int = 30,
+        max_rounds: int = 3,
+    ) -> QuestionBank:
+        """
+        Generates questions as independent sub-batches issued concurrently instead
+        of one growing conversation. Each sub-batch is steered towards a different
+        focus area and, unless `provider` is given, sent to a different configured
+        provider. Results are merged and deduplicated, and further rounds top up
+        any shortfall left by failed or overlapping batches.
+        """
+        thoughts = None
+        all_questions: List[str] = []
+        index = self.question_index()
+        providers = [provider] if provider else self.llm.provider_priority
+        seed = 0
+
+        async def generate_batch(seed: int, n: int, batch_provider: Optional[str]) -> QuestionBank:
+            return await self.generate_question_batch(
+                tagname=tagname,
+                description=description,
+                num_questions=n,
+                seed=seed,
+                temperature=temperature,
+                mcq_type=mcq_type,
+                difficulty_level=difficulty_level,
+                provider=batch_provider,
+                use_cache=use_cache,
+            )
+
+        for round_index in range(max_rounds):
+            remaining = num_questions - len(all_questions)
+            if remaining <= 0:
+                break
+            num_batches = math.ceil(remaining / batch_size)
+            batches = []
+            for _ in range(num_batches):
+                # The first round spreads batches across providers; top-up rounds
+                # fall back to the normal priority order with failover.
+                batch_provider = providers[seed % len(providers)] if round_index == 0 or provider else None
+                batches.append(generate_batch(seed, min(batch_size, remaining), batch_provider))
+                seed += 1
+
+            for question_bank in await asyncio.gather(*batches, return_exceptions=True):
+                if isinstance(question_bank, Exception):
+                    print(f"Question batch failed: {str(question_bank)}")
+                    continue
+                if thoughts is None:
+                    thoughts = question_bank.thoughts
+                all_questions.extend(q for q in question_bank.questions if index.add(q))
+
+        if thoughts is None:
+            raise Exception("All question generation batches failed")
+        return QuestionBank(thoughts=thoughts, questions=all_questions[:num_questions])
+
     async def generate_distractors(
         self,
         correct_answer: str,
         temperature: float = 0.3,
         provider: Optional[str] = None,
+        use_cache: bool = True,
     ) -> List[Option]:
         distractors: List[str] = await self.llm.generate(
             provider=provider,
             temperature=temperature,
-            max_tokens=self.max_tokens,
+            **self._stage_params("distractors"),
+            use_cache=use_cache,
+            enable_cache=self.enable_prompt_cache,
             system=DISTRACATOR_INSTRUCTION,
             extractor_function=extract_distractors,
             messages=[{
@@ -153,12 +558,15 @@ class MathForge:
         solution_code: str,
         correct_answer: str,
         temperature: float = 0.3,
-        provider: Optional[str] = None
+        provider: Optional[str] = None,
+        use_cache: bool = True,
     ) -> Tuple[bool, SolverOutput]:
         return await self.llm.generate(
             provider=provider,
             temperature=temperature,
-            max_tokens=self.max_tokens,
+            **self._stage_params("verify"),
+            use_cache=use_cache,
+            enable_cache=self.enable_prompt_cache,
             system=VERIFIER_INSTRUCTION,
             extractor_function=extract_from_verifier,
             messages=[{
@@ -177,48 +585,267 @@ class MathForge:
         temperature: float = 0.3,
         verify_solution: bool = False,
         provider: Optional[str] = None,
+        on_event: Optional[Callable[[SolutionEvent], None]] = None,
+        topic: Optional[str] = None,
+        difficulty_level: Optional[str] = None,
+        use_cache: bool = True,
     ) -> FinalOutput:
+        """
+        Solves a question and builds its MCQ options.
+
+        The pipeline runs as a stage graph: distractors for the first executed
+        answer are generated speculatively while verification is still running.
+        If verification changes the answer they are cancelled, and any error they
+        raised is ignored, before distractors for the new answer are generated. Per-stage
+        wall times are returned in `FinalOutput.stage_timings` and token usage
+        per stage and provider in `FinalOutput.usage`.
+
+        If `on_event` is given, the solver response is streamed and every stage
+        reports its progress to it as a `SolutionEvent` (see `stream_solution`).
+
+        The result is added to the dataset store, if one is configured, under
+        the optional `topic` and `difficulty_level`. With `use_cache` off neither
+        LLM responses nor execution results are served from the caches.
+        """
         if mcq_type == MCQType.STATEMENT:
             system = STATEMENT_SOLVER_INSTRUCTION
         else:
             system = SYMBOLIC_SOLVER_INSTRUCTION
-        
-        code_output: SolverOutput = await self.llm.generate(
-            system=system,
-            provider=provider,
-            temperature=temperature,
-            max_tokens=self.max_tokens,
-            extractor_function=extract_from_solver,
-            messages=[{
-                "role": "user",
-                "content": INPUT_TEMPLATE.format(
-                    question=question, output_type=mcq_type
+        graph = StageGraph()
+        messages = [{
+            "role": "user",
+            "content": INPUT_TEMPLATE.format(
+                question=question, output_type=mcq_type
+            )
+        }]
+
+        def emit(event: str, stage: str, data=None) -> None:
+            if on_event is not None:
+                on_event(SolutionEvent(event=event, stage=stage, data=data))
+
+        def emit_distractors(stage: str, options: List[Option]) -> None:
+            for option in options:
+                emit("distractor", stage, option.output_result)
+
+        async def solve() -> SolverOutput:
+            if on_event is None:
+                return await self.llm.generate(
+                    system=system,
+                    provider=provider,
+                    messages=messages,
+                    temperature=temperature,
+                    **self._stage_params("solve"),
+                    use_cache=use_cache,
+                    enable_cache=self.enable_prompt_cache,
+                    extractor_function=extract_from_solver,
                 )
-            }],
-        )
-        correct_answer = await self.execute_solution(code_output)
-        if verify_solution:
+            response_text = ""
+            parser = StreamingTagParser()
+            async for message in self.llm.stream(
+                system=system,
+                provider=provider,
+                messages=messages,
+                temperature=temperature,
+                **self._stage_params("solve"),
+                enable_cache=self.enable_prompt_cache,
+            ):
+                if message.response_finished:
+                    response_text = message.content
+                elif message.content_delta:
+                    if len(message.content) == len(message.content_delta):
+                        # The stream failed over and restarted on another provider.
+                        parser = StreamingTagParser()
+                    emit("token", "solve", message.content_delta)
+                    for element in parser.feed(message.content_delta):
+                        if element.tag == "thoughts":
+                            emit("thoughts", "solve", element.content)
+            try:
+                with span("llm.extract", extractor=extract_from_solver.__name__):
+                    code_output = extract_from_solver(response_text)
+            except Exception:
+                EXTRACTION_FAILURES.labels(extract_from_solver.__name__).inc()
+                raise
+            emit("code", "solve", {"code": code_output.code, "thoughts": code_output.thoughts})
+            return code_output
+
+        # Distractors for the executed answer, started as soon as it is known. Not a
+        # graph stage, so that finalize can drop them without failing the graph.
+        speculative: Dict[str, asyncio.Task] = {}
+
+        async def execute(solve: SolverOutput) -> str:
+            correct_answer = await self.execute_solution(solve, use_cache=use_cache)
+            emit("execution", "execute", correct_answer)
+            speculative["distractors"] = asyncio.create_task(distractors(correct_answer))
+            return correct_answer
+
+        async def distractors(correct_answer: str) -> List[Option]:
+            options = await graph.timed(
+                "distractors",
+                self.generate_distractors(
+                    correct_answer, temperature=temperature, provider=provider, use_cache=use_cache,
+                )
+            )
+            emit_distractors("distractors", options)
+            return options
+
+        async def verify(solve: SolverOutput, execute: str) -> Tuple[SolverOutput, str]:
             need_update, new_code_output = await self.verify_solution(
                 question=question,
                 mcq_type=mcq_type,
                 provider=provider,
                 temperature=temperature,
-                correct_answer=correct_answer,
-                solution_code=code_output.code,
+                correct_answer=execute,
+                solution_code=solve.code,
+                use_cache=use_cache,
             )
             if need_update:
-                new_correct_answer = await self.execute_solution(code_output)
-                if new_correct_answer != correct_answer:
-                    code_output = new_code_output
-                    correct_answer = new_correct_answer
-                    
-        wrong_options = await self.generate_distractors(correct_answer, temperature=temperature, provider=provider)
-
-        return FinalOutput(
+                new_correct_answer = await graph.timed("reexecute", self.execute_solution(new_code_output, use_cache=use_cache))
+                if new_correct_answer != execute:
+                    emit("verification", "verify", {"need_update": True, "correct_answer": new_correct_answer})
+                    return new_code_output, new_correct_answer
+            emit("verification", "verify", {"need_update": need_update, "correct_answer": execute})
+            return solve, execute
+
+        async def finalize(
+            solve: SolverOutput, 
+            execute: str, 
+            verify: Optional[Tuple[SolverOutput, str]] = None
+        ) -> Tuple[SolverOutput, str, List[Option]]:
+            code_output, correct_answer = verify or (solve, execute)
+            if correct_answer == execute:
+                distractors = await speculative["distractors"]
+            else:
+                speculative["distractors"].cancel()
+                await asyncio.gather(speculative["distractors"], return_exceptions=True)
+                distractors = await graph.timed(
+                    "distractors_regenerated",
+                    self.generate_distractors(
+                        correct_answer, temperature=temperature, provider=provider, use_cache=use_cache,
+                    )
+                )
+                emit_distractors("distractors_regenerated", distractors)
+            return code_output, correct_answer, distractors
+
+        graph.add("solve", solve)
+        graph.add("execute", execute, depends_on=["solve"])
+        if verify_solution:
+            graph.add("verify", verify, depends_on=["solve", "execute"])
+            graph.add("finalize", finalize, depends_on=["solve", "execute", "verify"])
+        else:
+            graph.add("finalize", finalize, depends_on=["solve", "execute"])
+
+        with self.llm.track_calls() as calls:
+            try:
+                results = await graph.run()
+            finally:
+                # Verification may have failed while the speculative distractors were still running.
+                if "distractors" in speculative and not speculative["distractors"].done():
+                    speculative["distractors"].cancel()
+                    await asyncio.gather(speculative["distractors"], return_exceptions=True)
+        code_output, correct_answer, wrong_options = results["finalize"]
+        # Every other stage depends on the solver, so its call is logged first.
+        solver_call = calls[0] if calls else {}
+
+        output = FinalOutput(
             question=question,
             thoughts=code_output.thoughts,
             correct_answer=correct_answer,
+            stage_timings=graph.timings,
+            solution_code=code_output.code,
+            provider=solver_call.get("provider"),
+            model=solver_call.get("model"),
+            usage=UsageSummary.from_calls(calls),
             options=[Option(is_correct=True, output_result=correct_answer)] + wrong_options,
         )
+        self._record_topic_usage(topic, output.usage)
+        if self.dataset_store is not None:
+            self.dataset_store.add_solution(
+                output, mcq_type=mcq_type, topic=topic, difficulty_level=difficulty_level, verified=verify_solution,
+            )
+        return output
+
+    async def stream_solution(
+        self,
+        question: str,
+        mcq_type: MCQType,
+        temperature: float = 0.3,
+        verify_solution: bool = False,
+        provider: Optional[str] = None,
+        topic: Optional[str] = None,
+        difficulty_level: Optional[str] = None,
+        use_cache: bool = True,
+    ) -> AsyncIterator[SolutionEvent]:
+        """
+        Runs `generate_solution` and yields its progress as it happens:
+        `token` events with the solver's raw output, `thoughts` as soon as the
+        solver has closed its `<thoughts>` tag, then `code`, `execution`,
+        `verification` (if enabled) and one `distractor` event per option. If
+        verification changes the answer, the speculative distractors are replaced
+        by ones with stage `distractors_regenerated`. The stream ends with a
+        `result` event carrying the `FinalOutput`, or an `error` event. Closing
+        the iterator early cancels the remaining stages.
+        """
+        events: asyncio.Queue = asyncio.Queue()
+        task = asyncio.create_task(self.generate_solution(
+            question=question,
+            mcq_type=mcq_type,
+            provider=provider,
+            temperature=temperature,
+            verify_solution=verify_solution,
+            on_event=events.put_nowait,
+            topic=topic,
+            difficulty_level=difficulty_level,
+            use_cache=use_cache,
+        ))
+        task.add_done_callback(lambda _: events.put_nowait(None))
+        try:
+            while (event := await events.get()) is not None:
+                yield event
+            if task.exception() is not None:
+                yield SolutionEvent(event="error", data=str(task.exception()))
+            else:
+                yield SolutionEvent(event="result", data=task.result().model_dump())
+        finally:
+            task.cancel()
+
+    async def generate_solutions(
+        self,
+        tasks: List[SolutionTask],
+        temperature: float = 0.3,
+        verify_solution: bool = False,
+        provider: Optional[str] = None,
+        max_concurrency: Optional[int] = None,
+        use_cache: bool = True,
+    ) -> AsyncIterator[BatchSolutionResult]:
+        """
+        Solves a batch of questions concurrently, yielding each result as soon as
+        it completes. At most `max_concurrency` questions are in flight at once and
+        a failing question yields a result carrying its error instead of aborting
+        the batch.
+        """
+        semaphore = asyncio.Semaphore(max_concurrency or self.max_concurrency)
+
+        async def solve(index: int, task: SolutionTask) -> BatchSolutionResult:
+            async with semaphore:
+                try:
+                    output = await self.generate_solution(
+                        question=task.question,
+                        mcq_type=task.mcq_type,
+                        provider=provider,
+                        temperature=temperature,
+                        verify_solution=verify_solution,
+                        topic=task.topic,
+                        difficulty_level=task.difficulty_level,
+                        use_cache=use_cache,
+                    )
+                    return BatchSolutionResult(index=index, question=task.question, output=output)
+                except Exception as e:
+                    return BatchSolutionResult(index=index, question=task.question, error=str(e))
 
-        
+        pending = [asyncio.create_task(solve(index, task)) for index, task in enumerate(tasks)]
+        try:
+            for next_result in asyncio.as_completed(pending):
+                yield await next_result
+        finally:
+            for task in pending:
+                task.cancel()
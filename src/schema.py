@@ -1,6 +1,6 @@
 from enum import Enum
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import Any, Dict, List, Optional
 
     
 class MCQType(str, Enum):
@@ -13,6 +13,17 @@ class DifficultyLevel(str, Enum):
     MEDIUM = 'medium'
     HARD = 'hard'
 
+class JobStatus(str, Enum):
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    COMPLETED = 'completed'
+    FAILED = 'failed'
+
+class CircuitState(str, Enum):
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
 class SolverOutput(BaseModel):
     code: Optional[str] = None
     thoughts: Optional[str] = None
@@ -30,9 +41,94 @@ class LLMMessage(BaseModel):
     content_delta:     Optional[str] = None
     response_finished: bool = False
     
+class LLMUsage(BaseModel):
+    input_tokens:                int = 0
+    output_tokens:               int = 0
+    cache_read_input_tokens:     int = 0
+    cache_creation_input_tokens: int = 0
+    # In USD, for providers with `pricing` configured
+    cost:                        float = 0.0
+
+    def add(self, other: "LLMUsage") -> "LLMUsage":
+        return LLMUsage(**{field: getattr(self, field) + getattr(other, field) for field in LLMUsage.model_fields})
+
+class UsageSummary(BaseModel):
+    """Token usage and cost of one request, in total and per pipeline stage and provider."""
+    total:     LLMUsage = LLMUsage()
+    stages:    Dict[str, LLMUsage] = {}
+    providers: Dict[str, LLMUsage] = {}
+
+    @classmethod
+    def from_calls(cls, calls: List[dict]) -> "UsageSummary":
+        """Sums the `usage` of calls collected by `LLMConnector.track_calls`."""
+        summary = cls()
+        for call in calls:
+            usage = call["usage"]
+            stage = call.get("stage") or "other"
+            summary.total = summary.total.add(usage)
+            summary.stages[stage] = summary.stages.get(stage, LLMUsage()).add(usage)
+            summary.providers[call["provider"]] = summary.providers.get(call["provider"], LLMUsage()).add(usage)
+        return summary
+
+    def add(self, other: "UsageSummary") -> "UsageSummary":
+        def merge(a: Dict[str, LLMUsage], b: Dict[str, LLMUsage]) -> Dict[str, LLMUsage]:
+            return {key: a.get(key, LLMUsage()).add(b.get(key, LLMUsage())) for key in {**a, **b}}
+        return UsageSummary(
+            total=self.total.add(other.total),
+            stages=merge(self.stages, other.stages),
+            providers=merge(self.providers, other.providers),
+        )
+
+class ModelPricing(BaseModel):
+    """USD per million tokens. Cache reads and writes are billed at the input price unless set."""
+    input:       float = 0.0
+    output:      float = 0.0
+    cache_read:  Optional[float] = None
+    cache_write: Optional[float] = None
+
+    def cost(self, usage: LLMUsage) -> float:
+        cache_read = self.input if self.cache_read is None else self.cache_read
+        cache_write = self.input if self.cache_write is None else self.cache_write
+        return (
+            usage.input_tokens * self.input + usage.output_tokens * self.output
+            + usage.cache_read_input_tokens * cache_read + usage.cache_creation_input_tokens * cache_write
+        ) / 1_000_000
+
+class CostRoutingConfig(BaseModel):
+    # Latency SLO in seconds per pipeline stage, e.g. {"distractors": 5.0}; stages
+    # without one keep the `provider_priority` order
+    stage_latency_slo: Dict[str, float] = {}
+    latency_percentile: float = 0.95
+    # Until this many latencies of a provider for a stage are known it is assumed to meet the SLO
+    min_samples:        int = 5
+    
+class RateLimitConfig(BaseModel):
+    requests_per_minute: Optional[float] = None
+    tokens_per_minute:   Optional[float] = None
+    max_concurrency:     Optional[int] = None
+    max_retries:         int = 3
+    increase_step:       float = 0.05
+    min_rate_fraction:   float = 0.1
+
+class CircuitBreakerConfig(BaseModel):
+    window_size:            int = 20
+    window_seconds:         float = 120.0
+    min_calls:              int = 5
+    failure_rate_threshold: float = 0.5
+    open_seconds:           float = 30.0
+    half_open_max_calls:    int = 1
+    latency_alpha:          float = 0.2
+    slow_latency_factor:    float = 2.0
+    max_retries:            int = 2
+    retry_base_delay:       float = 0.5
+    retry_max_delay:        float = 8.0
+    
 class LLMProviderConfig(BaseModel):
     model:   str
     api_key: str
+    api_keys: List[str] = []
+    rate_limit: Optional[RateLimitConfig] = None
+    pricing: Optional[ModelPricing] = None
     
 class AnthropicConfig(LLMProviderConfig):
     pass
@@ -52,15 +148,48 @@ class GroqConfig(LLMProviderConfig):
 class MistralConfig(LLMProviderConfig):
     pass
 
+class ReplayConfig(LLMProviderConfig):
+    model:                str = "replay"
+    api_key:              str = "replay"
+    recordings_path:      str = ".cache/recordings.jsonl"
+    # 'fixed', 'uniform', 'normal', 'lognormal', or 'recorded' to replay the recorded latencies
+    latency_distribution: str = 'lognormal'
+    latency_mean:         float = 1.0
+    latency_stddev:       float = 0.5
+    latency_scale:        float = 1.0
+    error_rate:           float = 0.0
+    error_status_code:    int = 503
+    stream_chunk_chars:   int = 16
+    # Without an exact match, replay a response recorded for the same system prompt (pipeline stage)
+    match_system_prompt:  bool = True
+    seed:                 Optional[int] = None
+
 
 
 
 class SecurityException(Exception):
     pass
 
+class ExecutionException(Exception):
+    pass
+
+class ExecutionTimeoutException(ExecutionException):
+    pass
+
+class SandboxBusyException(ExecutionException):
+    pass
+
+class ProviderUnavailableException(Exception):
+    pass
+
+class AllKeysRateLimitedException(Exception):
+    # Read by `is_rate_limit_error`, like the 429 errors of the provider SDKs.
+    status_code = 429
+
 class QuestionBank(BaseModel):
     thoughts: str
     questions: List[str] = []
+    usage: Optional[UsageSummary] = None
 
 class Question(BaseModel):
     numerical: List[str] = []
@@ -71,6 +200,7 @@ class MultiLevelQuestionBank(BaseModel):
     easy_questions: Question = Question()
     medium_questions: Question = Question()
     hard_questions: Question = Question()
+    usage: Optional[UsageSummary] = None
 
 class Option(BaseModel):
     is_correct: bool = False
@@ -81,3 +211,37 @@ class FinalOutput(BaseModel):
     options:  List[Option]
     correct_answer: int|float|str
     thoughts: Optional[str] = None
+    stage_timings: Optional[Dict[str, float]] = None
+    solution_code: Optional[str] = None
+    provider: Optional[str] = None
+    model: Optional[str] = None
+    usage: Optional[UsageSummary] = None
+
+class SolutionTask(BaseModel):
+    question: str
+    mcq_type: MCQType = MCQType.NUMERICAL
+    topic: Optional[str] = None
+    difficulty_level: Optional[DifficultyLevel] = None
+
+class BatchSolutionResult(BaseModel):
+    index: int
+    question: str
+    output: Optional[FinalOutput] = None
+    error: Optional[str] = None
+
+class SolutionEvent(BaseModel):
+    event: str
+    stage: Optional[str] = None
+    data: Any = None
+
+class JobInfo(BaseModel):
+    id: str
+    kind: str
+    status: JobStatus
+    total_units: int = 0
+    completed_units: int = 0
+    result: Any = None
+    partial_results: List[Any] = []
+    error: Optional[str] = None
+    created_at: float
+    updated_at: float
@@ -0,0 +1,258 @@
+"""
+Span-based request tracing.
+
+A trace is started per request with `Tracer.trace()`; code anywhere below it
+opens nested spans with `span()`, which finds its parent through a context
+variable, so spans opened in tasks started by the request (stage graph stages,
+hedged attempts) nest correctly. Outside a trace `span()` does nothing.
+
+Finished traces are tail-sampled: a trace is kept if it failed, if it is
+among the slowest `slowest_fraction` of recent traces, or otherwise with
+probability `sample_rate`. Kept traces go to an in-memory ring buffer (slow
+ones to a separate one, so a burst of fast requests cannot evict them) and,
+optionally, to a rotating JSONL file.
+"""
+import os
+import time
+import uuid
+import json
+import random
+import logging
+import itertools
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from logging.handlers import RotatingFileHandler
+from typing import Any, Deque, Dict, Iterator, List, Optional
+
+
+class Span:
+    __slots__ = ("trace", "span_id", "parent_id", "name", "start", "end", "attributes", "error")
+
+    def __init__(self, trace: "Trace", span_id: int, parent_id: Optional[int], name: str, attributes: Dict[str, Any]) -> None:
+        self.trace = trace
+        self.span_id = span_id
+        self.parent_id = parent_id
+        self.name = name
+        self.start = time.perf_counter()
+        self.end: Optional[float] = None
+        self.attributes = attributes
+        self.error: Optional[str] = None
+
+    def set(self, **attributes: Any) -> None:
+        self.attributes.update(attributes)
+
+    def finish(self, error: Optional[BaseException] = None) -> None:
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"
+        self.end = time.perf_counter()
+
+    @property
+    def duration(self) -> Optional[float]:
+        return self.end - self.start if self.end is not None else None
+
+    def to_dict(self) -> Dict[str, Any]:
+        origin = self.trace.root.start
+        return {
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "offset": round(self.start - origin, 6),
+            "duration": round(self.duration, 6) if self.end is not None else None,
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+class Trace:
+    def __init__(self, name: str, attributes: Dict[str, Any]) -> None:
+        self.trace_id = uuid.uuid4().hex
+        self.started_at = time.time()
+        self._span_ids = itertools.count()
+        self.spans: List[Span] = []
+        self.root = self.new_span(name, None, attributes)
+
+    def new_span(self, name: str, parent_id: Optional[int], attributes: Dict[str, Any]) -> Span:
+        span = Span(self, next(self._span_ids), parent_id, name, attributes)
+        self.spans.append(span)
+        return span
+
+    @property
+    def duration(self) -> Optional[float]:
+        return self.root.duration
+
+    @property
+    def failed(self) -> bool:
+        """Whether the request itself failed; retried or cancelled attempts inside it do not count."""
+        return self.root.error is not None or self.root.attributes.get("status", 0) >= 500
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "name": self.root.name,
+            "started_at": self.started_at,
+            "duration": round(self.duration, 6) if self.duration is not None else None,
+            "spans": [span.to_dict() for span in list(self.spans)],
+        }
+
+    def waterfall(self, width: int = 60) -> str:
+        """Renders the spans as an indented text waterfall, one bar per span on a common time axis."""
+        spans = list(self.spans)
+        children: Dict[Optional[int], List[Span]] = {}
+        for span in spans:
+            children.setdefault(span.parent_id, []).append(span)
+        now = time.perf_counter()
+        origin = self.root.start
+        total = max(((span.end or now) - origin for span in spans), default=0.0) or 1e-9
+        lines = [f"trace {self.trace_id}  {self.root.name}  {total * 1000:.1f} ms"]
+
+        def render(span: Span, depth: int) -> None:
+            begin = int((span.start - origin) / total * width)
+            length = max(1, int(((span.end or now) - span.start) / total * width))
+            bar = " " * begin + "#" * min(length, width - begin)
+            duration = f"{span.duration * 1000:9.1f} ms" if span.end is not None else "  running"
+            label = ("  " * depth + span.name)[:40]
+            details = " ".join(f"{key}={value}" for key, value in span.attributes.items())
+            if span.error:
+                details = f"{details} error={span.error}".strip()
+            lines.append(f"{label:<40} |{bar:<{width}}| {duration}  {details}".rstrip())
+            for child in sorted(children.get(span.span_id, []), key=lambda s: s.start):
+                render(child, depth + 1)
+
+        render(self.root, 0)
+        return "\n".join(lines)
+
+
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+def start_span(name: str, **attributes: Any) -> Optional[Span]:
+    """
+    Opens a child of the current span without making it current, for work that
+    spans `yield`s of an async generator; the caller must `finish()` it.
+    Returns None outside a trace.
+    """
+    parent = _current_span.get()
+    if parent is None:
+        return None
+    return parent.trace.new_span(name, parent.span_id, attributes)
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Optional[Span]]:
+    """Records the enclosed block as a child of the current span. Yields None outside a trace."""
+    child = start_span(name, **attributes)
+    if child is None:
+        yield None
+        return
+    token = _current_span.set(child)
+    try:
+        yield child
+    except BaseException as e:
+        child.finish(e)
+        raise
+    else:
+        child.finish()
+    finally:
+        _current_span.reset(token)
+
+def record_span(name: str, start: float, end: float, **attributes: Any) -> None:
+    """Adds an already finished child of the current span, e.g. timings reported by a worker process."""
+    child = start_span(name, **attributes)
+    if child is not None:
+        child.start, child.end = start, end
+
+
+class Tracer:
+    """
+    Starts request traces and keeps the tail-sampled ones.
+
+    Args:
+        capacity (int): Sampled traces kept in memory
+        slow_capacity (int): Slow or failed traces kept in memory, separately
+        slowest_fraction (float): Fraction of traces, the slowest among the last
+            `window`, that are always kept
+        sample_rate (float): Probability of keeping any other trace
+        window (int): Recent trace durations the slowness threshold is taken from
+        path (str, optional): JSONL file kept traces are also written to
+        max_file_bytes (int): Size at which `path` is rotated
+        backup_count (int): Rotated files kept next to `path`
+    """
+    def __init__(
+        self,
+        capacity: int = 500,
+        slow_capacity: int = 100,
+        slowest_fraction: float = 0.01,
+        sample_rate: float = 1.0,
+        window: int = 1000,
+        path: Optional[str] = None,
+        max_file_bytes: int = 10 * 1024 * 1024,
+        backup_count: int = 3,
+    ) -> None:
+        self.capacity = capacity
+        self.slow_capacity = slow_capacity
+        self.slowest_fraction = slowest_fraction
+        self.sample_rate = sample_rate
+        self.random = random.Random()
+        self.durations: Deque[float] = deque(maxlen=window)
+        self.sampled: "OrderedDict[str, Trace]" = OrderedDict()
+        self.slow: "OrderedDict[str, Trace]" = OrderedDict()
+        self.logger: Optional[logging.Logger] = None
+        if path:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self.logger = logging.getLogger(f"{__name__}.{id(self)}")
+            self.logger.propagate = False
+            self.logger.setLevel(logging.INFO)
+            self.logger.addHandler(RotatingFileHandler(path, maxBytes=max_file_bytes, backupCount=backup_count))
+
+    @contextmanager
+    def trace(self, name: str, **attributes: Any) -> Iterator[Trace]:
+        """Starts a trace whose root span covers the block, and samples it when the block exits."""
+        trace = Trace(name, attributes)
+        token = _current_span.set(trace.root)
+        try:
+            yield trace
+        except BaseException as e:
+            trace.root.finish(e)
+            raise
+        else:
+            trace.root.finish()
+        finally:
+            _current_span.reset(token)
+            self._sample(trace)
+
+    def _is_slow(self, duration: float) -> bool:
+        ordered = sorted(self.durations)
+        index = min(len(ordered) - 1, int((1 - self.slowest_fraction) * len(ordered)))
+        return duration >= ordered[index]
+
+    def _sample(self, trace: Trace) -> None:
+        duration = trace.duration
+        self.durations.append(duration)
+        if trace.failed or self._is_slow(duration):
+            kept, capacity = self.slow, self.slow_capacity
+        elif self.random.random() < self.sample_rate:
+            kept, capacity = self.sampled, self.capacity
+        else:
+            return
+        kept[trace.trace_id] = trace
+        while len(kept) > capacity:
+            kept.popitem(last=False)
+        if self.logger is not None:
+            self.logger.info(json.dumps(trace.to_dict(), default=str))
+
+    def get(self, trace_id: str) -> Optional[Trace]:
+        return self.slow.get(trace_id) or self.sampled.get(trace_id)
+
+    def recent(self, limit: int = 50) -> List[Dict[str, Any]]:
+        """Summaries of the kept traces, slowest first."""
+        traces = sorted({**self.sampled, **self.slow}.values(), key=lambda t: t.duration or 0.0, reverse=True)
+        return [
+            {"trace_id": t.trace_id, "name": t.root.name, "started_at": t.started_at,
+             "duration": round(t.duration or 0.0, 6), "failed": t.failed}
+            for t in traces[:limit]
+        ]
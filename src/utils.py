@@ -1,12 +1,12 @@
 import re
 import ast
 import math
-import asyncio
+import time
 import sympy as sp
 import numpy as np
 from typing import Optional, List, Tuple
 from src.schema import SecurityException
-from concurrent.futures import ThreadPoolExecutor
+from src.xml_stream import XMLElement, parse_tags, stop_after_code
 from src.schema import SolverOutput, QuestionBank, MultiLevelQuestionBank, Question
 
 
@@ -47,184 +47,175 @@ def remove_python_comments(text):
 def remove_print_statements(text):
     return re.sub(r'print\s*\([^)]*\)', '', text)
 
+def _first_content(elements: List[XMLElement], tag: str) -> Optional[str]:
+    return next((element.content for element in elements if element.tag == tag), None)
+
+def _python_code(elements: List[XMLElement], itered: bool = False, requires: list|None = None) -> Optional[str]:
+    code = None
+    for element in elements:
+        if element.tag != 'code' or element.language.split()[:1] != ['python']:
+            continue
+        code = element.content
+        if not itered:
+            return code
+        if isinstance(requires, list):
+            if all(tag in code for tag in requires):
+                return code
+    return code
+
+def _filter_questions(questions: List[str]) -> List[str]:
+    filtered_questions = []
+    excluded_words = ['diagram', 'figure']
+    markdown_pattern = r'(!?\[([^\]]*)\]\(([^)]+)\))'
+    for question in questions:
+        has_markdown = bool(re.search(markdown_pattern, question))
+        has_excluded_words = any(word.lower() in question.lower() for word in excluded_words)
+        if not (has_markdown or has_excluded_words):
+            filtered_questions.append(question)
+    return filtered_questions
+
 def extract_xml_content(text: str, tag: str) -> Optional[str]:
     """Extract content between XML tags, excluding the tags themselves."""
-    pattern = fr'(?s)<{tag}>(.*?)</{tag}>'
-    match = re.search(pattern, text)
-    if match:
-        return match.group(1).strip()
-    return None
+    return _first_content(parse_tags(text), tag)
 
 def extract_iter_xml(text: str, tag: str) -> List[str]:
-    output = []
-    pattern = fr'<{tag}>(.*?)</{tag}>'
-    for match in re.finditer(pattern, text, re.DOTALL):
-        txt = match.group(1).strip()
-        output.append(txt)
-    return output
+    return [element.content for element in parse_tags(text) if element.tag == tag]
 
 def extract_code_snippet(text: str, itered: bool=False, requires: list|None=None):
-    if itered:
-        code_blocks = re.finditer(r'```python\s*(.*?)\s*```', text, re.DOTALL)
-        code = None
-        for match in code_blocks:
-            code = match.group(1).strip()
-            if isinstance(requires, list):
-                if all(tag in code for tag in requires):
-                    return code
-        return code
-    code_match = re.search(r'```python\s*(.*?)\s*```', text, re.DOTALL)
-    return code_match.group(1).strip() if code_match else None
+    return _python_code(parse_tags(text), itered=itered, requires=requires)
 
 def extract_from_solver(text: str) -> SolverOutput:
-    thoughts = extract_xml_content(text, 'thoughts')
-    code = extract_code_snippet(text, itered=True)
+    elements = parse_tags(text)
+    thoughts = _first_content(elements, 'thoughts')
+    code = _python_code(elements, itered=True)
     return SolverOutput(code=code, thoughts=thoughts)
 
 def extract_from_verifier(text: str) -> Tuple[bool, SolverOutput]:
-    thoughts = extract_xml_content(text, 'thoughts')
-    need_update = ast.literal_eval(str(extract_xml_content(text, 'need_update')))
-    code = extract_code_snippet(text, itered=True, requires=['solve_problem', 'actual_params'])
+    elements = parse_tags(text)
+    thoughts = _first_content(elements, 'thoughts')
+    need_update = ast.literal_eval(str(_first_content(elements, 'need_update')))
+    code = _python_code(elements, itered=True, requires=['solve_problem', 'actual_params'])
     return need_update, SolverOutput(code=code, thoughts=thoughts)
 
+_solution_code_closed = stop_after_code(['solve_problem', 'actual_params'])
+
+def verifier_complete(elements: List[XMLElement]) -> bool:
+    """Stop condition for verifier responses: the verdict, plus the corrected code if one is needed."""
+    need_update = _first_content(elements, 'need_update')
+    if need_update is None:
+        return False
+    return need_update != 'True' or _solution_code_closed(elements)
+
 def extract_distractors(text: str) -> List[str]:
     return extract_iter_xml(text, 'option')
 
 def extract_question(text: str) -> QuestionBank:
-    thoughts = extract_xml_content(text, 'thoughts')
-    questions_xml = extract_xml_content(text, 'questions')
-    if questions_xml is not None:
-        all_questions = extract_iter_xml(questions_xml, 'li')
-    else:
-        all_questions = extract_iter_xml(text, 'li')
-
-    filtered_questions = []
-    excluded_words = ['diagram', 'figure']
-    markdown_pattern = r'(!?\[([^\]]*)\]\(([^)]+)\))'
-    for question in all_questions:
-        has_markdown = bool(re.search(markdown_pattern, question))
-        has_excluded_words = any(word.lower() in question.lower() for word in excluded_words)
-        if not (has_markdown or has_excluded_words):
-            filtered_questions.append(question)
+    elements = parse_tags(text)
+    thoughts = _first_content(elements, 'thoughts')
+    items = [element for element in elements if element.tag == 'li']
+    # A repeated `<questions>` opening tag also closes the list, so this holds
+    # for the `<questions> ... <questions>` responses the extension prompt invites.
+    if any(element.tag == 'questions' for element in elements):
+        items = [element for element in items if 'questions' in element.path]
 
     return QuestionBank(
         thoughts=thoughts, 
-        questions=filtered_questions
+        questions=_filter_questions([element.content for element in items])
     )
 
 def extract_multi_level_questions(text: str) -> MultiLevelQuestionBank:
-    easy_questions = extract_xml_content(text, 'easy-questions')
-    hard_questions = extract_xml_content(text, 'hard-questions')
-    medium_questions = extract_xml_content(text, 'medium-questions')
-    
-    easy_numerical = extract_xml_content(easy_questions, 'numerical-questions')
-    easy_symbolic = extract_xml_content(easy_questions, 'symbolic-questions')
-    easy_statement = extract_xml_content(easy_questions, 'statement-questions')
-
-    medium_numerical = extract_xml_content(medium_questions, 'numerical-questions')
-    medium_symbolic = extract_xml_content(medium_questions, 'symbolic-questions')
-    medium_statement = extract_xml_content(medium_questions, 'statement-questions')
-
-    hard_numerical = extract_xml_content(hard_questions, 'numerical-questions')
-    hard_symbolic = extract_xml_content(hard_questions, 'symbolic-questions')
-    hard_statement = extract_xml_content(hard_questions, 'statement-questions')
-
-    def deduplicate(questions: List[str]):
-        filtered_questions = []
-        excluded_words = ['diagram', 'figure']
-        markdown_pattern = r'(!?\[([^\]]*)\]\(([^)]+)\))'
-        for question in questions:
-            has_markdown = bool(re.search(markdown_pattern, question))
-            has_excluded_words = any(word.lower() in question.lower() for word in excluded_words)
-            if not (has_markdown or has_excluded_words):
-                filtered_questions.append(question)
-        return filtered_questions
-
-    return MultiLevelQuestionBank(
-        easy_questions=Question(
-            symbolic=deduplicate(extract_iter_xml(easy_symbolic, "li")),
-            numerical=deduplicate(extract_iter_xml(easy_numerical, "li")),
-            statement=deduplicate(extract_iter_xml(easy_statement, "li")),
-        ),
-        medium_questions=Question(
-            symbolic=deduplicate(extract_iter_xml(medium_symbolic, "li")),
-            numerical=deduplicate(extract_iter_xml(medium_numerical, "li")),
-            statement=deduplicate(extract_iter_xml(medium_statement, "li")),
-        ),
-        hard_questions=Question(
-            symbolic=deduplicate(extract_iter_xml(hard_symbolic, "li")),
-            numerical=deduplicate(extract_iter_xml(hard_numerical, "li")),
-            statement=deduplicate(extract_iter_xml(hard_statement, "li")),
-        )
-    )
-
-async def safe_exec(code, timeout: int = 5, disallowed_names=None, disallowed_global_vars=None):
-    def analyze_ast(node, disallowed_names):
-        """
-        Recursively analyzes AST nodes to check for disallowed names and dangerous operations.
-        """
-        if isinstance(node, ast.Name):
-            if node.id in disallowed_names:
-                raise SecurityException(f"Use of disallowed name: {node.id}")
-        elif isinstance(node, ast.Import):
-            for alias in node.names:
-                if alias.name in disallowed_names:
-                    raise SecurityException(f"Import of disallowed module: {alias.name}")
-        elif isinstance(node, ast.ImportFrom):
-            if node.module in disallowed_names:
-                raise SecurityException(f"Import from disallowed module: {node.module}")
-        elif isinstance(node, (ast.Call, ast.Attribute)):
-            if isinstance(node, ast.Attribute):
-                if node.attr.startswith('__'):
-                    raise SecurityException(f"Access to dunder method not allowed: {node.attr}")
-        for child in ast.iter_child_nodes(node):
-            analyze_ast(child, disallowed_names)
-
-    def execute_code():
-        nonlocal disallowed_names, disallowed_global_vars, code
-        try:
-            if disallowed_names is None:
-                disallowed_names = {
-                    'eval', 'exec', 'compile', 'open', 'system', 'os', 
-                    'subprocess', 'sys', '__import__'
-                }
-                    
-            tree = ast.parse(code)
-            analyze_ast(tree, disallowed_names)
-            
-            local_vars = {}
-            globals_copy = globals().copy()
-                
-            if disallowed_global_vars:
-                for name in disallowed_global_vars:
-                    globals_copy.pop(name, None)
-                
-            compiled_code = compile(tree, '<string>', 'exec')
-            exec(compiled_code, globals_copy, local_vars)
-                
-            return local_vars
-                
-        except SecurityException as e:
-            print(f"Security violation: {str(e)}")
-            return None
-        except Exception as e:
-            print(f"Execution error: {str(e)}")
-            return None
-        
-    async def execute_with_timeout():
-        result = None
-        try:
-            loop = asyncio.get_event_loop()
-            thread_pool = ThreadPoolExecutor(max_workers=1)
-            future = loop.run_in_executor(thread_pool, execute_code)
-            try:
-                result = await asyncio.wait_for(future, timeout=timeout)
-            finally:
-                thread_pool.shutdown(wait=False)
-            return result
-        except asyncio.TimeoutError:
-            print(f"Code execution timed out after {timeout} seconds")
-            return None
-
-    return await execute_with_timeout()
-
+    levels = {'easy-questions': 'easy_questions', 'medium-questions': 'medium_questions', 'hard-questions': 'hard_questions'}
+    kinds = {'numerical-questions': 'numerical', 'symbolic-questions': 'symbolic', 'statement-questions': 'statement'}
+    questions = {level: {kind: [] for kind in kinds.values()} for level in levels.values()}
+    for element in parse_tags(text):
+        if element.tag != 'li':
+            continue
+        level = next((levels[tag] for tag in element.path if tag in levels), None)
+        kind = next((kinds[tag] for tag in element.path if tag in kinds), None)
+        if level is not None and kind is not None:
+            questions[level][kind].append(element.content)
+
+    return MultiLevelQuestionBank(**{
+        level: Question(**{kind: _filter_questions(items) for kind, items in kinds_questions.items()})
+        for level, kinds_questions in questions.items()
+    })
+
+DEFAULT_DISALLOWED_NAMES = {
+    'eval', 'exec', 'compile', 'open', 'system', 'os', 
+    'subprocess', 'sys', '__import__'
+}
+
+def analyze_ast(node, disallowed_names):
+    """
+    Recursively analyzes AST nodes to check for disallowed names and dangerous operations.
+    """
+    if isinstance(node, ast.Name):
+        if node.id in disallowed_names:
+            raise SecurityException(f"Use of disallowed name: {node.id}")
+    elif isinstance(node, ast.Import):
+        for alias in node.names:
+            if alias.name in disallowed_names:
+                raise SecurityException(f"Import of disallowed module: {alias.name}")
+    elif isinstance(node, ast.ImportFrom):
+        if node.module in disallowed_names:
+            raise SecurityException(f"Import from disallowed module: {node.module}")
+    elif isinstance(node, (ast.Call, ast.Attribute)):
+        if isinstance(node, ast.Attribute):
+            if node.attr.startswith('__'):
+                raise SecurityException(f"Access to dunder method not allowed: {node.attr}")
+    for child in ast.iter_child_nodes(node):
+        analyze_ast(child, disallowed_names)
+
+def normalized_code_key(code: str) -> Optional[str]:
+    """
+    Dumps the AST of `code` without comments, formatting or docstrings, so
+    solutions that only differ in those get the same key. Returns None if the
+    code does not parse.
+    """
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return None
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.Module, ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)) and node.body:
+            first = node.body[0]
+            if isinstance(first, ast.Expr) and isinstance(first.value, ast.Constant) and isinstance(first.value.value, str):
+                node.body = node.body[1:] or [ast.Pass()]
+    return ast.dump(tree, include_attributes=False)
+
+def exec_restricted(code: str, namespace: dict, disallowed_names=None) -> dict:
+    """
+    Parses and statically checks `code`, then executes it against `namespace`.
+    Returns the local variables defined by the code. Raises `SecurityException`
+    on a policy violation and lets any other execution error propagate.
+    """
+    if disallowed_names is None:
+        disallowed_names = DEFAULT_DISALLOWED_NAMES
+    tree = ast.parse(code)
+    analyze_ast(tree, disallowed_names)
+    local_vars = {}
+    exec(compile(tree, '<string>', 'exec'), namespace, local_vars)
+    return local_vars
+
+def run_solution(code: str, namespace: dict, disallowed_names=None, timings: Optional[dict] = None) -> Optional[str]:
+    """
+    Executes solver code and returns the formatted result of
+    `solve_problem(**actual_params)`. If `timings` is given, the seconds spent
+    executing the code, in `solve_problem` and in `format_result` are added to
+    it under `exec`, `solve` and `format`.
+    """
+    timings = {} if timings is None else timings
+    started = time.perf_counter()
+    local_vars = exec_restricted(code, namespace, disallowed_names)
+    timings['exec'] = time.perf_counter() - started
+    actual_params = local_vars.get('actual_params')
+    solve_function = local_vars.get('solve_problem')
+    if solve_function is None or actual_params is None:
+        raise ValueError("Solution code must define `solve_problem` and `actual_params`")
+    started = time.perf_counter()
+    result = solve_function(**actual_params)
+    timings['solve'] = time.perf_counter() - started
+    started = time.perf_counter()
+    formatted = format_result(result)
+    timings['format'] = time.perf_counter() - started
+    return formatted
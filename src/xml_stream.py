@@ -0,0 +1,194 @@
+import re
+from typing import Callable, Iterable, List, Optional, Tuple
+
+
+# Fences open at the start of a line, or anywhere when they are tagged `python`.
+_TOKEN_PATTERN = re.compile(r'<|^[ \t]*```|```(?=python\b)', re.MULTILINE)
+_TAG_PATTERN = re.compile(r'<(/?)([A-Za-z][\w\-]*)\s*>')
+_PARTIAL_TAG_PATTERN = re.compile(r'</?(?:[A-Za-z][\w\-]*\s*)?')
+_PARTIAL_FENCE_PATTERN = re.compile(r'[ \t]*`{0,2}')
+_MAX_TAG_LENGTH = 64
+# Fences the prompts use to wrap the expected tags; their content is parsed as usual.
+_MARKUP_LANGUAGES = {'', 'xml', 'html'}
+
+
+class XMLElement:
+    """A closed element: its tag, stripped inner text and the tags enclosing it (outermost first)."""
+    def __init__(self, tag: str, content: str, path: Tuple[str, ...] = (), language: Optional[str] = None) -> None:
+        self.tag = tag
+        self.content = content
+        self.path = path
+        self.language = language
+
+    def __repr__(self) -> str:
+        return f"XMLElement(tag={self.tag!r}, path={self.path!r}, content={self.content[:40]!r})"
+
+
+class _OpenTag:
+    def __init__(self, tag: str, start: int) -> None:
+        self.tag = tag
+        self.start = start
+        self.has_children = False
+
+
+class StreamingTagParser:
+    """
+    Single-pass, incremental parser for the tag-structured output of the LLMs.
+
+    Feed it the response text in chunks (e.g. the deltas of `LLMConnector.stream`);
+    `feed()` returns every element that closed within the text seen so far, so
+    `<li>`, `<option>` or `<thoughts>` items are available as soon as their
+    closing tag arrives. Fenced code blocks are reported as elements with tag
+    `code` and their fence's `language`; tags inside them are not parsed. Bare,
+    `xml` and `html` fences are only markup around tags and are looked through.
+
+    The parser is lenient with the mistakes LLMs make: text that only looks like
+    a tag (`a < b`) is kept as text, unmatched closing tags are ignored, and an
+    opening tag repeated while the same tag is still open closes it. That covers
+    `<questions> ... <questions>` written instead of `</questions>`; for a leaf
+    element such as `<li>` a new element is started as well.
+    """
+    def __init__(self) -> None:
+        self._buffer = ""
+        self._pos = 0
+        self._stack: List[_OpenTag] = []
+        self._fence: Optional[Tuple[str, int]] = None
+        self._in_markup_fence = False
+        self._events: List[XMLElement] = []
+
+    @property
+    def text(self) -> str:
+        return self._buffer
+
+    def feed(self, chunk: str) -> List[XMLElement]:
+        """Adds `chunk` and returns the elements it completed."""
+        self._buffer += chunk
+        self._scan(final=False)
+        return self._take_events()
+
+    def close(self) -> List[XMLElement]:
+        """Processes any text held back at the end of the input. Unclosed elements are dropped."""
+        self._scan(final=True)
+        return self._take_events()
+
+    def _take_events(self) -> List[XMLElement]:
+        events, self._events = self._events, []
+        return events
+
+    def _path(self) -> Tuple[str, ...]:
+        return tuple(open_tag.tag for open_tag in self._stack)
+
+    def _scan(self, final: bool) -> None:
+        buffer = self._buffer
+        while True:
+            if self._fence is not None:
+                if not self._scan_fence(final):
+                    return
+                continue
+
+            match = _TOKEN_PATTERN.search(buffer, self._pos)
+            if match is None:
+                if final:
+                    self._pos = len(buffer)
+                    return
+                # Hold back a tail that may still become a fence.
+                line_start = max(buffer.rfind('\n', self._pos) + 1, self._pos)
+                if _PARTIAL_FENCE_PATTERN.fullmatch(buffer, line_start):
+                    self._pos = line_start
+                else:
+                    self._pos = max(self._pos, len(buffer) - len('```pytho'))
+                return
+
+            if match.group() == '<':
+                start = match.start()
+                tag = _TAG_PATTERN.match(buffer, start)
+                if tag is not None:
+                    self._pos = tag.end()
+                    if tag.group(1):
+                        self._close_tag(tag.group(2), start)
+                    else:
+                        self._open_tag(tag.group(2), start, tag.end())
+                elif (
+                    not final and len(buffer) - start < _MAX_TAG_LENGTH
+                    and _PARTIAL_TAG_PATTERN.fullmatch(buffer, start)
+                ):
+                    self._pos = start
+                    return
+                else:
+                    self._pos = start + 1
+                continue
+
+            if self._in_markup_fence:
+                self._in_markup_fence = False
+                self._pos = match.end()
+                continue
+            newline = buffer.find('\n', match.end())
+            if newline == -1:
+                self._pos = match.start() if not final else len(buffer)
+                return
+            language = buffer[match.end():newline].strip()
+            if language.lower() in _MARKUP_LANGUAGES:
+                self._in_markup_fence = True
+            else:
+                self._fence = (language, newline + 1)
+            self._pos = newline + 1
+
+    def _scan_fence(self, final: bool) -> bool:
+        language, start = self._fence
+        end = self._buffer.find('```', self._pos)
+        if end == -1:
+            self._pos = len(self._buffer) if final else max(self._pos, len(self._buffer) - 2)
+            return False
+        self._events.append(XMLElement('code', self._buffer[start:end].strip(), self._path(), language))
+        self._fence = None
+        self._pos = end + 3
+        return True
+
+    def _open_tag(self, tag: str, start: int, end: int) -> None:
+        if any(open_tag.tag == tag for open_tag in self._stack):
+            closed = self._close_tag(tag, start)
+            if closed.has_children:
+                return
+        if self._stack:
+            self._stack[-1].has_children = True
+        self._stack.append(_OpenTag(tag, end))
+
+    def _close_tag(self, tag: str, start: int) -> Optional[_OpenTag]:
+        for index in range(len(self._stack) - 1, -1, -1):
+            if self._stack[index].tag == tag:
+                break
+        else:
+            return None
+        # Elements still open inside it were never closed and are dropped.
+        open_tag = self._stack[index]
+        del self._stack[index:]
+        self._events.append(XMLElement(tag, self._buffer[open_tag.start:start].strip(), self._path()))
+        return open_tag
+
+
+def parse_tags(text: Optional[str]) -> List[XMLElement]:
+    """Parses a complete response in one pass and returns its elements in closing order."""
+    if not text:
+        return []
+    parser = StreamingTagParser()
+    return parser.feed(text) + parser.close()
+
+
+def stop_after(*tags: str, count: int = 1) -> Callable[[List[XMLElement]], bool]:
+    """Stop condition that holds once `count` elements of each of `tags` have closed."""
+    def condition(elements: List[XMLElement]) -> bool:
+        return all(sum(element.tag == tag for element in elements) >= count for tag in tags)
+    condition.__name__ = f"stop_after({', '.join(tags)}, count={count})"
+    return condition
+
+def stop_after_code(requires: Iterable[str] = ()) -> Callable[[List[XMLElement]], bool]:
+    """Stop condition that holds once a python code block containing all of `requires` has closed."""
+    requires = list(requires)
+    def condition(elements: List[XMLElement]) -> bool:
+        return any(
+            element.tag == 'code' and element.language.split()[:1] == ['python']
+            and all(name in element.content for name in requires)
+            for element in elements
+        )
+    condition.__name__ = f"stop_after_code({', '.join(requires)})"
+    return condition
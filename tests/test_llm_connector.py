@@ -0,0 +1,29 @@
+import math
+from types import SimpleNamespace
+from src.llm_connector import usage_from_response
+from src.schema import ModelPricing
+
+
+def test_openai_cached_tokens_are_not_counted_twice():
+    usage = usage_from_response(SimpleNamespace(
+        prompt_tokens=1000,
+        completion_tokens=200,
+        prompt_tokens_details=SimpleNamespace(cached_tokens=600),
+    ))
+    assert usage.input_tokens == 400
+    assert usage.cache_read_input_tokens == 600
+    assert usage.output_tokens == 200
+    pricing = ModelPricing(input=1.0, output=2.0, cache_read=0.1)
+    assert math.isclose(pricing.cost(usage), (400 * 1.0 + 200 * 2.0 + 600 * 0.1) / 1_000_000)
+
+
+def test_openai_usage_without_details():
+    usage = usage_from_response(SimpleNamespace(prompt_tokens=50, completion_tokens=5, prompt_tokens_details=None))
+    assert (usage.input_tokens, usage.output_tokens, usage.cache_read_input_tokens) == (50, 5, 0)
+
+
+def test_anthropic_usage():
+    usage = usage_from_response(SimpleNamespace(
+        input_tokens=30, output_tokens=10, cache_read_input_tokens=500, cache_creation_input_tokens=20,
+    ))
+    assert (usage.input_tokens, usage.cache_read_input_tokens, usage.cache_creation_input_tokens) == (30, 500, 20)